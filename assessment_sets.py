@@ -0,0 +1,133 @@
+"""Assessment datasets and their per-year column schemas, compiled once from wa-ed-config.json.
+
+The data in the annual assessment datasets is essentially unchanged from year to year, but OSPI
+likes to rename the columns. Each entry in "assessment_sets" can override the default column
+names in "assessment_schema" with its own "schema" (and a "grade_offset" for 2020-21, which was
+tested in the fall, so students are listed a grade older than usual). At startup every year is
+compiled into its scores and grid query templates, so building a query on each call is just
+filling in the filters, and adding a new year only needs a new config entry."""
+import functools
+
+DEFAULT_SCHEMA = {
+    "met_standard_column": "count_consistent_grade_level",
+    "total_students_column": "count_of_students_expected",
+    "dat_column": "DAT",
+    "grade_offset": 0
+}
+
+# Student groups that the data sometimes names differently, e.g. {"TwoorMoreRaces": "Two Or More Races"}.
+DEFAULT_STUDENT_GROUP_ALIASES = {"TwoorMoreRaces": "Two Or More Races"}
+
+class AssessmentSet:
+    """One year's assessment dataset: its view URL, column schema and compiled scores query template."""
+    __slots__ = ("year", "url", "met_standard_column", "total_students_column", "dat_column", "grade_offset", "schema_key", "_template", "_grid_template")
+
+    def __init__(self, year: int, url: str, schema: dict):
+        self.year = year
+        self.url = url
+        self.met_standard_column = schema["met_standard_column"]
+        self.total_students_column = schema["total_students_column"]
+        self.dat_column = schema["dat_column"]
+        self.grade_offset = schema["grade_offset"]
+        # Years with the same view and the same schema can be fetched with a single query.
+        self.schema_key = (url, self.met_standard_column, self.total_students_column, self.dat_column, self.grade_offset)
+        self._template = f"""SELECT
+  `schoolyear`,
+  `organizationlevel`,
+  `districtcode`,
+  `districtname`,
+  `studentgroup`,
+  `studentgrouptype`,
+  `gradelevel`,
+  `testadministration`,
+  `testsubject`,
+  `{self.met_standard_column}` AS `count_consistent_grade_level`,
+  `{self.total_students_column}` AS `count_of_students_expected`,
+  `{self.dat_column}` AS `DAT`
+WHERE
+  caseless_eq(`organizationlevel`, "District")
+  AND caseless_eq(`gradelevel`, "{{grade_level}}")
+  AND caseless_one_of(`testadministration`, "{{tests}}")
+  AND caseless_one_of(`testsubject`, "{{subject}}"){{district_filter}}
+  AND caseless_one_of(`studentgroup`, "{{student_groups}}")
+  AND caseless_one_of(`schoolyear`, "{{school_years}}")
+    """
+
+        # Student counts are text columns where suppressed counts are "NULL", so they're treated as
+        # 0 and cast to numbers before the portal sums them across tests.
+        self._grid_template = f"""SELECT
+  `districtcode`,
+  `studentgroup`,
+  `testsubject`,
+  `gradelevel`,
+  sum(case(caseless_eq(`{self.met_standard_column}`, "NULL"), 0, true, `{self.met_standard_column}`::number)) AS `count_consistent_grade_level`,
+  sum(case(caseless_eq(`{self.total_students_column}`, "NULL"), 0, true, `{self.total_students_column}`::number)) AS `count_of_students_expected`
+WHERE
+  caseless_eq(`organizationlevel`, "District")
+  AND caseless_one_of(`gradelevel`, "{{grade_levels}}")
+  AND caseless_one_of(`testadministration`, "{{tests}}")
+  AND caseless_one_of(`testsubject`, "{{subjects}}"){{district_filter}}
+  AND caseless_one_of(`studentgroup`, "{{student_groups}}")
+  AND caseless_eq(`schoolyear`, "{{school_year}}")
+GROUP BY `districtcode`, `studentgroup`, `testsubject`, `gradelevel`
+    """
+
+    def build_query(self, school_years: str, district_filter: str, tests: str, subject: str, grade: int, student_groups: str) -> str:
+        """Fill in the scores query template. List arguments are already joined for caseless_one_of."""
+        return self._template.format(
+            grade_level=f"{grade + self.grade_offset:02d}",
+            tests=tests,
+            subject=subject,
+            district_filter=district_filter,
+            student_groups=student_groups,
+            school_years=school_years
+        )
+
+    def build_grid_query(self, school_year: str, district_filter: str, tests: str, subjects: str, grades: list, student_groups: str) -> str:
+        """Fill in the grid query template, which sums student counts across tests for every district,
+        student group, subject and grade. List arguments (other than grades) are already joined for caseless_one_of."""
+        return self._grid_template.format(
+            grade_levels='","'.join(f"{grade + self.grade_offset:02d}" for grade in grades),
+            tests=tests,
+            subjects=subjects,
+            district_filter=district_filter,
+            student_groups=student_groups,
+            school_year=school_year
+        )
+
+def compile_assessment_sets(config: dict) -> dict:
+    """Compile the configured assessment sets into a dict of year -> AssessmentSet, in config order."""
+    default_schema = {**DEFAULT_SCHEMA, **config.get("assessment_schema", {})}
+    return {
+        assessment_set["year"]: AssessmentSet(assessment_set["year"], assessment_set["url"], {**default_schema, **assessment_set.get("schema", {})})
+        for assessment_set in config.get("assessment_sets", [])
+    }
+
+class StudentGroupAliases:
+    """Compiled student group aliases: expands requested groups for queries and normalizes names in rows."""
+
+    def __init__(self, aliases: dict):
+        # Data name -> name used in tool output.
+        self.normalized_names = dict(aliases)
+        # Every spelling of an aliased group, keyed by each spelling in lower case.
+        spellings = {}
+        for data_name, output_name in aliases.items():
+            names = spellings.setdefault(output_name.lower(), [])
+            names.extend(name for name in (data_name, output_name) if name not in names)
+            spellings[data_name.lower()] = names
+        self._spellings = spellings
+
+    @functools.lru_cache(maxsize=256)
+    def query_list(self, student_groups: tuple) -> str:
+        """Join requested student groups for caseless_one_of, adding every spelling of aliased groups."""
+        expanded = list(student_groups)
+        added = set()
+        for student_group in student_groups:
+            spellings = self._spellings.get(student_group.lower())
+            if spellings and spellings[0] not in added:
+                expanded.extend(spellings)
+                added.add(spellings[0])
+        return '","'.join(expanded)
+
+def compile_student_group_aliases(config: dict) -> StudentGroupAliases:
+    return StudentGroupAliases(config.get("student_group_aliases", DEFAULT_STUDENT_GROUP_ALIASES))
@@ -0,0 +1,77 @@
+"""Run the blocking tool implementations without blocking the MCP server's event loop.
+
+Every tool is written as a plain function that blocks on portal requests, which is what the
+precompute job and the benchmarks call directly. When a tool is registered with the server it's
+wrapped in an async function that runs it in a worker thread instead, so under an HTTP transport
+one slow portal call doesn't hold up every other client. Worker threads are shared through one
+capacity limit, each call has a deadline, and a call that is cancelled (because the client
+aborted the request or the deadline passed) stops at its next portal query. A cancelled call's
+thread keeps its place in the capacity limit until it has actually stopped, so the limit bounds
+the number of live threads, not just the calls still being waited on. Tools that only look
+things up in memory are marked @nonblocking and run directly on the event loop, so they never
+wait behind slow calls for a worker thread."""
+import functools
+import math
+import threading
+
+import anyio
+import anyio.from_thread
+import anyio.to_thread
+
+from utils import cancellation_scope
+
+def nonblocking(function):
+    """Mark a tool that never blocks (no portal queries or disk access), so it's called directly on the event loop."""
+    function.nonblocking = True
+    return function
+
+def make_async_tool(function, limiter: anyio.CapacityLimiter, timeout_seconds: float = None):
+    """Wrap a blocking tool function in an async function that runs it in a worker thread.
+
+    The wrapper keeps the function's name, docstring and signature, so it registers as the same tool.
+    If the call runs past timeout_seconds it returns an error dict instead of a result."""
+    # Threads are limited by the limiter passed in, held until each thread exits, so anyio's own
+    # default thread limit shouldn't cap them as well.
+    thread_limiter = anyio.CapacityLimiter(math.inf)
+
+    @functools.wraps(function)
+    async def async_tool(*args, **kwargs):
+        borrower = object()
+        state = {"acquired": False, "started": False, "caller_done": False}
+        state_lock = threading.Lock()
+
+        def release():
+            # Runs on the event loop: from the thread once it's done, or from the caller if the thread never started.
+            limiter.release_on_behalf_of(borrower)
+
+        def run():
+            with state_lock:
+                if state["caller_done"]:
+                    return None
+                state["started"] = True
+            try:
+                return function(*args, **kwargs)
+            finally:
+                try:
+                    anyio.from_thread.run_sync(release)
+                except RuntimeError:
+                    pass # the event loop has shut down, and the limiter with it
+
+        with cancellation_scope() as cancelled:
+            try:
+                with anyio.fail_after(timeout_seconds):
+                    await limiter.acquire_on_behalf_of(borrower)
+                    state["acquired"] = True
+                    # Abandon the thread on cancellation rather than waiting for it; the cancellation
+                    # flag makes it give up at its next query, so it doesn't keep the portal busy.
+                    return await anyio.to_thread.run_sync(run, abandon_on_cancel=True, limiter=thread_limiter)
+            except TimeoutError:
+                return {"error": f"{function.__name__} did not finish within {timeout_seconds} seconds"}
+            finally:
+                cancelled.set()
+                with state_lock:
+                    never_started = not state["started"]
+                    state["caller_done"] = True
+                if state["acquired"] and never_started:
+                    release()
+    return async_tool
@@ -0,0 +1,96 @@
+"""Concurrency test: many simultaneous clients calling tools on one server.
+
+Fires a burst of concurrent tool calls at the server's tool manager, the same way the MCP request
+handlers do under an HTTP transport: mostly analyze_trends calls (several portal queries each) with
+quick get_district_name/list_multidistrict_sets calls mixed in. Portal queries are answered from
+synthetic data (needs duckdb) with a simulated network latency. The same burst is run against a
+plain FastMCP server with the tools registered as blocking functions, for comparison. Finally, one
+slow call is cancelled part-way through to check that it stops sending queries.
+
+Usage: python benchmarks/bench_concurrency.py [--clients 24] [--latency-ms 200]"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import anyio
+
+import utils
+
+# Every call should do its full work, so keep the response cache and precomputed results out of it.
+utils.load_config().setdefault("response_cache", {})["enabled"] = False
+utils.load_config().setdefault("precompute", {})["enabled"] = False
+
+import server
+from mcp.server.fastmcp import FastMCP
+from transports import CountingTransport, SyntheticTransport
+
+SUBJECTS = ["ELA", "Math"]
+GRADES = [3, 4, 5, 6, 7, 8, 10]
+
+def get_calls(clients: int) -> list:
+    """The (tool name, arguments) for each client: every fourth client makes a quick call."""
+    calls = []
+    for i in range(clients):
+        if i % 4 == 3:
+            calls.append(("get_district_name", {}) if i % 8 == 3 else ("list_multidistrict_sets", {}))
+        else:
+            # Distinct subject/grade pairs, so no two slow calls share (and coalesce) their queries.
+            subject = SUBJECTS[(i // len(GRADES)) % len(SUBJECTS)]
+            calls.append(("analyze_trends", {"multidistrict_set_id": "MEDIUM", "subject": subject, "grade": GRADES[i % len(GRADES)], "yearspan": 6}))
+    return calls
+
+def make_blocking_server() -> FastMCP:
+    """A server with the same tools registered as plain blocking functions."""
+    blocking = FastMCP("Blocking")
+    for function in [server.analyze_trends, server.get_district_name, server.list_multidistrict_sets]:
+        blocking.add_tool(function)
+    return blocking
+
+async def run_burst(mcp: FastMCP, calls: list) -> list:
+    """Start every call at once and return (tool name, latency) for each."""
+    latencies = []
+    start = time.perf_counter()
+
+    async def call(name, arguments):
+        await mcp.call_tool(name, arguments)
+        latencies.append((name, time.perf_counter() - start))
+
+    async with anyio.create_task_group() as tasks:
+        for name, arguments in calls:
+            tasks.start_soon(call, name, arguments)
+    return latencies
+
+def report(label: str, latencies: list):
+    fast = sorted(latency for name, latency in latencies if name != "analyze_trends")
+    slow = sorted(latency for name, latency in latencies if name == "analyze_trends")
+    print(f"  {label:<9} {max(fast) * 1000:>14.0f} {fast[len(fast) // 2] * 1000:>15.0f} {max(slow) * 1000:>14.0f} {max(fast + slow) * 1000:>9.0f}")
+
+async def run_cancellation(counter: CountingTransport, latency_seconds: float):
+    """Cancel a ten-year analyze_trends call while its first queries are in flight, and count how many it sends."""
+    counter.reset()
+    with anyio.move_on_after(latency_seconds / 2):
+        await server.mcp.call_tool("analyze_trends", {"multidistrict_set_id": "DEFAULT", "subject": "Math", "grade": 6, "yearspan": 10})
+    # Give any abandoned worker threads time to finish (or give up).
+    await anyio.sleep(latency_seconds * 4)
+    print(f"\nCancelled call: sent {counter.queries} of the 5 queries a full call makes "
+          f"({server.MAX_CONCURRENT_QUERIES} run at once)")
+
+async def main(args):
+    counter = CountingTransport(SyntheticTransport(server.DISTRICTS), args.latency_ms / 1000)
+    utils.set_query_transport(counter)
+    calls = get_calls(args.clients)
+
+    print(f"{len(calls)} simultaneous calls, {args.latency_ms:.0f} ms per portal query")
+    print(f"  {'server':<9} {'max quick (ms)':>14} {'p50 quick (ms)':>15} {'max slow (ms)':>14} {'all (ms)':>9}")
+    report("blocking", await run_burst(make_blocking_server(), calls))
+    report("async", await run_burst(server.mcp, calls))
+    await run_cancellation(counter, args.latency_ms / 1000)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=24)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    anyio.run(main, parser.parse_args())
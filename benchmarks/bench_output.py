@@ -0,0 +1,80 @@
+"""Benchmark of the full and compact output formats of the tools with large results.
+
+Calls analyze_trends, get_district_score_grid, get_enrollment_for_grad_cohort and
+compare_cohort_retention once each on synthetic statewide data (every district in
+Districts.xml), then reports the size of the JSON the server would send for each result and the
+time to produce it: the full result serialized as FastMCP does (indented), output_format="compact",
+and compact with fields and limit. Needs duckdb; no network access is needed.
+
+Usage: python benchmarks/bench_output.py [--runs 20]"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pydantic_core
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import utils
+
+utils.load_config().setdefault("response_cache", {})["enabled"] = False
+utils.load_config().setdefault("precompute", {})["enabled"] = False
+utils.load_config().setdefault("catalog", {})["path"] = os.path.join(tempfile.mkdtemp(), "catalog.json")
+
+import enrollment_tools
+import server
+from output_formats import shaped_output, with_output_options
+from transports import SyntheticTransport
+
+STUDENT_GROUPS = ["All Students", "Low-Income", "Hispanic/ Latino of any race(s)", "White"]
+
+def get_tool_calls(district_ids: list) -> list:
+    """The (name, tool function, arguments, fields) to benchmark, with the fields a caller might project to."""
+    return [
+        ("analyze_trends", server.analyze_trends, {"multidistrict_set_id": server.STATEWIDE_SET_ID, "student_groups": STUDENT_GROUPS},
+         ["district_id", "percent_consistent_grade_level", "rank"]),
+        ("get_district_score_grid", server.get_district_score_grid, {"district_ids": district_ids, "student_groups": STUDENT_GROUPS[:2]},
+         ["district_id", "student_group", "scores"]),
+        ("get_enrollment_for_grad_cohort", enrollment_tools.get_enrollment_for_grad_cohort,
+         {"grad_cohorts": [2028, 2030], "district_ids": district_ids, "student_groups": ["All Students", "Low Income"]},
+         ["schoolyear", "all_students_enrollment", "all_students_progression_ratio"]),
+        ("compare_cohort_retention", enrollment_tools.compare_cohort_retention,
+         {"grad_cohorts": [2028, 2030], "district_ids": district_ids, "student_groups": ["All Students", "Low Income"]},
+         ["district_id", "retention_ratio", "rank"])
+    ]
+
+def measure(encode, runs: int) -> tuple:
+    """The median time of encode() in ms, and the size of what it returns in bytes."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        text = encode()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2] * 1000, len(text.encode("utf-8") if isinstance(text, str) else text)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    utils.set_query_transport(SyntheticTransport(server.DISTRICTS))
+    district_ids = list(server.DISTRICTS.keys())
+    print(f"Statewide results for {len(district_ids)} districts, median of {args.runs} runs")
+    print(f"  {'':<34} {'format':<20} {'ms':>8} {'KB':>9} {'vs full':>8}")
+    for name, function, arguments, fields in get_tool_calls(district_ids):
+        result = function(**arguments)
+        # Wrap a function that returns the result already computed, so only shaping and serialization are timed.
+        shaped = with_output_options(shaped_output(lambda: result, compact_drop=function.compact_drop))
+        variants = [
+            ("full", lambda: pydantic_core.to_json(result, fallback=str, indent=2)),
+            ("compact", lambda: shaped(output_format="compact")),
+            ("compact, fields", lambda: shaped(output_format="compact", fields=fields)),
+            ("compact, fields, 10", lambda: shaped(output_format="compact", fields=fields, limit=10))
+        ]
+        full_size = None
+        for label, encode in variants:
+            elapsed, size = measure(encode, args.runs)
+            full_size = full_size or size
+            print(f"  {name:<34} {label:<20} {elapsed:>8.2f} {size / 1024:>9.1f} {size / full_size:>7.0%}")
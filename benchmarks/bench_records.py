@@ -0,0 +1,148 @@
+"""Benchmark of the typed score records against the original string-valued dict rows.
+
+Builds a statewide scores response (every district in Districts.xml, ten student groups, two
+tests, four years) as the portal would return it, then runs it through the original dict
+pipeline (int() parsing during aggregation, a dict copy per ranked record) and through the
+typed pipeline (records.parse_score_rows, then aggregation and ranking on ScoreRow/ScoreResult).
+Reports the CPU time and peak allocations of everything after JSON decoding, and the memory
+held by the decoded rows (string dicts) versus the parsed ScoreRows. No network access is needed.
+
+Usage: python benchmarks/bench_records.py"""
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import server
+from records import parse_score_rows
+from synthetic import STUDENT_GROUPS, load_district_ids
+
+YEARS = [2022, 2023, 2024, 2025]
+TESTS = ["SBAC", "AIM"]
+
+def make_portal_body(district_ids: list, student_groups: list) -> bytes:
+    """A scores query response for every district, as the JSON bytes the portal would send."""
+    rows = []
+    for year in YEARS:
+        for district_id in district_ids:
+            for student_group in student_groups:
+                for test in TESTS:
+                    total = 20 + hash((year, district_id, student_group, test)) % 2000
+                    rows.append({
+                        "schoolyear": server.get_school_year(year),
+                        "organizationlevel": "District",
+                        "districtcode": district_id,
+                        "districtname": server.DISTRICTS.get(district_id, ""),
+                        "studentgroup": student_group,
+                        "studentgrouptype": "All",
+                        "gradelevel": "03",
+                        "testadministration": test,
+                        "testsubject": "ELA",
+                        "count_consistent_grade_level": str(total // 2) if test == "SBAC" else "NULL",
+                        "count_of_students_expected": str(total),
+                        "DAT": "None"
+                    })
+    return json.dumps(rows).encode()
+
+def dict_aggregate(response: list) -> list:
+    """The original aggregation: sum string counts straight out of the portal dicts."""
+    aggregated_scores = {}
+    for record in response:
+        studentgroup = record.get("studentgroup")
+        if studentgroup == "TwoorMoreRaces":
+            studentgroup = "Two Or More Races"
+        result = aggregated_scores.setdefault(studentgroup, {}).setdefault(record.get("districtcode"), {"total_students": 0, "consistent_grade_level": 0})
+        total_str = record.get("count_of_students_expected", "0")
+        consistent_str = record.get("count_consistent_grade_level", "0")
+        result["total_students"] += int(total_str if total_str != "NULL" else "0")
+        result["consistent_grade_level"] += int(consistent_str if consistent_str != "NULL" else "0")
+
+    results = []
+    for studentgroup, districts in aggregated_scores.items():
+        for district_id, result_data in districts.items():
+            percent = None
+            if result_data["total_students"] > 0:
+                percent = round(result_data["consistent_grade_level"] / result_data["total_students"] * 100, 2)
+            results.append({
+                "student_group": studentgroup,
+                "district_id": district_id,
+                "total_students": result_data["total_students"],
+                "consistent_grade_level": result_data["consistent_grade_level"],
+                "percent_consistent_grade_level": percent
+            })
+    return results
+
+def dict_rankings(data: list, student_group: str) -> list:
+    """The original ranking: copy each matching dict, sort, then add ranks."""
+    records = [record.copy() for record in data if record.get("student_group") == student_group]
+    records.sort(key=lambda x: (x.get("percent_consistent_grade_level") is not None, x.get("percent_consistent_grade_level")), reverse=True)
+    for rank, record in enumerate(records, start=1):
+        record["rank"] = rank
+        record.pop("student_group", None)
+    return records
+
+def split_by_year(rows: list, school_year) -> dict:
+    rows_by_year = {server.get_school_year(year).lower(): [] for year in YEARS}
+    for row in rows:
+        rows_by_year[school_year(row)].append(row)
+    return rows_by_year
+
+def dict_pipeline(response: list, student_groups: list):
+    for year_rows in split_by_year(response, lambda row: row["schoolyear"].lower()).values():
+        data = dict_aggregate(year_rows)
+        for student_group in student_groups:
+            dict_rankings(data, student_group)
+
+def typed_pipeline(response: list, student_groups: list):
+    rows_by_year = split_by_year(parse_score_rows(response), lambda row: row.school_year)
+    for year in YEARS:
+        year_scores = {"year": year, "data": server.aggregate_scores(rows_by_year[server.get_school_year(year).lower()])["results"]}
+        for student_group in student_groups:
+            server.get_district_rankings(year_scores, student_group)
+
+def best_time(function, *args, repeat: int = 5) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def held_memory(build) -> int:
+    """Bytes still allocated by the object build() returns."""
+    gc.collect()
+    tracemalloc.start()
+    held = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return current
+
+def peak_memory(function, *args) -> int:
+    gc.collect()
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+if __name__ == "__main__":
+    student_groups = STUDENT_GROUPS[:10]
+    district_ids = load_district_ids()
+    body = make_portal_body(district_ids, student_groups)
+    response = json.loads(body)
+    print(f"Statewide response: {len(district_ids)} districts, {len(response)} rows, {len(body) / 1024 / 1024:.1f} MB of JSON")
+
+    results = [
+        ("dict rows", best_time(dict_pipeline, response, student_groups), held_memory(lambda: json.loads(body)), peak_memory(dict_pipeline, response, student_groups)),
+        ("typed rows", best_time(typed_pipeline, response, student_groups), held_memory(lambda: parse_score_rows(json.loads(body))), peak_memory(typed_pipeline, response, student_groups))
+    ]
+    print(f"  {'':<12} {'CPU ms':>8} {'rows MB':>9} {'peak MB':>9}")
+    for name, elapsed, held, peak in results:
+        print(f"  {name:<12} {elapsed * 1000:>8.1f} {held / 1024 / 1024:>9.1f} {peak / 1024 / 1024:>9.1f}")
@@ -0,0 +1,65 @@
+"""Startup benchmark: time from launching server.py to the first tool response over stdio.
+
+Spawns the server the same way an MCP client does, sends initialize, then calls a tool that
+needs no network access, and reports the time to the initialize response and to the first
+tool response.
+
+Usage: python benchmarks/bench_startup.py [--runs 10] [--tool list_multidistrict_sets]"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SERVER = os.path.join(os.path.dirname(__file__), "..", "server.py")
+
+def send(process, message: dict):
+    process.stdin.write((json.dumps(message) + "\n").encode("utf-8"))
+    process.stdin.flush()
+
+def read_response(process, request_id: int) -> dict:
+    """Read messages until the response to request_id arrives (skipping notifications)."""
+    while True:
+        line = process.stdout.readline()
+        if not line:
+            raise RuntimeError("Server exited before responding")
+        message = json.loads(line)
+        if message.get("id") == request_id:
+            return message
+
+def measure(tool: str, arguments: dict) -> tuple:
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, SERVER], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        send(process, {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {
+            "protocolVersion": "2025-06-18", "capabilities": {}, "clientInfo": {"name": "bench_startup", "version": "1.0"}}})
+        read_response(process, 1)
+        initialized = time.perf_counter() - start
+
+        send(process, {"jsonrpc": "2.0", "method": "notifications/initialized"})
+        send(process, {"jsonrpc": "2.0", "id": 2, "method": "tools/call", "params": {"name": tool, "arguments": arguments}})
+        response = read_response(process, 2)
+        first_response = time.perf_counter() - start
+        if "error" in response or response.get("result", {}).get("isError"):
+            raise RuntimeError(f"Tool call failed: {response}")
+    finally:
+        process.kill()
+        process.wait()
+    return initialized, first_response
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--tool", default="list_multidistrict_sets")
+    parser.add_argument("--arguments", default="{}", help="Tool arguments as JSON")
+    args = parser.parse_args()
+
+    # The first launch also compiles bytecode and the district table, so report it separately.
+    cold_initialized, cold_response = measure(args.tool, json.loads(args.arguments))
+    runs = [measure(args.tool, json.loads(args.arguments)) for _ in range(args.runs)]
+
+    print(f"first launch: initialize {cold_initialized * 1000:.0f} ms, first tool response {cold_response * 1000:.0f} ms")
+    for label, values in (("initialize", [r[0] for r in runs]), ("first tool response", [r[1] for r in runs])):
+        print(f"{label}: median {statistics.median(values) * 1000:.0f} ms, min {min(values) * 1000:.0f} ms, max {max(values) * 1000:.0f} ms ({args.runs} runs)")
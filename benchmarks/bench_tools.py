@@ -0,0 +1,145 @@
+"""Offline benchmark of the MCP tools, using recorded or synthetic portal responses.
+
+Times get_district_scores, get_district_score_grid (against the get_district_scores calls it
+replaces, one per subject and grade), analyze_trends, get_enrollment_for_grad_cohort,
+compare_cohort_retention and list_available_tests for the SMALL, MEDIUM and DEFAULT
+multidistrict sets plus a synthetic statewide set, and reports latency percentiles, peak
+Python allocations and the number of portal queries (and response bytes) per call. The
+response cache is disabled so every call does its full work.
+
+Modes:
+  synthetic  Generated data for every district in Districts.xml (needs duckdb). The default.
+  record     Run against the live portal once, saving every response to --recordings.
+  replay     Answer every query from --recordings. Sets without recordings report an error.
+
+Usage: python benchmarks/bench_tools.py [--mode synthetic] [--runs 20] [--latency-ms 0]"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import utils
+
+# Benchmarks measure the full work of each call, so keep the on-disk response cache and
+# precomputed results out of it.
+utils.load_config().setdefault("response_cache", {})["enabled"] = False
+utils.load_config().setdefault("precompute", {})["enabled"] = False
+# The catalog is still used, but kept apart from the real one, since it's filled from synthetic data.
+utils.load_config().setdefault("catalog", {})["path"] = os.path.join(tempfile.mkdtemp(), "catalog.json")
+
+import enrollment_tools
+import server
+from transports import CountingTransport, RecordingTransport, ReplayTransport, SyntheticTransport, DEFAULT_RECORDINGS_DIR
+
+STATEWIDE_SET_ID = server.STATEWIDE_SET_ID
+# The subject/grade pairs OSPI tests, as fetched by get_district_score_grid in one call.
+GRID_SUBJECTS = ["ELA", "Math", "Science"]
+GRID_GRADES = [3, 4, 5, 6, 7, 8, 10, 11]
+GRID_PAIRS = [(subject, grade) for subject in ["ELA", "Math"] for grade in [3, 4, 5, 6, 7, 8, 10]] + [("Science", grade) for grade in [5, 8, 11]]
+
+def get_set_districts(set_id: str) -> list:
+    if set_id == STATEWIDE_SET_ID:
+        return list(server.DISTRICTS.keys())
+    return server.get_multidistrict_set(set_id)["districts"]
+
+def get_tool_calls(set_id: str) -> list:
+    """The (name, function) pairs to benchmark for one multidistrict set."""
+    districts = get_set_districts(set_id)
+    latest_year = server.DEFAULT_ASSESSMENT_YEAR
+    return [
+        ("get_district_scores", lambda: server.get_district_scores(district_ids=districts, student_groups=["All Students", "Low-Income"])),
+        ("get_district_score_grid", lambda: server.get_district_score_grid(district_ids=districts, subjects=GRID_SUBJECTS, grades=GRID_GRADES, student_groups=["All Students", "Low-Income"])),
+        ("get_district_scores (per pair)", lambda: [server.get_district_scores(district_ids=districts, subject=subject, grade=grade, student_groups=["All Students", "Low-Income"]) for subject, grade in GRID_PAIRS]),
+        ("analyze_trends", lambda: server.analyze_trends(multidistrict_set_id=set_id)),
+        ("analyze_trends (10 years)", lambda: server.analyze_trends(multidistrict_set_id=set_id, yearspan=10)),
+        ("get_enrollment_for_grad_cohort", lambda: enrollment_tools.get_enrollment_for_grad_cohort(
+            grad_cohorts=list(range(latest_year + 1, latest_year + 7)), student_groups=["all_students", "low_income"], district_ids=districts)),
+        ("compare_cohort_retention", lambda: enrollment_tools.compare_cohort_retention(
+            grad_cohorts=list(range(latest_year + 1, latest_year + 7)), student_groups=["All Students", "Low Income"], district_ids=districts)),
+        ("list_available_tests", lambda: server.list_available_tests())
+    ]
+
+def is_error(result) -> bool:
+    return isinstance(result, str) or (isinstance(result, dict) and "error" in result)
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def benchmark(name: str, function, counter: CountingTransport, runs: int) -> dict:
+    # One untimed call to warm up imports and check the call works with this transport.
+    counter.reset()
+    result = function()
+    if is_error(result):
+        return {"name": name, "error": result if isinstance(result, str) else result.get("error")}
+    queries = counter.queries
+    response_bytes = counter.response_bytes
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    # Measure allocations in a separate call, since tracing slows everything down.
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "name": name,
+        "p50": percentile(timings, 0.5),
+        "p90": percentile(timings, 0.9),
+        "p99": percentile(timings, 0.99),
+        "max": max(timings),
+        "peak_kb": peak / 1024,
+        "queries": queries,
+        "response_kb": response_bytes / 1024
+    }
+
+def print_results(set_id: str, results: list):
+    print(f"\n{set_id} ({len(get_set_districts(set_id))} districts)")
+    print(f"  {'tool':<32} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'peak KB':>9} {'queries':>8} {'resp KB':>9}")
+    for result in results:
+        if "error" in result:
+            print(f"  {result['name']:<32} error: {result['error']}")
+            continue
+        print(f"  {result['name']:<32} {result['p50'] * 1000:>8.1f} {result['p90'] * 1000:>8.1f} {result['p99'] * 1000:>8.1f} "
+              f"{result['max'] * 1000:>8.1f} {result['peak_kb']:>9.0f} {result['queries']:>8} {result['response_kb']:>9.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["synthetic", "record", "replay"], default="synthetic")
+    parser.add_argument("--recordings", default=DEFAULT_RECORDINGS_DIR, help="Directory of recorded responses")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Simulated network latency added to every query")
+    parser.add_argument("--sets", nargs="+", default=["SMALL", "MEDIUM", "DEFAULT", STATEWIDE_SET_ID])
+    args = parser.parse_args()
+
+    if args.mode == "synthetic":
+        start = time.perf_counter()
+        transport = SyntheticTransport(server.DISTRICTS)
+        print(f"Built synthetic data in {time.perf_counter() - start:.1f}s")
+    elif args.mode == "record":
+        utils.load_environment()
+        transport = RecordingTransport(args.recordings)
+        args.runs = 0
+    else:
+        transport = ReplayTransport(args.recordings)
+
+    counter = CountingTransport(transport, args.latency_ms / 1000)
+    utils.set_query_transport(counter)
+
+    for set_id in args.sets:
+        if args.mode == "record":
+            for name, function in get_tool_calls(set_id):
+                result = function()
+                print(f"{set_id} {name}: {'error: ' + str(result) if is_error(result) else 'recorded'}")
+            continue
+        print_results(set_id, [benchmark(name, function, counter, args.runs) for name, function in get_tool_calls(set_id)])
@@ -0,0 +1,68 @@
+"""Microbenchmark for the ranking and trend computations in analyze_trends.
+
+Compares the indexed implementation against the original linear-scan approach as the number
+of districts and student groups grows to statewide size, then times the vectorized statewide
+engine. No network access is needed.
+
+Usage: python benchmarks/bench_trends.py"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import server
+from synthetic import STUDENT_GROUPS, load_district_ids, make_multidistrict_scores
+
+YEARS = [2015, 2016, 2017, 2018, 2019, 2021, 2022, 2023, 2024, 2025]
+
+def linear_scan_trends(scores: dict, first_year, last_year, student_group) -> list:
+    """The original get_annual_trends lookup pattern: a scan of first-year records per district."""
+    first_year_scores = next(record for record in scores["results"] if record["year"] == first_year)
+    last_year_scores = next(record for record in scores["results"] if record["year"] == last_year)
+    trends = []
+    for last_record in last_year_scores["data"]:
+        if last_record.student_group != student_group:
+            continue
+        first_record = next((r for r in first_year_scores["data"] if r.district_id == last_record.district_id and r.student_group == student_group), None)
+        if first_record:
+            trends.append(round((last_record.percent_consistent_grade_level - first_record.percent_consistent_grade_level) / (last_year - first_year + 1), 2))
+    return trends
+
+def linear_scan_analysis(scores: dict):
+    for student_group in scores["student_groups"]:
+        for year_scores in scores["results"]:
+            server.get_district_rankings(year_scores, student_group)
+        linear_scan_trends(scores, YEARS[0], YEARS[-1], student_group)
+
+def indexed_analysis(scores: dict):
+    index = server.index_scores(scores)
+    for student_group in scores["student_groups"]:
+        for year_scores in scores["results"]:
+            server.get_district_rankings(year_scores, student_group, index)
+        server.get_annual_trends(scores, YEARS[0], YEARS[-1], student_group, index)
+
+def best_time(function, *args, repeat: int = 3) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+if __name__ == "__main__":
+    all_districts = load_district_ids()
+    print(f"{'districts':>9} {'groups':>6} {'records':>8} {'linear (ms)':>12} {'indexed (ms)':>13} {'speedup':>8}")
+    for district_count, group_count in [(10, 2), (50, 5), (100, 10), (len(all_districts), 10), (len(all_districts), len(STUDENT_GROUPS))]:
+        scores = make_multidistrict_scores(all_districts[:district_count], YEARS, STUDENT_GROUPS[:group_count])
+        records = sum(len(year_scores["data"]) for year_scores in scores["results"])
+        linear = best_time(linear_scan_analysis, scores)
+        indexed = best_time(indexed_analysis, scores)
+        print(f"{district_count:>9} {group_count:>6} {records:>8} {linear * 1000:>12.1f} {indexed * 1000:>13.1f} {linear / indexed:>7.1f}x")
+
+    # The statewide (multidistrict_set_id="STATE") engine, which also computes percentiles and slopes.
+    import statewide_analysis
+    scores = make_multidistrict_scores(all_districts, YEARS, STUDENT_GROUPS)
+    statewide = best_time(statewide_analysis.analyze_statewide, scores, YEARS[0], YEARS[-1], server.FOCUS_DISTRICT_ID)
+    print(f"\nStatewide engine, {len(all_districts)} districts x {len(YEARS)} years x {len(STUDENT_GROUPS)} groups: {statewide * 1000:.1f} ms")
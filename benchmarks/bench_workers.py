@@ -0,0 +1,199 @@
+"""Load test of the multi-worker HTTP server: throughput against the number of worker processes.
+
+For each worker count, starts `server.py`'s multi-worker launcher (workers.serve) on a local port,
+with portal queries answered from synthetic data (needs duckdb) after a simulated network latency,
+and with a fresh response cache shared by the workers. Then, over streamable HTTP:
+
+- cold: every client makes the same statewide analyze_trends call at once, and the portal queries
+  sent by all the workers together are counted (a worker waits for a query another worker is
+  already fetching, so each query should be sent once).
+- load: every client makes statewide analyze_trends calls (varying subject and grade) back to back
+  for --seconds, and the calls per second and latency percentiles are reported. The queries are
+  in the shared cache by then, so the calls are CPU-bound and should scale with the workers, up to
+  the number of CPU cores.
+
+Usage: python benchmarks/bench_workers.py [--workers 1 2 4] [--clients 8] [--seconds 20]"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import utils
+
+# Every call should do its work from the shared cache, not from precomputed results, and the
+# supervisor process mustn't warm the cache from the live portal.
+utils.load_config().setdefault("precompute", {})["enabled"] = False
+utils.load_config().setdefault("warmup", {})["enabled"] = False
+if "BENCH_WORKERS_DIR" in os.environ:
+    utils.load_config().setdefault("response_cache", {})["path"] = os.path.join(os.environ["BENCH_WORKERS_DIR"], "responses.sqlite3")
+    utils.load_config().setdefault("catalog", {})["path"] = os.path.join(os.environ["BENCH_WORKERS_DIR"], "catalog.json")
+
+SUBJECTS = ["ELA", "Math"]
+GRADES = [3, 4, 5, 6, 7, 8, 10]
+
+class LoggedTransport:
+    """Answer queries from synthetic data after a delay, appending a line per query to a log shared by every worker."""
+
+    def __init__(self, transport, log_path: str, latency_seconds: float):
+        self.transport = transport
+        self.log_path = log_path
+        self.latency_seconds = latency_seconds
+
+    def __call__(self, url: str, query_string: str):
+        with open(self.log_path, "a") as f:
+            f.write(f"{os.getpid()}\n")
+        time.sleep(self.latency_seconds)
+        return self.transport(url, query_string)
+
+    def get_view_version(self, url: str):
+        get_view_version = getattr(self.transport, "get_view_version", None)
+        return get_view_version(url) if get_view_version is not None else None
+
+def create_app():
+    """The app for one worker process of the benchmark server."""
+    import server
+    import workers
+    from transports import SyntheticTransport
+    directory = os.environ["BENCH_WORKERS_DIR"]
+    utils.set_query_transport(LoggedTransport(SyntheticTransport(server.DISTRICTS), os.path.join(directory, "queries.log"),
+                                              float(os.environ["BENCH_WORKERS_LATENCY_MS"]) / 1000))
+    return workers.create_app()
+
+def call_tool(client, url: str, name: str, arguments: dict) -> dict:
+    """Call a tool over stateless streamable HTTP and return the JSON-RPC result."""
+    response = client.post(url, json={"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": {"name": name, "arguments": arguments}},
+                           headers={"Accept": "application/json, text/event-stream"}, timeout=300)
+    response.raise_for_status()
+    if response.headers.get("content-type", "").startswith("text/event-stream"):
+        message = json.loads(next(line[len("data:"):] for line in response.text.splitlines() if line.startswith("data:")))
+    else:
+        message = response.json()
+    if "error" in message or message["result"].get("isError"):
+        raise RuntimeError(f"{name} failed: {message}")
+    return message["result"]
+
+def get_pid(client, url: str) -> int:
+    result = call_tool(client, url, "get_server_stats", {"recent_calls": 0})
+    return json.loads(result["content"][0]["text"])["pid"]
+
+def wait_until_ready(url: str, workers: int, timeout_seconds: float = 180):
+    """Wait until every worker has answered a request (each new connection goes to whichever worker accepts it)."""
+    import httpx
+    pids = set()
+    deadline = time.time() + timeout_seconds
+    while len(pids) < workers and time.time() < deadline:
+        try:
+            with httpx.Client() as client:
+                pids.add(get_pid(client, url))
+        except (httpx.HTTPError, RuntimeError):
+            time.sleep(0.5)
+    return len(pids)
+
+def run_clients(url: str, clients: int, make_calls) -> list:
+    """Run make_calls(client, client index) in one thread per client, and return every (start, latency) recorded."""
+    import httpx
+    samples = []
+    errors = []
+    lock = threading.Lock()
+
+    def run(index):
+        try:
+            with httpx.Client() as client:
+                for start, latency in make_calls(client, index):
+                    with lock:
+                        samples.append((start, latency))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return samples
+
+def timed_call(client, url: str, arguments: dict) -> tuple:
+    start = time.perf_counter()
+    call_tool(client, url, "analyze_trends", arguments)
+    return start, time.perf_counter() - start
+
+def measure(workers: int, args) -> dict:
+    directory = tempfile.mkdtemp()
+    log_path = os.path.join(directory, "queries.log")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    url = f"http://127.0.0.1:{port}/mcp"
+    environment = {**os.environ, "BENCH_WORKERS_DIR": directory, "BENCH_WORKERS_LATENCY_MS": str(args.latency_ms)}
+    process = subprocess.Popen([sys.executable, __file__, "--serve", str(workers), "--port", str(port)], env=environment,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready = wait_until_ready(url, workers)
+        statewide = {"multidistrict_set_id": "STATE", "student_groups": ["All Students", "Low-Income"]}
+
+        open(log_path, "w").close()
+        start = time.perf_counter()
+        run_clients(url, args.clients, lambda client, i: [timed_call(client, url, statewide)])
+        cold_seconds = time.perf_counter() - start
+        with open(log_path) as f:
+            cold_queries = len(f.read().split())
+
+        # Fill the cache for the load phase, so it measures the CPU work of the calls.
+        load_arguments = [{**statewide, "subject": subject, "grade": grade} for subject in SUBJECTS for grade in GRADES]
+        run_clients(url, len(load_arguments), lambda client, i: [timed_call(client, url, load_arguments[i])])
+
+        def load(client, index):
+            end = time.perf_counter() + args.seconds
+            i = index
+            while time.perf_counter() < end:
+                yield timed_call(client, url, load_arguments[i % len(load_arguments)])
+                i += 1
+
+        start = time.perf_counter()
+        samples = run_clients(url, args.clients, load)
+        elapsed = time.perf_counter() - start
+        latencies = sorted(latency for _, latency in samples)
+        return {
+            "ready": ready,
+            "cold_seconds": cold_seconds,
+            "cold_queries": cold_queries,
+            "calls": len(latencies),
+            "calls_per_second": len(latencies) / elapsed,
+            "p50": latencies[len(latencies) // 2],
+            "p95": latencies[int(len(latencies) * 0.95)]
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--latency-ms", type=float, default=200, help="Simulated network latency added to every portal query")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        import workers
+        workers.serve(args.serve, port=args.port, app_factory="bench_workers:create_app", log_level="warning")
+        sys.exit()
+
+    print(f"{args.clients} clients, statewide analyze_trends, {args.latency_ms:.0f} ms per portal query, {os.cpu_count()} CPUs")
+    print(f"  {'workers':>7} {'cold (s)':>9} {'queries':>8} {'calls':>6} {'calls/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+    for workers in args.workers:
+        result = measure(workers, args)
+        note = "" if result["ready"] == workers else f"  (only {result['ready']} workers answered before the load started)"
+        print(f"  {workers:>7} {result['cold_seconds']:>9.2f} {result['cold_queries']:>8} {result['calls']:>6} {result['calls_per_second']:>8.2f} "
+              f"{result['p50'] * 1000:>9.0f} {result['p95'] * 1000:>9.0f}{note}")
@@ -0,0 +1,43 @@
+"""Synthetic score data shaped like the server's own results, for benchmarking at statewide scale."""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from records import ScoreResult
+
+STUDENT_GROUPS = [
+    "All Students", "Low-Income", "Non-Low Income", "Female", "Male", "Gender X",
+    "American Indian/ Alaskan Native", "Asian", "Black/ African American", "Hispanic/ Latino of any race(s)",
+    "Native Hawaiian/ Other Pacific Islander", "Two Or More Races", "White", "English Language Learners",
+    "Non-English Language Learners", "Students with Disabilities", "Students without Disabilities",
+    "Homeless", "Non-Homeless", "Highly Capable"
+]
+
+def load_district_ids() -> list:
+    """All district codes from Districts.xml."""
+    import server
+    return list(server.DISTRICTS.keys())
+
+def make_multidistrict_scores(district_ids: list, years: list, student_groups: list, seed: int = 0) -> dict:
+    """Build a result in the same shape as server.get_multidistrict_scores."""
+    rng = random.Random(seed)
+    results = []
+    for year in years:
+        data = []
+        for student_group in student_groups:
+            for district_id in district_ids:
+                total = rng.randint(20, 2000)
+                consistent = rng.randint(0, total)
+                data.append(ScoreResult(student_group, district_id, total, consistent, round(consistent / total * 100, 2)))
+        results.append({"year": year, "data": data})
+
+    return {
+        "multidistrict_set_id": "SYNTHETIC",
+        "subject": "ELA",
+        "grade": 3,
+        "student_groups": student_groups,
+        "years": years,
+        "results": results
+    }
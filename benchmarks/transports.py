@@ -0,0 +1,161 @@
+"""Stand-ins for the data.wa.gov portal, plugged in with utils.set_query_transport.
+
+- RecordingTransport forwards queries to the live portal and saves each response to disk.
+- ReplayTransport answers queries from those saved responses.
+- SyntheticTransport answers any query from generated data covering every district in
+  Districts.xml, using the snapshot module's SoQL translation over an in-memory DuckDB.
+- CountingTransport wraps any of these to count queries and response sizes, and can add a
+  fixed delay per query to model network latency.
+
+Only RecordingTransport talks to the live portal, for view metadata (get_view_version) as well as
+queries. The offline transports don't know a view's version, so the catalog and precomputed
+results treat their entries as current."""
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import utils
+from response_cache import make_cache_key
+
+DEFAULT_RECORDINGS_DIR = os.path.join(os.path.dirname(__file__), "recordings")
+
+class RecordingTransport:
+    """Send queries to the live portal and save every successful response."""
+
+    def __init__(self, directory: str = DEFAULT_RECORDINGS_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, url: str, query_string: str):
+        response = utils.fetch_from_portal(url, query_string)
+        if not (isinstance(response, dict) and "error" in response):
+            with open(os.path.join(self.directory, make_cache_key(url, query_string) + ".json"), "w") as f:
+                json.dump({"url": url, "query": query_string, "response": response}, f)
+        return response
+
+    def get_view_version(self, url: str):
+        return utils.fetch_view_last_modified(url)
+
+class ReplayTransport:
+    """Answer queries from responses saved by RecordingTransport."""
+
+    def __init__(self, directory: str = DEFAULT_RECORDINGS_DIR):
+        self.directory = directory
+
+    def __call__(self, url: str, query_string: str):
+        path = os.path.join(self.directory, make_cache_key(url, query_string) + ".json")
+        if not os.path.exists(path):
+            return {"error": "No recorded response for query; re-run with --mode record", "url": url, "query": query_string}
+        with open(path) as f:
+            return json.load(f)["response"]
+
+class SyntheticTransport:
+    """Answer queries from generated data for every district, for every configured dataset view."""
+
+    ASSESSMENT_GROUPS = ["All Students", "Low-Income", "Non-Low Income", "Female", "Male", "Asian",
+                         "Black/ African American", "Hispanic/ Latino of any race(s)", "TwoorMoreRaces", "White"]
+    ASSESSMENT_TESTS = [("SBAC", "ELA"), ("SBAC", "Math"), ("AIM", "ELA"), ("AIM", "Math"), ("WCAS", "Science"), ("AIM", "Science")]
+    ASSESSMENT_GRADES = ["03", "04", "05", "06", "07", "08", "10", "All Grades"]
+    ENROLLMENT_GRADES = ["Kindergarten", "Half-day Kindergarten", "1st Grade", "2nd Grade", "3rd Grade"] + [f"{grade}th Grade" for grade in range(4, 13)]
+
+    def __init__(self, districts: dict, config: dict = None):
+        import duckdb
+
+        config = config or utils.load_config()
+        self.connection = duckdb.connect(":memory:")
+        self.connection.execute("CREATE TABLE districts (districtcode VARCHAR, districtname VARCHAR)")
+        self.connection.executemany("INSERT INTO districts VALUES (?, ?)", list(districts.items()))
+
+        years_by_url = {}
+        for assessment_set in config["assessment_sets"]:
+            years_by_url.setdefault(assessment_set["url"], []).append(assessment_set["year"])
+        for url, years in years_by_url.items():
+            self._create_assessment_table(url, years)
+        for enrollment_set in config["enrollment_sets"]:
+            self._create_enrollment_table(enrollment_set["url"], config.get("latest_assessment_year", 2025), config.get("enrollment_student_groups", []))
+
+    @staticmethod
+    def _values(values: list) -> str:
+        """Render a list of values (or tuples of values) as a SQL VALUES list."""
+        rows = ", ".join("(" + ", ".join("'" + str(v).replace("'", "''") + "'" for v in (value if isinstance(value, tuple) else (value,))) + ")" for value in values)
+        return f"(VALUES {rows})"
+
+    def _create_assessment_table(self, url: str, years: list):
+        from snapshot import get_table_name
+        # Counts are derived from a hash of the row's identity, so data is stable between runs.
+        self.connection.execute(f"""
+CREATE TABLE "{get_table_name(url)}" AS
+SELECT
+  y.schoolyear, 'District' AS organizationlevel, d.districtcode, d.districtname,
+  g.studentgroup, 'Synthetic' AS studentgrouptype, gl.gradelevel,
+  t.testadministration, t.testsubject,
+  CAST(20 + hash(y.schoolyear, d.districtcode, g.studentgroup, gl.gradelevel, t.testadministration, t.testsubject) % 2000 AS VARCHAR) AS count_of_students_expected,
+  CAST(20 + hash(y.schoolyear, d.districtcode, g.studentgroup, gl.gradelevel, t.testadministration, t.testsubject) % 2000 AS VARCHAR) AS denominatorsuppressed,
+  CAST(hash(d.districtcode, y.schoolyear, g.studentgroup, gl.gradelevel, t.testsubject) % 20 AS VARCHAR) AS count_consistent_grade_level,
+  CAST(hash(d.districtcode, y.schoolyear, g.studentgroup, gl.gradelevel, t.testsubject) % 20 AS VARCHAR) AS countmetstandard,
+  CAST(hash(d.districtcode, y.schoolyear, g.studentgroup, gl.gradelevel, t.testsubject) % 20 AS VARCHAR) AS count_consistent_grade_level_knowledge_and_above,
+  CAST(hash(d.districtcode, y.schoolyear, g.studentgroup, gl.gradelevel, t.testsubject) % 20 AS VARCHAR) AS numeratorsuppressed,
+  'None' AS "DAT",
+  'None' AS "Suppression"
+FROM {self._values([utils.get_school_year(year) for year in years])} y(schoolyear)
+CROSS JOIN districts d
+CROSS JOIN {self._values(self.ASSESSMENT_GROUPS)} g(studentgroup)
+CROSS JOIN {self._values(self.ASSESSMENT_GRADES)} gl(gradelevel)
+CROSS JOIN {self._values(self.ASSESSMENT_TESTS)} t(testadministration, testsubject)
+""")
+        # Make the "met standard" counts a plausible fraction of the students tested.
+        table = get_table_name(url)
+        for column in ["count_consistent_grade_level", "countmetstandard", "count_consistent_grade_level_knowledge_and_above", "numeratorsuppressed"]:
+            self.connection.execute(f'UPDATE "{table}" SET "{column}" = CAST(CAST(count_of_students_expected AS BIGINT) * (30 + CAST("{column}" AS BIGINT) * 2) // 100 AS VARCHAR)')
+
+    def _create_enrollment_table(self, url: str, latest_year: int, student_groups: list):
+        from snapshot import get_table_name
+        group_columns = ",\n  ".join(
+            f"CAST(hash(y.schoolyear, d.districtcode, gl.gradelevel, '{group}') % {1000 if group == 'all_students' else 300} AS VARCHAR) AS \"{group}\""
+            for group in student_groups)
+        self.connection.execute(f"""
+CREATE TABLE "{get_table_name(url)}" AS
+SELECT
+  y.schoolyear, 'District' AS organizationlevel, d.districtcode, d.districtname, gl.gradelevel,
+  {group_columns}
+FROM {self._values([utils.get_school_year(year) for year in range(2015, latest_year + 1)])} y(schoolyear)
+CROSS JOIN districts d
+CROSS JOIN {self._values(self.ENROLLMENT_GRADES)} gl(gradelevel)
+""")
+
+    def __call__(self, url: str, query_string: str):
+        from snapshot import query_connection
+        return query_connection(self.connection, url, query_string)
+
+class CountingTransport:
+    """Count queries and response bytes passing through another transport, optionally adding latency."""
+
+    def __init__(self, transport, latency_seconds: float = 0.0):
+        self.transport = transport
+        self.latency_seconds = latency_seconds
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.response_bytes = 0
+
+    def __call__(self, url: str, query_string: str):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        response = self.transport(url, query_string)
+        size = len(json.dumps(response))
+        with self._lock:
+            self.queries += 1
+            self.response_bytes += size
+        return response
+
+    def get_view_version(self, url: str):
+        get_view_version = getattr(self.transport, "get_view_version", None)
+        return get_view_version(url) if get_view_version is not None else None
+
+    def reset(self):
+        with self._lock:
+            self.queries = 0
+            self.response_bytes = 0
@@ -0,0 +1,169 @@
+"""Catalog of the parameter values each dataset view offers: tests, student groups and school years.
+
+list_available_tests, list_available_student_groups and get_available_enrollment_years used to
+run a GROUP BY over a whole dataset on every call. The catalog runs those aggregations once per
+dataset view (covering every school year in the view at once) and keeps the results in a JSON
+file, along with the view's version (its rowsUpdatedAt). Views for past years never change, so
+their entries are kept for good. The live views (the current assessment year and enrollment) are
+re-checked at most once every version_check_seconds, and only fetched again, with their cached
+query responses dropped, once the portal reports a new version. Under the snapshot backend the
+snapshot file's modification time stands in for the version.
+
+The same entries let get_district_scores reject tests, subjects, grades and student groups that
+don't exist for a year before a query is sent."""
+import json
+import os
+import threading
+import time
+
+import metrics
+from single_flight import SingleFlight
+from utils import (ToolCancelled, execute_query, get_current_view_version, get_data_backend, get_grade_from_string, get_live_urls,
+                   get_response_cache, get_school_year_from_string, get_view_id)
+
+DEFAULT_CATALOG_PATH = ".cache/catalog.json"
+DEFAULT_VERSION_CHECK_SECONDS = 300
+
+# Bump when the shape of the stored entries changes, so old catalog files are fetched again.
+CATALOG_FORMAT_VERSION = 1
+
+ASSESSMENT_TESTS_QUERY = """SELECT `schoolyear`, `testadministration`, `testsubject`, `gradelevel`
+GROUP BY `schoolyear`, `testadministration`, `testsubject`, `gradelevel`
+HAVING caseless_ne(`gradelevel`, "All Grades")"""
+
+ASSESSMENT_STUDENT_GROUPS_QUERY = """SELECT `schoolyear`, `studentgroup`, `studentgrouptype`
+GROUP BY `schoolyear`, `studentgrouptype`, `studentgroup`
+ORDER BY `studentgrouptype`"""
+
+ENROLLMENT_YEARS_QUERY = "SELECT `schoolyear` GROUP BY `schoolyear`"
+
+def fetch_assessment_entry(url: str) -> dict:
+    """The tests (test, subject, grade) and student groups (group, group type) in an assessment view,
+    each keyed by lower-cased school year."""
+    tests_response = execute_query(url, ASSESSMENT_TESTS_QUERY)
+    if "error" in tests_response:
+        return tests_response
+    student_groups_response = execute_query(url, ASSESSMENT_STUDENT_GROUPS_QUERY)
+    if "error" in student_groups_response:
+        return student_groups_response
+
+    tests = {}
+    for row in tests_response:
+        grade = get_grade_from_string(row.get("gradelevel", ""))
+        if grade is not None:
+            tests.setdefault(row.get("schoolyear", "").lower(), []).append([row.get("testadministration"), row.get("testsubject"), grade])
+    student_groups = {}
+    for row in student_groups_response:
+        student_groups.setdefault(row.get("schoolyear", "").lower(), []).append([row.get("studentgroup"), row.get("studentgrouptype")])
+    return {"tests": tests, "student_groups": student_groups}
+
+def fetch_enrollment_entry(url: str) -> dict:
+    """The school years (as ints, in the order the portal returns them) in an enrollment view."""
+    response = execute_query(url, ENROLLMENT_YEARS_QUERY)
+    if "error" in response:
+        return response
+    return {"years": [get_school_year_from_string(row.get("schoolyear", "")) for row in response]}
+
+FETCHERS = {
+    "assessment": fetch_assessment_entry,
+    "enrollment": fetch_enrollment_entry
+}
+
+class DatasetCatalog:
+    """Per-view catalog entries, persisted to a JSON file and fetched again only when a view changes."""
+
+    def __init__(self, path: str, version_check_seconds: float = DEFAULT_VERSION_CHECK_SECONDS):
+        self.path = path
+        self.version_check_seconds = version_check_seconds
+        self.lookups = 0
+        self.fetches = 0
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight(retry_on=(ToolCancelled,))
+        self._entries = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return stored.get("entries", {}) if stored.get("format") == CATALOG_FORMAT_VERSION else {}
+
+    def _save(self):
+        """Write the catalog file. Caller holds the lock."""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temporary_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary_path, "w") as f:
+                json.dump({"format": CATALOG_FORMAT_VERSION, "entries": self._entries}, f, separators=(",", ":"))
+            os.replace(temporary_path, self.path)
+        except OSError:
+            pass # not being able to write the file just means fetching the entries again next time
+
+    def get(self, url: str, kind: str) -> dict:
+        """Return the catalog entry for a dataset view ("assessment" or "enrollment"), fetching it if it's
+        missing or out of date. Returns an error dict if it has to be fetched and the queries fail."""
+        backend = get_data_backend()
+        key = f"{backend}:{url}"
+        with self._lock:
+            self.lookups += 1
+            entry = self._entries.get(key)
+        if entry is not None and entry["kind"] == kind and self._is_current(backend, url, entry):
+            return entry
+        # Concurrent lookups for the same view share one fetch.
+        return self._single_flight.do(key, self._fetch, backend, key, url, kind, entry)
+
+    def _is_current(self, backend: str, url: str, entry: dict) -> bool:
+        if backend == "snapshot":
+            return entry["version"] == self._snapshot_version()
+        if url not in get_live_urls():
+            return True
+        # If the portal can't be asked for the view's version, the stored entry is trusted.
+        version = get_current_view_version(url, self.version_check_seconds)
+        return version is None or version == entry["version"]
+
+    def _snapshot_version(self):
+        from snapshot import get_snapshot_version
+        return get_snapshot_version()
+
+    def _fetch(self, backend: str, key: str, url: str, kind: str, previous: dict) -> dict:
+        # Take the version before querying: if the view changes part-way through, the entry is
+        # recorded against the older version and fetched again on a later lookup.
+        if backend == "snapshot":
+            version = self._snapshot_version()
+        else:
+            # A max age of 0 always asks the portal, and saves the answer for the next freshness check.
+            version = get_current_view_version(url, 0)
+            if previous is not None:
+                # The view has changed, so cached responses for it (including the catalog's own
+                # queries) are out of date too.
+                cache = get_response_cache()
+                if cache is not None:
+                    cache.invalidate(url)
+
+        with metrics.span("catalog_fetch", dataset=get_view_id(url), kind=kind):
+            data = FETCHERS[kind](url)
+        if "error" in data:
+            return data
+
+        entry = {"kind": kind, "version": version, "fetched_at": time.time(), **data}
+        with self._lock:
+            self.fetches += 1
+            if previous is not None:
+                self.refreshes += 1
+            self._entries[key] = entry
+            self._save()
+        return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "path": self.path,
+                "views": len(self._entries),
+                "lookups": self.lookups,
+                "fetches": self.fetches,
+                "refreshes": self.refreshes
+            }
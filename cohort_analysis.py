@@ -0,0 +1,99 @@
+"""Vectorized cohort retention comparison across the districts of a multidistrict set.
+
+Fetched cohort enrollment is pivoted into a cohorts x student groups x districts x grades array,
+and retention ratios, progression ratios and group percentages are computed with NumPy over the
+whole array at once. Used by compare_cohort_retention."""
+import numpy as np
+
+from statewide_analysis import _value, dense_ranks
+from utils import get_school_year
+
+GRADES = 13 # kindergarten (0) through 12th grade
+
+def build_enrollment_cube(enrollment: dict, grad_cohorts: list, district_ids: list, groups: list):
+    """Pivot fetched enrollment into a cohorts x groups x districts x grades array. Missing counts are NaN.
+
+    Each (school year, grade) belongs to exactly one graduation cohort, so every count is placed
+    with one indexed assignment."""
+    cohort_positions = {grad_cohort: position for position, grad_cohort in enumerate(grad_cohorts)}
+    cells = []
+    for district_position, district in enumerate(district_ids):
+        district_enrollment = enrollment["districts"].get(str(district), {}).get("enrollment", {})
+        for (year, grade), counts in district_enrollment.items():
+            cohort_position = cohort_positions.get(year + 12 - grade)
+            if cohort_position is None:
+                continue
+            for group_position, group in enumerate(groups):
+                cells.append((cohort_position, group_position, district_position, grade, counts.get(group, 0)))
+
+    cube = np.full((len(grad_cohorts), len(groups), len(district_ids), GRADES), np.nan)
+    if cells:
+        cohorts, group_positions, districts, grades, values = (np.asarray(a) for a in zip(*cells))
+        cube[cohorts, group_positions, districts, grades] = values.astype(float)
+    return cube
+
+def _ratio(numerator, denominator):
+    """Elementwise numerator / denominator, NaN where the denominator is missing or zero."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+def analyze_cohort_retention(enrollment: dict, grad_cohorts: list, district_ids: list, student_groups: list) -> list:
+    """Rank districts by how many of each graduation cohort they kept, for each cohort and student group.
+
+    A cohort's span runs from the first to the last grade that any district has data for, so every
+    district in a ranking is measured over the same school years. Districts without enrollment at
+    both ends of the span (e.g. K-8 districts for a cohort that has reached high school) are listed
+    after the ranked districts with a retention ratio of None."""
+    groups = [student_group.replace(" ", "_").lower() for student_group in student_groups]
+    if "all_students" not in groups:
+        # Percentages are computed against All Students, which get_cohort_enrollment always fetches.
+        groups.append("all_students")
+    all_students = groups.index("all_students")
+
+    cube = build_enrollment_cube(enrollment, grad_cohorts, district_ids, groups)
+    # Progression ratios between consecutive grades (this year / last year's previous grade).
+    progression = _ratio(cube[..., 1:], cube[..., :-1])
+    observed = ~np.isnan(progression)
+    mean_progression = _ratio(np.where(observed, progression, 0.0).sum(axis=-1), observed.sum(axis=-1))
+
+    district_names = [enrollment["districts"].get(str(district), {}).get("districtname", "Unknown District") for district in district_ids]
+    results = []
+    for cohort_position, grad_cohort in enumerate(grad_cohorts):
+        grades_with_data = np.flatnonzero(~np.isnan(cube[cohort_position, all_students]).all(axis=0))
+        if not len(grades_with_data):
+            continue
+        first_grade, last_grade = int(grades_with_data[0]), int(grades_with_data[-1])
+
+        first = cube[cohort_position, :, :, first_grade]
+        last = cube[cohort_position, :, :, last_grade]
+        retention = _ratio(last, first) if last_grade > first_grade else np.full(first.shape, np.nan)
+        percentage = _ratio(last, last[all_students][None, :]) * 100
+        ranks = dense_ranks(retention.T).T
+
+        for group_position, student_group in enumerate(student_groups):
+            present = np.flatnonzero(~np.isnan(retention[group_position]))
+            missing = np.flatnonzero(np.isnan(retention[group_position]))
+            ordered = np.concatenate([present[np.lexsort((present, ranks[group_position, present]))], missing])
+            results.append({
+                "grad_cohort": grad_cohort,
+                "student_group": student_group,
+                "first_schoolyear": get_school_year(grad_cohort - 12 + first_grade),
+                "first_gradelevel_num": first_grade,
+                "last_schoolyear": get_school_year(grad_cohort - 12 + last_grade),
+                "last_gradelevel_num": last_grade,
+                "district_count": len(present),
+                "ranked_data": [
+                    {
+                        "district_id": str(district_ids[i]),
+                        "districtname": district_names[i],
+                        "first_enrollment": None if np.isnan(first[group_position, i]) else int(first[group_position, i]),
+                        "last_enrollment": None if np.isnan(last[group_position, i]) else int(last[group_position, i]),
+                        "retention_ratio": _value(retention[group_position, i], 3),
+                        "mean_progression_ratio": _value(mean_progression[cohort_position, group_position, i], 3),
+                        "last_percentage": _value(percentage[group_position, i], 3),
+                        "rank": int(ranks[group_position, i]) or None
+                    }
+                    for i in ordered.tolist()
+                ]
+            })
+    return results
@@ -0,0 +1,80 @@
+"""Fuzzy search over district names, for looking up district codes by name.
+
+The index is built once when the districts are loaded: every name is normalized (lower case, no
+punctuation, without words like "School District" that nearly every name shares), then split
+into words and into character trigrams. Each word and trigram maps to the districts containing
+it, so a search only scores the districts that share something with the query. A district scores
+highly when every word of the query starts one of its words ("lake wash" -> Lake Washington),
+and trigram overlap catches misspellings ("Bellvue" -> Bellevue)."""
+import re
+
+# Words that nearly every name includes, so they say nothing about which district is meant.
+COMMON_WORDS = {"school", "schools", "district", "districts", "sd", "no", "public"}
+MIN_SCORE = 0.3
+
+_NON_WORD_PATTERN = re.compile(r"[^a-z0-9]+")
+
+def normalize_name(name: str) -> list:
+    """Split a district name (or search text) into lower-case words, leaving out the common ones."""
+    return [word for word in _NON_WORD_PATTERN.split(name.lower()) if word and word not in COMMON_WORDS]
+
+def get_trigrams(words: list) -> set:
+    """Character trigrams of the words, each padded so word starts and ends count too."""
+    trigrams = set()
+    for word in words:
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+class DistrictIndex:
+    """Word-prefix and trigram index over district names, keyed by district code."""
+
+    def __init__(self, districts: dict):
+        self.districts = districts
+        self._words = {}
+        self._trigrams = {}
+        self._prefixes = {}
+        self._trigram_counts = {}
+        for district_id, name in districts.items():
+            words = normalize_name(name) or [name.lower()]
+            trigrams = get_trigrams(words)
+            self._words[district_id] = words
+            self._trigram_counts[district_id] = len(trigrams)
+            for trigram in trigrams:
+                self._trigrams.setdefault(trigram, []).append(district_id)
+            for word in words:
+                for length in range(1, len(word) + 1):
+                    self._prefixes.setdefault(word[:length], set()).add(district_id)
+
+    def search(self, text: str, limit: int = 5) -> list:
+        """Return up to limit (district_id, score) pairs for the districts best matching text, best first.
+
+        Scores run from 0 to 1; a district code, or a name whose words all start with the query's
+        words, scores 1."""
+        text = text.strip()
+        if text in self.districts:
+            return [(text, 1.0)]
+        query_words = normalize_name(text)
+        if not query_words:
+            return []
+
+        # Districts where every query word is the start of one of the name's words.
+        prefix_matches = set.intersection(*(self._prefixes.get(word, set()) for word in query_words))
+
+        # Trigram overlap (Jaccard similarity) with every district sharing at least one trigram.
+        query_trigrams = get_trigrams(query_words)
+        shared = {}
+        for trigram in query_trigrams:
+            for district_id in self._trigrams.get(trigram, ()):
+                shared[district_id] = shared.get(district_id, 0) + 1
+
+        scores = {}
+        for district_id, count in shared.items():
+            score = count / (len(query_trigrams) + self._trigram_counts[district_id] - count)
+            if district_id in prefix_matches:
+                # Every word matched; names with fewer extra words rank first.
+                score = max(score, 0.5 + 0.5 * len(query_words) / len(self._words[district_id]))
+            if score >= MIN_SCORE:
+                scores[district_id] = score
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.districts[item[0]]))
+        return [(district_id, round(score, 3)) for district_id, score in ranked[:limit]]
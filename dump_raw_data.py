@@ -12,4 +12,4 @@ benchmark_scores = get_multidistrict_scores(
 )
 
 with open(f"sample_{set_id}.json", "w") as f:
-    json.dump(benchmark_scores, f, indent=2)
\ No newline at end of file
+    json.dump(benchmark_scores, f, indent=2, default=ScoreResult.to_dict)
\ No newline at end of file
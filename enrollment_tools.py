@@ -1,19 +1,24 @@
+import metrics
+from async_tools import nonblocking
+from output_formats import shaped_output
 from utils import *
 
 config_data = load_config()
 FOCUS_DISTRICT_ID = config_data.get("focus_district_id", "17414")
+ENROLLMENT_DISTRICTS_PER_QUERY = 50
 
 def register_tools(mcp):
     """Register enrollment tools with the MCP server."""
     mcp.tool()(get_available_enrollment_years)
-    mcp.tool()(get_enrollment_for_grad_cohort)
-    mcp.tool()(get_enrollment_student_groups)
+    mcp.tool()(shaped_output(get_enrollment_for_grad_cohort))
+    mcp.tool()(shaped_output(compare_cohort_retention))
+    mcp.tool()(nonblocking(get_enrollment_student_groups))
 
 def get_enrollment_student_groups() -> list:
     """Get a list of all available student groups in the enrollment dataset."""
     return config_data.get("enrollment_student_groups", [])
 
-def get_enrollment_for_grad_cohort(grad_cohorts: list, district_id: int = FOCUS_DISTRICT_ID, student_groups: list = ["All Students"]):
+def get_enrollment_for_grad_cohort(grad_cohorts: list, district_id: int = FOCUS_DISTRICT_ID, student_groups: list = ["All Students"], district_ids: list = None):
     """Retrieve enrollment data for specified graduation cohorts in a school district,
     including student group percentages as well as grade progression ratios.
     This function tracks student enrollment across multiple school years for cohorts
@@ -29,9 +34,12 @@ def get_enrollment_for_grad_cohort(grad_cohorts: list, district_id: int = FOCUS_
         student_groups (list, optional): List of student demographic groups to track
             (e.g., ["All Students", "Asian", "Hispanic"]). Defaults to ["All Students"].
             "All Students" MUST be included to calculate student group percentages correctly.
+        district_ids (list, optional): List of district IDs to retrieve cohorts for in a
+            single call, e.g. to compare cohorts across a multidistrict set. Overrides
+            district_id when provided.
     Returns:
-        list or str: A list of dictionaries containing enrollment data with the following
-            fields per record:
+        list or str: A list of dictionaries, one per district and graduation cohort, containing
+            enrollment data with the following fields per record:
             - schoolyear: School year (e.g., "2020-21")
             - districtname: Name of the school district
             - grad_cohort: The graduation year
@@ -46,114 +54,205 @@ def get_enrollment_for_grad_cohort(grad_cohorts: list, district_id: int = FOCUS_
     Note:
         - The query may include years beyond available data (e.g., future school years),
           which are safely excluded from results."""
+    if district_ids is None:
+        district_ids = [district_id]
+
+    enrollment = get_cohort_enrollment(grad_cohorts, district_ids, student_groups)
+    if "error" in enrollment:
+        return f"Error executing query for grad cohorts {grad_cohorts}: {enrollment['error']}"
+
+    with metrics.span("cohort_processing"):
+        return build_cohort_results(enrollment, grad_cohorts, district_ids, student_groups)
+
+def build_cohort_results(enrollment: dict, grad_cohorts: list, district_ids: list, student_groups: list) -> list:
+    """Lay out fetched enrollment by district and graduation cohort, adding percentages and progression ratios."""
     results = []
-    district_name = "Unknown District"
+    for district in district_ids:
+        district_enrollment = enrollment["districts"].get(str(district), {})
+        district_name = district_enrollment.get("districtname", "Unknown District")
+        enrollment_by_year_grade = district_enrollment.get("enrollment", {})
 
-    select_list = "`schoolyear`, `districtcode`, `districtname`"
-    for student_group in student_groups:
-        student_group_normalized = student_group.replace(" ", "_").lower()
-        select_list += f", sum(`{student_group_normalized}`) AS `{student_group_normalized}_enrollment`"
+        for grad_cohort in grad_cohorts:
+            grad_cohort_results = []
+            prev_enrollment = {}
+            for year, grade in get_cohort_year_grades(grad_cohort):
+                year_enrollment = enrollment_by_year_grade.get((year, grade))
+                if year_enrollment is None:
+                    # Years that aren't in the dataset (e.g. future school years) are simply left out.
+                    continue
+
+                grad_cohort_result = {"schoolyear": get_school_year(year)}
+                for student_group in student_groups:
+                    student_group_normalized = student_group.replace(" ", "_").lower()
+                    grad_cohort_result[f"{student_group_normalized}_enrollment"] = str(year_enrollment.get(student_group_normalized, 0))
+                grad_cohort_result["schoolyear_num"] = year
+                grad_cohort_result["gradelevel_num"] = grade
+                grad_cohort_result["gradelevel_str"] = get_grade_as_string(grade, False)
+
+                # Calculate percentages and grade progression ratios for each student group.
+                all_students_enrollment = year_enrollment.get("all_students", 0)
+
+                for student_group in student_groups:
+                    student_group_normalized = student_group.replace(" ", "_").lower()
+                    enrollment_field = f"{student_group_normalized}_enrollment"
+                    group_enrollment = year_enrollment.get(student_group_normalized, 0)
+
+                    # Calculate percentage of total student body
+                    if all_students_enrollment > 0:
+                        percentage = (group_enrollment / all_students_enrollment) * 100
+                        # TODO: _percentage is written for the "All Students" group in addition to any other groups.
+                        # Could suppress all_students_percentage from being written if desired, since it's always 100%.
+                        grad_cohort_result[f"{student_group_normalized}_percentage"] = round(percentage, 3)
+                    else:
+                        grad_cohort_result[f"{student_group_normalized}_percentage"] = 0
+
+                    # Calculate grade progression ratio (current year / previous year)
+                    if enrollment_field in prev_enrollment:
+                        prev_year_enrollment = prev_enrollment[enrollment_field]
+                        if prev_year_enrollment > 0:
+                            progression_ratio = group_enrollment / prev_year_enrollment
+                            grad_cohort_result[f"{student_group_normalized}_progression_ratio"] = round(progression_ratio, 3)
+                        else:
+                            grad_cohort_result[f"{student_group_normalized}_progression_ratio"] = None
+                    else:
+                        grad_cohort_result[f"{student_group_normalized}_progression_ratio"] = None
+
+                    # Store current enrollment for next iteration
+                    prev_enrollment[enrollment_field] = group_enrollment
+
+                grad_cohort_results.append(grad_cohort_result)
+
+            results.append( {
+                "districtcode": district,
+                "districtname": district_name,
+                "grad_cohort": grad_cohort,
+                "enrollment_data": grad_cohort_results
+            })
+
+    return results
 
+def compare_cohort_retention(grad_cohorts: list, multidistrict_set_id: str = "DEFAULT", student_groups: list = ["All Students"], district_ids: list = None) -> dict:
+    """Compare how well every district in a multidistrict set retains its graduation cohorts. Returns authoritative
+    retention rankings across districts; use this tool rather than comparing get_enrollment_for_grad_cohort results manually.
+    Args:
+        grad_cohorts (list): Graduation cohorts to compare, e.g. [2026, 2027].
+        multidistrict_set_id (str, optional): The multidistrict set whose districts are compared. Defaults to "DEFAULT".
+        student_groups (list, optional): Student groups to compare (e.g. ["All Students", "Low Income"]).
+        district_ids (list, optional): Districts to compare instead of a multidistrict set.
+    Returns:
+        dict: "ranked_results", one entry per graduation cohort and student group, each with the school years and
+            grades the cohort is measured between and a "ranked_data" list of districts with:
+            - first_enrollment / last_enrollment: The group's enrollment at the start and end of the span
+            - retention_ratio: last_enrollment / first_enrollment (ranked highest first; None if either is missing)
+            - mean_progression_ratio: Average of the year-over-year grade progression ratios
+            - last_percentage: The group's percentage of total enrollment at the end of the span
+            - rank: Dense rank by retention_ratio
+            Returns an error dict if the set is not found or the query fails."""
+    if district_ids is None:
+        multidistrict_set = next((b for b in config_data.get("multidistrict_sets", []) if b["id"] == multidistrict_set_id), None)
+        if not multidistrict_set:
+            return {"error": f"Multidistrict set {multidistrict_set_id} not found"}
+        district_ids = multidistrict_set["districts"]
+
+    # One grouped query (per ENROLLMENT_DISTRICTS_PER_QUERY districts) covers every cohort and district.
+    enrollment = get_cohort_enrollment(grad_cohorts, district_ids, student_groups)
+    if "error" in enrollment:
+        return enrollment
+
+    import cohort_analysis
+    with metrics.span("cohort_retention"):
+        return { "ranked_results": cohort_analysis.analyze_cohort_retention(enrollment, grad_cohorts, district_ids, student_groups) }
+
+def get_cohort_year_grades(grad_cohort: int) -> list:
+    """Get the (school year, grade) pairs a graduation cohort passes through, kindergarten to 12th grade.
+
+    Example for grad cohort 2033: kindergarten (grade 0) in the 2020-21 school year, 1st grade
+    (grade 1) in the 2021-22 school year, and so on."""
+    return [(grad_cohort - (12 - grade), grade) for grade in range(13)]
+
+def get_cohort_enrollment(grad_cohorts: list, district_ids: list, student_groups: list) -> dict:
+    """Fetch enrollment for every (school year, grade) pair needed by a set of graduation cohorts.
+
+    Rather than one query per cohort, the year/grade pairs for all cohorts are merged into one
+    condition per school year, and every district is fetched in the same grouped query (split
+    into chunks of ENROLLMENT_DISTRICTS_PER_QUERY districts to keep the query a sensible size).
+    Cohort membership is worked out afterwards from each row's school year and grade.
+
+    Returns {"districts": {district_id: {"districtname": name, "enrollment": {(year, grade): {group: count}}}}},
+    or an error dict."""
+    # Note: The query as built may include years that aren't in the dataset, e.g. querying
+    # for grad cohort 2033 will include the 2032-33 school year, which obviously there's no
+    # data for yet. This is fine, it won't cause any errors, those years simply won't be
+    # present in the returned data. This ensures we're always getting all available and
+    # relevant data.
+    grades_by_year = {}
     for grad_cohort in grad_cohorts:
-        year_grade_list = ""
-        # Get enrollment over time for a specified grad cohort. 
-        # Example for grad cohort 2033:
-        # Kindergarten (grade 0) in 2020-21 school year
-        # 1st grade (grade 1) in 2021-22 school year
-        # ...and so on.
-        # Note: The query as built may include years that aren't in the dataset,
-        # e.g. querying for grad cohort 2033 will include the 2032-33 school year,
-        # which obviously there's no data for yet. This is fine, it won't cause any
-        # errors, those years simply won't be present in the returned data. This
-        # ensures we're always getting all available and relevant data.
-        for i in range(13):
-            year = grad_cohort - (12 - i)
-            
-            if year_grade_list:
-                year_grade_list += " OR "
-
-            year_grade_list += f"(caseless_eq(`schoolyear`, \"{get_school_year(year)}\") AND caseless_one_of(`gradelevel`, {get_grade_as_string(i)}))\n"
+        for year, grade in get_cohort_year_grades(grad_cohort):
+            grades_by_year.setdefault(year, set()).add(grade)
 
+    year_grade_list = " OR ".join(
+        f"(caseless_eq(`schoolyear`, \"{get_school_year(year)}\") AND caseless_one_of(`gradelevel`, {', '.join(get_grade_as_string(grade) for grade in sorted(grades))}))\n"
+        for year, grades in sorted(grades_by_year.items()))
+
+    student_groups_normalized = [student_group.replace(" ", "_").lower() for student_group in student_groups]
+    if "all_students" not in student_groups_normalized:
+        # Always fetch All Students, since percentages are computed against it.
+        student_groups_normalized.append("all_students")
+    select_list = "`schoolyear`, `gradelevel`, `districtcode`, `districtname`"
+    for student_group_normalized in student_groups_normalized:
+        select_list += f", sum(`{student_group_normalized}`) AS `{student_group_normalized}_enrollment`"
+
+    districts = {}
+    district_codes = [str(district) for district in district_ids]
+    for chunk_start in range(0, len(district_codes), ENROLLMENT_DISTRICTS_PER_QUERY):
+        chunk = district_codes[chunk_start:chunk_start + ENROLLMENT_DISTRICTS_PER_QUERY]
+        district_list = ", ".join(f"'{district}'" for district in chunk)
         query = f"""
-SELECT {select_list}, {grad_cohort} as `grad_cohort`
-WHERE caseless_eq(`districtcode`, '{district_id}')
+SELECT {select_list}
+WHERE caseless_one_of(`districtcode`, {district_list})
 AND caseless_eq(`organizationlevel`, 'District')
 AND ({year_grade_list})
-GROUP BY `schoolyear`, `districtcode`, `districtname`
-ORDER BY `schoolyear` ASC
+GROUP BY `schoolyear`, `gradelevel`, `districtcode`, `districtname`
+ORDER BY `districtcode` ASC, `schoolyear` ASC
 """
+        response = execute_enrollment_query(query, parse_enrollment_rows)
+        if "error" in response:
+            return response
+        # Each chunk covers different districts.
+        districts.update(response["districts"])
 
-        grad_cohort_results = execute_enrollment_query(query)
-
-        if "error" in grad_cohort_results:
-            return f"Error executing query for grad cohort {grad_cohort}: {grad_cohort_results['error']}"
-
-        # Fix up the returned data to add some additional relevant fields.
-        prev_enrollment = {}
-        for grad_cohort_result in grad_cohort_results:
-            grad_cohort_result["schoolyear_num"] = get_school_year_from_string(grad_cohort_result.get("schoolyear", ""))
-            grad_cohort_result["gradelevel_num"] = 12 - (grad_cohort - grad_cohort_result.get("schoolyear_num", 0))
-            grad_cohort_result["gradelevel_str"] = get_grade_as_string(grad_cohort_result.get("gradelevel_num", "Unknown Grade"), False)
-
-            # Calculate percentages and grade progression ratios for each student group.
-            all_students_enrollment_raw = grad_cohort_result.get("all_students_enrollment", "0")
-            all_students_enrollment = int(all_students_enrollment_raw if all_students_enrollment_raw != "NULL" else "0")
-            
-            for student_group in student_groups:
-                student_group_normalized = student_group.replace(" ", "_").lower()
-                enrollment_field = f"{student_group_normalized}_enrollment"
-                enrollment_raw = grad_cohort_result.get(enrollment_field, "0")
-                enrollment = int(enrollment_raw if enrollment_raw != "NULL" else "0")
-                
-                # Calculate percentage of total student body
-                if all_students_enrollment > 0:
-                    percentage = (enrollment / all_students_enrollment) * 100
-                    # TODO: _percentage is written for the "All Students" group in addition to any other groups.
-                    # Could suppress all_students_percentage from being written if desired, since it's always 100%.
-                    grad_cohort_result[f"{student_group_normalized}_percentage"] = round(percentage, 3)
-                else:
-                    grad_cohort_result[f"{student_group_normalized}_percentage"] = 0
-                
-                # Calculate grade progression ratio (current year / previous year)
-                if enrollment_field in prev_enrollment:
-                    prev_year_enrollment = prev_enrollment[enrollment_field]
-                    if prev_year_enrollment > 0:
-                        progression_ratio = enrollment / prev_year_enrollment
-                        grad_cohort_result[f"{student_group_normalized}_progression_ratio"] = round(progression_ratio, 3)
-                    else:
-                        grad_cohort_result[f"{student_group_normalized}_progression_ratio"] = None
-                else:
-                    grad_cohort_result[f"{student_group_normalized}_progression_ratio"] = None
-                
-                # Store current enrollment for next iteration
-                prev_enrollment[enrollment_field] = enrollment
-            
-            # We don't need this info in each individual year's record. Later on, we'll write it once for the entire dataset for this grad cohort.
-            grad_cohort_result.pop("districtcode")
-            district_name = grad_cohort_result.pop("districtname")
-            grad_cohort_result.pop("grad_cohort")
-
-        results.append( {
-            "districtcode": district_id,
-            "districtname": district_name,
-            "grad_cohort": grad_cohort,
-            "enrollment_data": grad_cohort_results
-        })
+    return {"districts": districts}
 
-    return results
+def parse_enrollment_rows(rows) -> dict:
+    """Add up the rows of a cohort enrollment query by district, school year and grade as they're decoded.
+
+    Returns {"districts": ...} in the shape get_cohort_enrollment returns. Each row's counts are its
+    <group>_enrollment columns; a count the portal leaves out (every value was null) is left out too,
+    and read as 0."""
+    districts = {}
+    for row in rows:
+        grade = get_grade_from_string(row.get("gradelevel", ""))
+        if grade is None:
+            continue
+        district = districts.setdefault(row.get("districtcode"), {"districtname": row.get("districtname"), "enrollment": {}})
+        # Kindergarten shows up under several grade level names, so add them together.
+        counts = district["enrollment"].setdefault((get_school_year_from_string(row.get("schoolyear", "")), grade), {})
+        for column, raw in row.items():
+            if column.endswith("_enrollment"):
+                student_group_normalized = column[:-len("_enrollment")]
+                counts[student_group_normalized] = counts.get(student_group_normalized, 0) + int(raw if raw != "NULL" else "0")
+    return {"districts": districts}
 
 def get_available_enrollment_years():
     """Get a list of available enrollment years."""
-    years = execute_enrollment_query("SELECT `schoolyear` GROUP BY `schoolyear`")
-
-    years_as_int = []
-    for year in years:
-        years_as_int.append(get_school_year_from_string(year.get("schoolyear", "")))
+    entry = get_catalog().get(config_data["enrollment_sets"][0]["url"], "enrollment")
+    if "error" in entry:
+        return entry
 
-    return years_as_int
+    return entry["years"]
 
-def execute_enrollment_query(query: str):
+def execute_enrollment_query(query: str, parse=list):
     """Execute a query against the enrollment dataset (single dataset for 2014-15 through current year)"""
     # TODO: Make sure enrollment_sets is properly configured.
 
-    return execute_query(config_data["enrollment_sets"][0]["url"], query)
\ No newline at end of file
+    return execute_query(config_data["enrollment_sets"][0]["url"], query, parse)
\ No newline at end of file
@@ -0,0 +1,80 @@
+"""Incremental decoding of JSON array responses, one item at a time as the body arrives."""
+import codecs
+import json
+
+# Bytes read from the response per chunk.
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = "0123456789.eE+-"
+_decoder = json.JSONDecoder()
+
+# Parser states
+_START, _FIRST_ITEM, _ITEM, _AFTER_ITEM, _END = range(5)
+
+def _texts(chunks):
+    """Decode UTF-8 byte chunks to text, flagging the final (flushed) piece."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        yield decoder.decode(chunk), False
+    yield decoder.decode(b"", final=True), True
+
+def _may_continue(item, buffer: str, end: int) -> bool:
+    """Whether an item decoded from the buffer might still be cut short by the end of the buffer.
+
+    A value ending exactly at the end of the buffer could be a number with more digits to come. A
+    number can also decode short when it was split after its "." or exponent mark ("12." decodes as
+    12), leaving only number characters after it."""
+    if end == len(buffer):
+        return True
+    return isinstance(item, (int, float)) and not isinstance(item, bool) and all(c in _NUMBER_CHARS for c in buffer[end:])
+
+def iter_json_array(chunks):
+    """Yield the items of a top-level JSON array from an iterable of byte chunks (e.g. response.iter_content()).
+
+    Only the not-yet-decoded tail of the body is buffered, so the raw response is never held in
+    memory alongside the decoded items. Raises ValueError if the body is not a complete JSON array."""
+    buffer = ""
+    state = _START
+    for text, final in _texts(chunks):
+        buffer += text
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            if position == len(buffer):
+                break
+
+            char = buffer[position]
+            if state == _START:
+                if char != "[":
+                    raise ValueError(f"Expected a JSON array, got {buffer[position:position + 80]!r}")
+                state = _FIRST_ITEM
+                position += 1
+            elif state == _END:
+                raise ValueError("Unexpected data after the end of the JSON array")
+            elif char == "]" and state in (_FIRST_ITEM, _AFTER_ITEM):
+                state = _END
+                position += 1
+            elif state == _AFTER_ITEM:
+                if char != ",":
+                    raise ValueError(f"Expected ',' or ']' between array items, got {char!r}")
+                state = _ITEM
+                position += 1
+            else:
+                try:
+                    item, end = _decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    # The item continues in the next chunk.
+                    break
+                if not final and _may_continue(item, buffer, end):
+                    break
+                yield item
+                state = _AFTER_ITEM
+                position = end
+        buffer = buffer[position:]
+
+    if state != _END:
+        raise ValueError("Truncated JSON array")
@@ -0,0 +1,209 @@
+"""Lightweight timing spans for tool calls, portal queries and post-processing stages.
+
+Spans nest through a context variable, so a query span opened while a tool span is active
+is recorded as that tool's child. Each finished span updates per-name aggregates (count,
+errors, durations) and is kept in a short history of recent tool calls. Everything is exposed
+through the get_server_stats tool and, under an HTTP transport, a Prometheus-style /metrics
+endpoint."""
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from collections import deque
+
+# Histogram bucket upper bounds (seconds) for the Prometheus endpoint.
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+RECENT_SAMPLES = 500
+RECENT_TOOL_CALLS = 50
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_lock = threading.Lock()
+_aggregates = {}
+_recent_tool_calls = deque(maxlen=RECENT_TOOL_CALLS)
+_started_at = time.time()
+
+class Span:
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.children = []
+        self.error = None
+        self.started_at = time.time()
+        self.duration = None
+
+    def set(self, **attributes):
+        """Add attributes (e.g. bytes, rows, cache status) to the span."""
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        span = {
+            "name": self.name,
+            "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+            **self.attributes
+        }
+        if self.error:
+            span["error"] = self.error
+        if self.children:
+            span["children"] = [child.to_dict() for child in self.children]
+        return span
+
+class _SpanContext:
+    def __init__(self, name: str, attributes: dict):
+        self.span = Span(name, attributes)
+
+    def __enter__(self) -> Span:
+        self._start = time.perf_counter()
+        self._parent = _current_span.get()
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.duration = time.perf_counter() - self._start
+        if exc is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        _record(self.span, self._parent)
+        return False
+
+def span(name: str, **attributes) -> _SpanContext:
+    """Time a block of code: `with span("aggregate_scores", rows=len(rows)) as s: ...`"""
+    return _SpanContext(name, attributes)
+
+def annotate(**attributes):
+    """Add attributes to the innermost active span, if there is one."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+def _record(finished: Span, parent: Span):
+    with _lock:
+        if parent is not None:
+            parent.children.append(finished)
+        if finished.name.startswith("tool:"):
+            _recent_tool_calls.append(finished)
+
+        aggregate = _aggregates.get(finished.name)
+        if aggregate is None:
+            aggregate = _aggregates[finished.name] = {
+                "count": 0, "errors": 0, "total": 0.0, "max": 0.0,
+                "buckets": [0] * len(DURATION_BUCKETS), "samples": deque(maxlen=RECENT_SAMPLES),
+                "bytes": 0, "rows": 0, "cache": {}
+            }
+        aggregate["count"] += 1
+        aggregate["total"] += finished.duration
+        aggregate["max"] = max(aggregate["max"], finished.duration)
+        aggregate["samples"].append(finished.duration)
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if finished.duration <= bound:
+                aggregate["buckets"][i] += 1
+        if finished.error or finished.attributes.get("error"):
+            aggregate["errors"] += 1
+        aggregate["bytes"] += finished.attributes.get("bytes", 0) or 0
+        aggregate["rows"] += finished.attributes.get("rows", 0) or 0
+        cache_status = finished.attributes.get("cache")
+        if cache_status:
+            aggregate["cache"][cache_status] = aggregate["cache"].get(cache_status, 0) + 1
+
+def instrument_tool(fn, name: str = None):
+    """Wrap a tool function so every call is recorded as a "tool:<name>" span."""
+    span_name = f"tool:{name or fn.__name__}"
+
+    def record_result(tool_span, result):
+        if isinstance(result, dict) and "error" in result:
+            tool_span.set(error=result["error"])
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            with span(span_name) as tool_span:
+                result = await fn(*args, **kwargs)
+                record_result(tool_span, result)
+                return result
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with span(span_name) as tool_span:
+            result = fn(*args, **kwargs)
+            record_result(tool_span, result)
+            return result
+    return wrapper
+
+def _percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def get_stats(recent: int = 10) -> dict:
+    """Per-span-name aggregates plus the most recent tool calls with their nested spans."""
+    with _lock:
+        spans = {}
+        for name, aggregate in sorted(_aggregates.items()):
+            samples = list(aggregate["samples"])
+            spans[name] = {
+                "count": aggregate["count"],
+                "errors": aggregate["errors"],
+                "total_ms": round(aggregate["total"] * 1000, 2),
+                "mean_ms": round(aggregate["total"] / aggregate["count"] * 1000, 2),
+                "p50_ms": round(_percentile(samples, 0.5) * 1000, 2),
+                "p95_ms": round(_percentile(samples, 0.95) * 1000, 2),
+                "max_ms": round(aggregate["max"] * 1000, 2)
+            }
+            if aggregate["bytes"]:
+                spans[name]["bytes"] = aggregate["bytes"]
+            if aggregate["rows"]:
+                spans[name]["rows"] = aggregate["rows"]
+            if aggregate["cache"]:
+                spans[name]["cache"] = dict(aggregate["cache"])
+        recent_calls = [tool_span.to_dict() for tool_span in list(_recent_tool_calls)[-recent:]] if recent else []
+
+    return {
+        "uptime_seconds": round(time.time() - _started_at, 1),
+        "spans": spans,
+        "recent_tool_calls": recent_calls
+    }
+
+def render_prometheus() -> str:
+    """Render span aggregates in the Prometheus text exposition format."""
+    lines = [
+        "# HELP wa_ed_span_duration_seconds Duration of tool calls, portal queries and processing stages.",
+        "# TYPE wa_ed_span_duration_seconds histogram"
+    ]
+    with _lock:
+        # Keyed by the span name escaped for use as a label value.
+        aggregates = {
+            name.replace("\\", "\\\\").replace('"', '\\"'): dict(aggregate, cache=dict(aggregate["cache"]))
+            for name, aggregate in sorted(_aggregates.items())
+        }
+
+    for label, aggregate in aggregates.items():
+        for bound, count in zip(DURATION_BUCKETS, aggregate["buckets"]):
+            lines.append(f'wa_ed_span_duration_seconds_bucket{{span="{label}",le="{bound}"}} {count}')
+        lines.append(f'wa_ed_span_duration_seconds_bucket{{span="{label}",le="+Inf"}} {aggregate["count"]}')
+        lines.append(f'wa_ed_span_duration_seconds_sum{{span="{label}"}} {aggregate["total"]}')
+        lines.append(f'wa_ed_span_duration_seconds_count{{span="{label}"}} {aggregate["count"]}')
+
+    lines.append("# HELP wa_ed_span_errors_total Spans that ended in an error.")
+    lines.append("# TYPE wa_ed_span_errors_total counter")
+    for label, aggregate in aggregates.items():
+        lines.append(f'wa_ed_span_errors_total{{span="{label}"}} {aggregate["errors"]}')
+
+    lines.append("# HELP wa_ed_response_bytes_total Response bytes received by span.")
+    lines.append("# TYPE wa_ed_response_bytes_total counter")
+    for label, aggregate in aggregates.items():
+        if aggregate["bytes"]:
+            lines.append(f'wa_ed_response_bytes_total{{span="{label}"}} {aggregate["bytes"]}')
+
+    lines.append("# HELP wa_ed_rows_total Rows returned by span.")
+    lines.append("# TYPE wa_ed_rows_total counter")
+    for label, aggregate in aggregates.items():
+        if aggregate["rows"]:
+            lines.append(f'wa_ed_rows_total{{span="{label}"}} {aggregate["rows"]}')
+
+    lines.append("# HELP wa_ed_cache_results_total Query results by cache status.")
+    lines.append("# TYPE wa_ed_cache_results_total counter")
+    for label, aggregate in aggregates.items():
+        for status, count in aggregate["cache"].items():
+            lines.append(f'wa_ed_cache_results_total{{span="{label}",status="{status}"}} {count}')
+
+    return "\n".join(lines) + "\n"
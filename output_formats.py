@@ -0,0 +1,98 @@
+"""Opt-in compact output for the tools with large results.
+
+Tools marked with @shaped_output get extra output_format, fields, limit and offset parameters when
+they're registered with the server (calling the functions directly, as the precompute job and
+benchmarks do, always gives the full result). The lists of records in a result (e.g. the
+ranked districts of analyze_trends) can be trimmed to the requested fields and to a page of limit
+records starting at offset. With output_format set to "compact", every list of records is also
+laid out as one array per field instead of one object per record, the echoed query text and
+fields that repeat what other fields say are left out, and the result is sent as JSON without
+indentation. For statewide or many-group calls this cuts the JSON that goes over stdio, and into
+the model's context, several times over."""
+import functools
+import inspect
+
+import pydantic_core
+
+OUTPUT_FORMATS = ("full", "compact")
+
+# Fields that only repeat information that's in other fields, left out of compact output.
+# (all_students_percentage is always 100; the _num/_str fields restate schoolyear and the grade.)
+DEFAULT_COMPACT_DROP = ("query", "all_students_percentage", "gradelevel_str", "schoolyear_num")
+
+def shaped_output(function=None, *, compact_drop: tuple = DEFAULT_COMPACT_DROP):
+    """Mark a tool whose result can be reshaped with output_format, fields, limit and offset."""
+    def mark(function):
+        function.compact_drop = compact_drop
+        return function
+    return mark(function) if function is not None else mark
+
+def is_record_list(value) -> bool:
+    return isinstance(value, list) and bool(value) and all(isinstance(item, dict) for item in value)
+
+def has_record_lists(record: dict) -> bool:
+    return any(is_record_list(value) for value in record.values())
+
+def shape_result(result, output_format: str = "full", fields: list = None, limit: int = None, offset: int = 0, compact_drop: tuple = DEFAULT_COMPACT_DROP):
+    """Apply field projection, paging and (for "compact") the columnar layout to the lists of records in a result.
+
+    Projection and paging apply to the innermost lists of records, and projection only to lists
+    with at least one of the requested fields, so e.g. fields=["district_id", "rank"] with limit=5
+    gives the top five districts of every year and student group of analyze_trends."""
+    if output_format not in OUTPUT_FORMATS:
+        return {"error": f"Unknown output_format {output_format}. Use one of: {', '.join(OUTPUT_FORMATS)}"}
+    if isinstance(result, str) or (isinstance(result, dict) and "error" in result):
+        return result
+    wanted = set(fields) if fields else None
+    # Compact output leaves out the redundant fields, unless they were asked for by name.
+    drop = set(compact_drop) - (wanted or set()) if output_format == "compact" else set()
+
+    def shape(value):
+        if isinstance(value, dict):
+            return {key: shape(item) for key, item in value.items() if key not in drop}
+        if not is_record_list(value):
+            return value
+
+        keys = list(dict.fromkeys(key for record in value for key in record))
+        innermost = not any(has_record_lists(record) for record in value)
+        page = value
+        if innermost:
+            if wanted is not None and wanted.intersection(keys):
+                keys = [key for key in keys if key in wanted]
+            page = value[offset:offset + limit] if limit is not None else value[offset:]
+        keys = [key for key in keys if key not in drop]
+        # Values in the innermost lists have nothing left to shape, so they're used as they are.
+        shape_value = (lambda item: item) if innermost else shape
+
+        if output_format == "compact":
+            return {"total": len(value), "columns": {key: [shape_value(record.get(key)) for record in page] for key in keys}}
+        return [{key: shape_value(record[key]) for key in keys if key in record} for record in page]
+
+    return shape(result)
+
+def with_output_options(function):
+    """Wrap a @shaped_output tool so it takes output_format, fields, limit and offset, keeping its
+    other parameters and docstring, for registering with the server."""
+    signature = inspect.signature(function)
+    compact_drop = function.compact_drop
+
+    @functools.wraps(function)
+    def wrapper(*args, output_format: str = "full", fields: list = None, limit: int = None, offset: int = 0, **kwargs):
+        result = shape_result(function(*args, **kwargs), output_format, fields, limit, offset, compact_drop)
+        if output_format == "compact" and not isinstance(result, str) and not (isinstance(result, dict) and "error" in result):
+            # Returned as text, serialized as FastMCP would but without indentation.
+            return pydantic_core.to_json(result, fallback=str).decode("utf-8")
+        return result
+
+    wrapper.__signature__ = signature.replace(parameters=[
+        *signature.parameters.values(),
+        inspect.Parameter("output_format", inspect.Parameter.KEYWORD_ONLY, default="full", annotation=str),
+        inspect.Parameter("fields", inspect.Parameter.KEYWORD_ONLY, default=None, annotation=list),
+        inspect.Parameter("limit", inspect.Parameter.KEYWORD_ONLY, default=None, annotation=int),
+        inspect.Parameter("offset", inspect.Parameter.KEYWORD_ONLY, default=0, annotation=int)
+    ])
+    wrapper.__doc__ = (function.__doc__ or "") + """
+    Output options: output_format="compact" lays lists of records out as one array per field, without
+    the query text and redundant fields; fields keeps only the listed fields of each record; limit and
+    offset return one page of each innermost list of records (compact lists also give the "total")."""
+    return wrapper
@@ -0,0 +1,156 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Status codes that the Socrata portal returns for transient problems. Anything else is
+# treated as a real error and surfaced immediately.
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def parse_retry_after(value) -> float:
+    """Parse a Retry-After header (either delay-seconds or an HTTP date) into seconds from now."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class HostRateLimiter:
+    """Token bucket rate limiter, tracked separately for each host."""
+
+    def __init__(self, requests_per_second: float, burst: int):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host: str) -> float:
+        """Block until a request to host is allowed. Returns the number of seconds spent waiting."""
+        if not self.requests_per_second:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at, paused_until = self._buckets.get(host, (self.burst, now, 0.0))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.requests_per_second)
+            # Reserve a token now, even if that takes the bucket negative, so that
+            # concurrent callers queue up behind each other instead of all waking at once.
+            tokens -= 1
+            wait = max(-tokens / self.requests_per_second if tokens < 0 else 0.0, paused_until - now)
+            self._buckets[host] = (tokens, now, paused_until)
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, host: str, seconds: float):
+        """Hold off all requests to host for the given number of seconds (e.g. after a 429)."""
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at, paused_until = self._buckets.get(host, (self.burst, now, 0.0))
+            self._buckets[host] = (tokens, updated_at, max(paused_until, now + seconds))
+
+class PortalClient:
+    """Shared HTTP client for the data.wa.gov portal.
+
+    Wraps a single requests.Session so that connections are kept alive and reused across
+    tool calls, retries transient failures with jittered exponential backoff (honoring
+    Retry-After), and rate limits requests per host."""
+
+    def __init__(self, pool_size: int = 10, timeout: float = 10, max_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 requests_per_second: float = 5, burst: int = 10):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = HostRateLimiter(requests_per_second, burst)
+
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttles = 0
+        self.rate_limited_seconds = 0.0
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given (zero-based) retry attempt."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _count(self, counter: str, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Send a GET request, retrying transient failures. Raises requests.exceptions.RequestException
+        (including HTTPError for non-2xx responses) once retries are exhausted."""
+        host = urlsplit(url).netloc
+        kwargs.setdefault("timeout", self.timeout)
+
+        attempt = 0
+        while True:
+            waited = self.rate_limiter.acquire(host)
+            if waited:
+                self._count("rate_limited_seconds", waited)
+            self._count("requests")
+
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                self._count("retries")
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                response.raise_for_status()
+                return response
+
+            delay = self._backoff(attempt)
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if response.status_code == 429:
+                self._count("throttles")
+                # Make every caller hitting this host back off, not just this one.
+                self.rate_limiter.pause(host, retry_after if retry_after is not None else delay)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.backoff_max * 4))
+
+            response.close()
+            self._count("retries")
+            time.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> dict:
+        """Return request, retry, throttle and connection reuse counters."""
+        connections_opened = 0
+        pooled_requests = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections_opened += pool.num_connections
+                pooled_requests += pool.num_requests
+
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttles": self.throttles,
+            "rate_limited_seconds": round(self.rate_limited_seconds, 3),
+            "connections_opened": connections_opened,
+            "connections_reused": max(0, pooled_requests - connections_opened)
+        }
@@ -0,0 +1,256 @@
+"""Precomputed results for common get_district_scores and analyze_trends calls.
+
+Run `python precompute.py run` to compute the tool results for every combination listed under
+"precompute" in wa-ed-config.json and store them in a local SQLite file. It's meant to be run on
+a schedule (e.g. nightly from cron); combinations whose datasets haven't changed since they were
+last computed are skipped. The tools answer calls that exactly match a stored combination from
+the store, and fall back to live queries for everything else.
+
+Results are stored per data backend, so a result computed from the live portal is never served
+under the snapshot backend or the other way round. Each stored result records the version (the
+portal's rowsUpdatedAt) of every dataset view it was computed from. A result is out of date, and
+no longer served, once one of its live views (the current assessment year or enrollment) reports
+a different version. Views for past years are frozen, so they're never re-checked. Under the
+snapshot backend the snapshot file's modification time stands in for the version of every view,
+and the portal isn't asked at all."""
+import argparse
+import functools
+import hashlib
+import inspect
+import json
+import threading
+import time
+
+import metrics
+from utils import load_config, load_environment, get_current_view_version, get_data_backend, get_live_urls, get_precomputed_store, get_view_last_modified, track_datasets
+
+DEFAULT_STORE_PATH = ".cache/precomputed.sqlite3"
+DEFAULT_VERSION_CHECK_SECONDS = 300
+
+# Bump when the output of a precomputed tool changes shape, so old results are no longer served.
+RESULT_FORMAT_VERSION = 1
+
+def make_key(tool_name: str, arguments: dict, backend: str) -> str:
+    """Build the store key for a tool call from its full set of arguments (defaults included) and the data backend."""
+    canonical = json.dumps({"tool": tool_name, "arguments": arguments, "backend": backend, "format": RESULT_FORMAT_VERSION}, sort_keys=True)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class PrecomputedStore:
+    """SQLite-backed store of tool results, keyed by tool call, with the dataset versions they were computed from."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._lock = threading.Lock()
+
+        # Imported here so that loading the tools doesn't pay for sqlite3 until the store is used.
+        from sqlite_store import SharedConnection
+        self._db = SharedConnection(path, ["""CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY,
+            tool TEXT NOT NULL,
+            arguments TEXT NOT NULL,
+            result BLOB NOT NULL,
+            versions TEXT NOT NULL,
+            computed_at REAL NOT NULL
+        )"""])
+
+    @property
+    def _conn(self):
+        return self._db.get()
+
+    def get(self, key: str):
+        """Return {"result", "versions", "computed_at"} for a key, or None if nothing is stored."""
+        with self._lock:
+            row = self._conn.execute("SELECT result, versions, computed_at FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        result, versions, computed_at = row
+        return {"result": json.loads(result), "versions": json.loads(versions), "computed_at": computed_at}
+
+    def count(self, outcome: str):
+        """Count a lookup as a hit, miss or stale result."""
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def put(self, key: str, tool_name: str, arguments: dict, result, versions: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, tool, arguments, result, versions, computed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, tool_name, json.dumps(arguments, sort_keys=True), json.dumps(result, separators=(",", ":")).encode("utf-8"),
+                 json.dumps(versions, sort_keys=True), time.time()))
+            self._conn.commit()
+
+    def clear(self):
+        """Remove every stored result."""
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """Return hit/miss/stale counters and the number of stored results per tool."""
+        with self._lock:
+            rows = self._conn.execute("SELECT tool, COUNT(*), MIN(computed_at), MAX(computed_at) FROM results GROUP BY tool ORDER BY tool").fetchall()
+        return {
+            "path": self.path,
+            "results": {
+                tool: {
+                    "count": count,
+                    "oldest": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(oldest)),
+                    "newest": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(newest))
+                }
+                for tool, count, oldest, newest in rows
+            },
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale
+        }
+
+def get_current_version(url: str):
+    """Get a dataset view's current version, checking the portal at most once every version_check_seconds."""
+    return get_current_view_version(url, load_config().get("precompute", {}).get("version_check_seconds", DEFAULT_VERSION_CHECK_SECONDS))
+
+def get_versions(urls: set, backend: str) -> dict:
+    """Get the version of every dataset view in urls, as of now, for the given backend."""
+    if backend == "snapshot":
+        from snapshot import get_snapshot_version
+        version = get_snapshot_version()
+        return {url: version for url in sorted(urls)}
+    return {url: get_view_last_modified(url) for url in sorted(urls)}
+
+def is_current(versions: dict, backend: str) -> bool:
+    """Check whether a stored result's datasets are still at the versions it was computed from.
+
+    Under the snapshot backend that's every dataset (a sync can change any of them), otherwise the
+    live ones. If the current version can't be found, the stored result is trusted."""
+    if backend == "snapshot":
+        from snapshot import get_snapshot_version
+        current = get_snapshot_version()
+        return current is None or all(version == current for version in versions.values())
+    live_urls = get_live_urls()
+    for url, version in versions.items():
+        if url not in live_urls:
+            continue
+        current = get_current_version(url)
+        if current is not None and current != version:
+            return False
+    return True
+
+def materialized(function):
+    """Answer calls to a tool from the precomputed store when there's an up-to-date result for the exact
+    same arguments, otherwise call the tool as usual. The undecorated tool is function.__wrapped__."""
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        store = get_precomputed_store()
+        if store is None:
+            return function(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        backend = get_data_backend()
+        with metrics.span("precomputed_lookup") as lookup_span:
+            entry = store.get(make_key(function.__name__, bound.arguments, backend))
+            if entry is None:
+                store.count("misses")
+                lookup_span.set(cache="miss")
+            elif not is_current(entry["versions"], backend):
+                store.count("stale")
+                lookup_span.set(cache="stale")
+            else:
+                store.count("hits")
+                lookup_span.set(cache="hit")
+                return entry["result"]
+        return function(*args, **kwargs)
+    return wrapper
+
+def get_combinations(config: dict) -> list:
+    """Expand the configured combinations into (multidistrict set ID, tool function, arguments) tuples."""
+    import server
+    precompute_config = config.get("precompute", {})
+    set_ids = precompute_config.get("multidistrict_sets") or [s["id"] for s in config.get("multidistrict_sets", [])]
+    calls = []
+    for combination in precompute_config.get("combinations", []):
+        for set_id in set_ids:
+            multidistrict_set = server.get_multidistrict_set(set_id)
+            if "error" in multidistrict_set:
+                continue
+            for subject in combination["subjects"]:
+                for grade in combination["grades"]:
+                    calls.append((set_id, server.get_district_scores, {
+                        "district_ids": multidistrict_set["districts"],
+                        "subject": subject,
+                        "grade": grade,
+                        "student_groups": combination["student_groups"]
+                    }))
+                    calls.append((set_id, server.analyze_trends, {
+                        "multidistrict_set_id": set_id,
+                        "subject": subject,
+                        "grade": grade,
+                        "student_groups": combination["student_groups"]
+                    }))
+    return calls
+
+def run(force: bool = False, log=print) -> dict:
+    """Compute and store every configured combination that is missing or out of date."""
+    config = load_config()
+    store = get_precomputed_store()
+    if store is None:
+        log("Precomputing is disabled in the config")
+        return {}
+
+    # Take every view's version before computing anything. If a view changes while the job is
+    # running, the results are recorded against the older version and get recomputed next time.
+    backend = get_data_backend()
+    urls = {a["url"] for a in config.get("assessment_sets", [])} | {e["url"] for e in config.get("enrollment_sets", [])}
+    versions = get_versions(urls, backend)
+
+    summary = {"computed": 0, "skipped": 0, "failed": 0}
+    for set_id, tool, arguments in get_combinations(config):
+        function = tool.__wrapped__
+        bound = inspect.signature(function).bind(**arguments)
+        bound.apply_defaults()
+        key = make_key(function.__name__, bound.arguments, backend)
+        description = f"{set_id} {function.__name__} {arguments['subject']} grade {arguments['grade']}"
+
+        entry = store.get(key)
+        if entry is not None and not force and all(entry["versions"].get(url) == version for url, version in versions.items() if url in entry["versions"]):
+            summary["skipped"] += 1
+            continue
+
+        with track_datasets() as used_urls:
+            result = function(**bound.arguments)
+        if isinstance(result, dict) and "error" in result:
+            log(f"{description}: error: {result['error']}")
+            summary["failed"] += 1
+            continue
+
+        store.put(key, function.__name__, bound.arguments, result, {url: versions.get(url) for url in used_urls})
+        log(f"{description}: computed")
+        summary["computed"] += 1
+
+    return summary
+
+if __name__ == "__main__":
+    load_environment()
+
+    parser = argparse.ArgumentParser(description="Manage precomputed results for common tool calls.")
+    parser.add_argument("command", choices=["run", "status", "clear"])
+    parser.add_argument("--force", action="store_true", help="Recompute every combination, even if its datasets haven't changed.")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        # Compute from fresh portal responses. A cached response for a live view could be older
+        # than the view version the result is recorded against.
+        load_config().setdefault("response_cache", {})["enabled"] = False
+        summary = run(force=args.force)
+        print(f"{summary.get('computed', 0)} computed, {summary.get('skipped', 0)} up to date, {summary.get('failed', 0)} failed")
+    elif args.command == "status":
+        store = get_precomputed_store()
+        print(json.dumps(store.stats() if store is not None else {"enabled": False}, indent=2))
+    else:
+        store = get_precomputed_store()
+        if store is not None:
+            store.clear()
@@ -0,0 +1,100 @@
+"""Compact typed records for assessment score rows.
+
+Portal rows arrive as dicts of strings. Score queries turn them into slotted objects with integer
+counts and interned district codes and student group names as soon as the response comes back,
+and aggregation, ranking and trend analysis all work on those. Dicts are only built again when a
+tool assembles its output."""
+import sys
+
+from assessment_sets import DEFAULT_STUDENT_GROUP_ALIASES
+from utils import get_school_year_from_string
+
+class ScoreRow:
+    """One portal row: a district's student counts for a single test, school year and student group."""
+    __slots__ = ("school_year", "district_id", "student_group", "total_students", "consistent_grade_level")
+
+    def __init__(self, school_year: str, district_id: str, student_group: str, total_students: int, consistent_grade_level: int):
+        self.school_year = school_year
+        self.district_id = district_id
+        self.student_group = student_group
+        self.total_students = total_students
+        self.consistent_grade_level = consistent_grade_level
+
+class ScoreResult:
+    """A district's combined score across tests for one student group and year."""
+    __slots__ = ("student_group", "district_id", "total_students", "consistent_grade_level", "percent_consistent_grade_level")
+
+    def __init__(self, student_group: str, district_id: str, total_students: int = 0, consistent_grade_level: int = 0, percent_consistent_grade_level: float = None):
+        self.student_group = student_group
+        self.district_id = district_id
+        self.total_students = total_students
+        self.consistent_grade_level = consistent_grade_level
+        self.percent_consistent_grade_level = percent_consistent_grade_level
+
+    def to_dict(self) -> dict:
+        return {
+            "student_group": self.student_group,
+            "district_id": self.district_id,
+            "total_students": self.total_students,
+            "consistent_grade_level": self.consistent_grade_level,
+            "percent_consistent_grade_level": self.percent_consistent_grade_level
+        }
+
+def parse_count(value) -> int:
+    """Parse a student count from the portal, where suppressed or missing counts are "NULL"."""
+    if value is None or value == "NULL":
+        return 0
+    return int(value)
+
+def parse_sum(value) -> int:
+    """Parse a student count summed by the portal, which may have a decimal part (e.g. "123.0") or be missing."""
+    if value is None or value == "NULL":
+        return 0
+    return int(float(value))
+
+def get_row_year(record: dict):
+    """The year (e.g. 2024) of a row's school year, or the school year as it is if it can't be parsed."""
+    school_year = record.get("schoolyear")
+    try:
+        return get_school_year_from_string(school_year)
+    except (AttributeError, IndexError, ValueError):
+        return school_year
+
+def parse_score_rows(response, student_group_aliases: dict = DEFAULT_STUDENT_GROUP_ALIASES):
+    """Convert the rows of a scores query (a list, or rows as they're decoded; see utils.execute_query)
+    to ScoreRows, renaming student groups the data spells differently (data name -> output name).
+    Returns the list of rows, or an error dict."""
+    rows = []
+    intern = sys.intern
+    for record in response:
+        student_group = record.get("studentgroup")
+        district_id = record.get("districtcode")
+        if not student_group:
+            return {"error": "Missing studentgroup in record"}
+        if not district_id:
+            return {"error": "Missing districtcode in record"}
+
+        try:
+            total_students = parse_count(record.get("count_of_students_expected", "0"))
+            consistent_grade_level = parse_count(record.get("count_consistent_grade_level", "0"))
+        except ValueError:
+            return {"error": "Error converting student counts to integers",
+                    "studentgroup": student_group,
+                    "studentgroup_adjusted": student_group_aliases.get(student_group, student_group),
+                    "district_id": district_id,
+                    "year": get_row_year(record),
+                    "record": record
+                   }
+
+        rows.append(ScoreRow(
+            intern(str(record.get("schoolyear", "")).lower()),
+            intern(district_id),
+            intern(student_group_aliases.get(student_group, student_group)),
+            total_students,
+            consistent_grade_level
+        ))
+    return rows
+
+def scores_to_dicts(results: list) -> list:
+    """Convert ScoreResults to plain dicts for tool output."""
+    return [result.to_dict() for result in results]
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from json_stream import CHUNK_SIZE, iter_json_array
+from sqlite_store import SharedConnection
+
+# Matches a quoted string literal (single, double or backtick quoted) so that query
+# normalization can leave the contents of literals alone.
+_LITERAL_PATTERN = re.compile(r"(\"[^\"]*\"|'[^']*'|`[^`]*`)")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# How long a process waits for another process's fetch of the same query before sending its own.
+DEFAULT_CLAIM_SECONDS = 60
+CLAIM_POLL_SECONDS = 0.05
+
+def normalize_query(query_string: str) -> str:
+    """Normalize a SoQL query so that cosmetic whitespace differences map to the same cache entry."""
+    parts = _LITERAL_PATTERN.split(query_string)
+    normalized = []
+    for i, part in enumerate(parts):
+        if i % 2 == 1:
+            # Odd entries are the captured string literals; keep them exactly as written.
+            normalized.append(part)
+        else:
+            normalized.append(_WHITESPACE_PATTERN.sub(" ", part))
+    return "".join(normalized).strip()
+
+def make_cache_key(url: str, query_string: str) -> str:
+    """Build the content-addressed key for a (dataset URL, query) pair."""
+    return hashlib.sha256(f"{url}\n{normalize_query(query_string)}".encode("utf-8")).hexdigest()
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class ResponseCache:
+    """SQLite-backed cache of portal responses with per-entry TTLs and size-based LRU eviction."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        # Shared by every server process that uses the same cache file.
+        self._db = SharedConnection(path, [
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                query TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL,
+                last_accessed REAL NOT NULL
+            )""",
+            "CREATE INDEX IF NOT EXISTS responses_last_accessed ON responses (last_accessed)",
+            # Queries a process is fetching from the portal right now; see claim().
+            "CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, pid INTEGER NOT NULL, expires_at REAL NOT NULL)"
+        ])
+
+    @property
+    def _conn(self):
+        return self._db.get()
+
+    def get(self, url: str, query_string: str, parse=list):
+        """Return parse(rows) for the cached response to a query, or None if it is missing or expired.
+
+        The stored rows are decoded one at a time as parse reads them (see utils.execute_query)."""
+        key = make_cache_key(url, query_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT body, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            body, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET last_accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return parse(iter_json_array(body[i:i + CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE)))
+
+    def put(self, url: str, query_string: str, response, ttl_seconds=None):
+        """Store a response. A ttl_seconds of None means the entry never expires."""
+        self.put_body(url, query_string, json.dumps(response, separators=(",", ":")).encode("utf-8"), ttl_seconds)
+
+    def put_body(self, url: str, query_string: str, body, ttl_seconds=None):
+        """Store a response that's already encoded as a JSON array (bytes, or any other buffer)."""
+        if len(body) > self.max_bytes:
+            return
+
+        now = time.time()
+        expires_at = now + ttl_seconds if ttl_seconds is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, url, query, body, size, created_at, expires_at, last_accessed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (make_cache_key(url, query_string), url, normalize_query(query_string), body, len(body), now, expires_at, now))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits within max_bytes. Caller holds the lock."""
+        total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_accessed ASC").fetchall():
+            if total_size <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total_size -= size
+            self.evictions += 1
+
+    def claim(self, url: str, query_string: str, wait_seconds: float = DEFAULT_CLAIM_SECONDS, check_cancelled=None, parse=list):
+        """Claim the fetch of a query for this process, so that other processes sharing the cache wait
+        for its response rather than sending the same query to the portal.
+
+        Returns None once this process holds the claim (or has waited wait_seconds), meaning it should
+        fetch the query and then call release(). If another process fetches it in the meantime, returns
+        that response from the cache instead, as parse(rows) (see get). A claim whose process has exited
+        is taken over.
+        check_cancelled, if given, is called before every wait, so a cancelled caller stops waiting."""
+        key = make_cache_key(url, query_string)
+        deadline = time.time() + wait_seconds
+        while True:
+            now = time.time()
+            with self._lock:
+                self._conn.execute("DELETE FROM claims WHERE key = ? AND expires_at <= ?", (key, now))
+                claimed = self._conn.execute("INSERT OR IGNORE INTO claims (key, pid, expires_at) VALUES (?, ?, ?)",
+                                             (key, os.getpid(), now + wait_seconds)).rowcount
+                row = None if claimed else self._conn.execute("SELECT pid FROM claims WHERE key = ?", (key,)).fetchone()
+                self._conn.commit()
+            if claimed or now >= deadline:
+                return None
+            if row is not None and not _is_running(row[0]):
+                with self._lock:
+                    self._conn.execute("DELETE FROM claims WHERE key = ? AND pid = ?", (key, row[0]))
+                    self._conn.commit()
+                continue
+
+            if check_cancelled is not None:
+                check_cancelled()
+            time.sleep(CLAIM_POLL_SECONDS)
+            with self._lock:
+                still_claimed = self._conn.execute("SELECT 1 FROM claims WHERE key = ?", (key,)).fetchone() is not None
+                # The response can arrive before the claim is released (or if releasing it failed).
+                stored = self._conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+            if stored or not still_claimed:
+                # If the other process's fetch failed, try to claim the query again.
+                response = self.get(url, query_string, parse)
+                if response is not None:
+                    return response
+
+    def release(self, url: str, query_string: str):
+        """Release this process's claim on a query, once its response is in the cache (or it failed)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM claims WHERE key = ? AND pid = ?", (make_cache_key(url, query_string), os.getpid()))
+            self._conn.commit()
+
+    def invalidate(self, url: str) -> int:
+        """Remove every cached response for a dataset view (e.g. once its data has changed). Returns how many were removed."""
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM responses WHERE url = ?", (url,)).rowcount
+            self._conn.commit()
+        return removed
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """Return hit/miss counters along with the current size of the cache."""
+        with self._lock:
+            entries, total_size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "size_bytes": total_size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "expired": self.expired,
+            "evictions": self.evictions
+        }
@@ -3,23 +3,70 @@ import json
 import os
 #import requests
 #from urllib.parse import quote
-import xml.etree.ElementTree as ET
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import inspect
+import anyio
 import enrollment_tools
+import metrics
+import warmup
+from assessment_sets import compile_assessment_sets, compile_student_group_aliases
+from async_tools import make_async_tool, nonblocking
+from district_index import DistrictIndex
+from output_formats import shaped_output, with_output_options
+from precompute import materialized
+from records import ScoreResult, parse_score_rows, parse_sum, scores_to_dicts
 from utils import *
 
-# Load environment variables
-from dotenv import load_dotenv
-load_dotenv()
-
-mcp = FastMCP("WA Education MCP")
+# Environment variables (.env) are loaded by utils on the first query, not at startup.
 
 config_data = load_config()
 
+# Blocking tools run in worker threads, at most this many at a time, each with a deadline.
+MAX_CONCURRENT_TOOL_CALLS = config_data.get("max_concurrent_tool_calls", 16)
+TOOL_TIMEOUT_SECONDS = config_data.get("tool_timeout_seconds", 120)
+TOOL_LIMITER = anyio.CapacityLimiter(MAX_CONCURRENT_TOOL_CALLS)
+
+class InstrumentedFastMCP(FastMCP):
+    """FastMCP server that runs blocking tools in worker threads and records a timing span for every tool call.
+    Tools marked @shaped_output also get the output_format, fields, limit and offset parameters."""
+
+    def add_tool(self, fn, name=None, **kwargs):
+        if hasattr(fn, "compact_drop"):
+            fn = with_output_options(fn)
+        if not inspect.iscoroutinefunction(fn) and not getattr(fn, "nonblocking", False):
+            fn = make_async_tool(fn, TOOL_LIMITER, TOOL_TIMEOUT_SECONDS)
+        super().add_tool(metrics.instrument_tool(fn, name), name=name, **kwargs)
+
+mcp = InstrumentedFastMCP("WA Education MCP")
+
+DISTRICTS_XML_FILE = os.path.join(os.path.dirname(__file__), "Districts.xml")
+DISTRICTS_TABLE_FILE = os.path.join(os.path.dirname(__file__), ".cache", "districts.json")
+
 def load_districts():
-    """Load district codes and names for easy querying"""
+    """Load district codes and names for easy querying.
+
+    Districts.xml is compiled into a compact JSON table the first time it's loaded (and again
+    whenever the XML changes), so later startups can skip the XML parse."""
+    if os.path.exists(DISTRICTS_TABLE_FILE) and os.path.getmtime(DISTRICTS_TABLE_FILE) >= os.path.getmtime(DISTRICTS_XML_FILE):
+        with open(DISTRICTS_TABLE_FILE) as f:
+            return json.load(f)
+
+    districts = compile_districts()
+    try:
+        os.makedirs(os.path.dirname(DISTRICTS_TABLE_FILE), exist_ok=True)
+        with open(DISTRICTS_TABLE_FILE, "w") as f:
+            json.dump(districts, f, separators=(",", ":"))
+    except OSError:
+        pass # not being able to write the table just means parsing the XML again next time
+    return districts
+
+def compile_districts() -> dict:
+    """Parse Districts.xml into a dict of district code -> district name."""
+    import xml.etree.ElementTree as ET
     districts = {}
-    tree = ET.parse(os.path.join(os.path.dirname(__file__), "Districts.xml"))
+    tree = ET.parse(DISTRICTS_XML_FILE)
     root = tree.getroot()
     for row in root.findall(".//row"):
         code = row.findtext("districtcode")
@@ -29,157 +76,236 @@ def load_districts():
     return districts
 
 DISTRICTS = load_districts()
+DISTRICT_INDEX = DistrictIndex(DISTRICTS)
 
 FOCUS_DISTRICT_ID = config_data.get("focus_district_id", "17414")
 DEFAULT_ASSESSMENT_YEAR = config_data.get("latest_assessment_year", 2025)
+MAX_CONCURRENT_QUERIES = config_data.get("max_concurrent_queries", 4)
+STATEWIDE_SET_ID = "STATE" # pseudo multidistrict set covering every district in the state
+
+# Per-year column schemas and query templates, compiled from the config once at startup.
+ASSESSMENT_SETS = compile_assessment_sets(config_data)
+STUDENT_GROUP_ALIASES = compile_student_group_aliases(config_data)
 
 enrollment_tools.register_tools(mcp)
 
 @mcp.tool()
+@shaped_output
+@materialized
 def get_district_scores(district_ids: list = [FOCUS_DISTRICT_ID], tests: list = ["SBAC", "AIM", "WCAS"], subject: str = "ELA", grade: int = 3, student_groups: list = ["All Students"], year: int = DEFAULT_ASSESSMENT_YEAR):
     """Get raw test scores for a specified list of one or more districts. Do NOT manually compute rankings or trends using this raw data. Use analyze_benchmark_trends or analyze_district_trends instead."""
-    # Annoyingly, the data in the various annual datasets is essentially unchanged, but OSPI likes to change
-    # around column names. Here we normalize the column names we need to use based on year.
-    met_standard_column = "count_consistent_grade_level"
-    total_students_column = "count_of_students_expected"
-    dat_column = "DAT"
-    grade_adjusted = grade
-    if (year == 2021):
-        met_standard_column = "numeratorsuppressed"
-        total_students_column = "denominatorsuppressed"
-        dat_column = "Suppression"
-        # 2020-21 data is extra-funky because the test was given in the fall of 2021, rather than the spring
-        # (due to COVID-19). So the students were a grade level older than expected, i.e. the kids who took
-        # the 3rd grade test are listed as 4th graders in the data. Adjust accordingly to match other years.
-        grade_adjusted = grade + 1
-    elif (year < 2023):
-        met_standard_column = "countmetstandard"
-        dat_column = "Suppression"
-    elif (year in [2023, 2024]):
-        met_standard_column = "count_consistent_grade_level_knowledge_and_above"
-
-    # Also annoyingly, the "two or more races" student group is sometimes called TwoorMoreRaces.
-    # If there is a student group that starts with "Two" then make sure both versions are added.
-    if any(group.startswith("Two") for group in student_groups):
-        student_groups = student_groups.copy() # work with a copy to avoid modifying caller's list
-        student_groups.append("TwoorMoreRaces")
-        student_groups.append("Two Or More Races")
-
-    # Define the query to use against the data.wa.gov portal
-    query = f"""SELECT
-  `schoolyear`,
-  `organizationlevel`,
-  `districtcode`,
-  `districtname`,
-  `studentgroup`,
-  `studentgrouptype`,
-  `gradelevel`,
-  `testadministration`,
-  `testsubject`,
-  `{met_standard_column}` AS `count_consistent_grade_level`,
-  `{total_students_column}` AS `count_of_students_expected`,
-  `{dat_column}` AS `DAT`
-WHERE
-  caseless_eq(`organizationlevel`, "District")
-  AND caseless_eq(`gradelevel`, "{get_grade(grade_adjusted)}")
-  AND caseless_one_of(`testadministration`, "{get_list_as_string(tests)}")
-  AND caseless_one_of(`testsubject`, "{subject}")
-  AND caseless_one_of(`districtcode`, "{get_list_as_string(district_ids)}")
-  AND caseless_one_of(`studentgroup`, "{get_list_as_string(student_groups)}")
-  AND caseless_eq(`schoolyear`, "{get_school_year(year)}")
-    """
-
-    # Execute the query and get the JSON response
-    response = execute_assessment_query(year, query)
-    if "error" in response:
-        return response
+    district_ids = [str(district_id) for district_id in district_ids]
+    invalid = validate_district_ids(district_ids) or validate_scores_parameters(year, tests, subject, grade, student_groups)
+    if invalid:
+        return invalid
 
-    # Each record in the response corresponds to a district's results for the
-    # specified grade level and test subject. Each district may have more than
-    # one test for a given subject (SBAC/WCAS and WA-AIM) so add together
-    # the student numbers for all tests. 
-    aggregated_scores = {}
-    for record in response:
-        studentgroup = record.get("studentgroup")
-        studentgroup_adjusted = studentgroup
-        if studentgroup == "TwoorMoreRaces":
-            studentgroup_adjusted = "Two Or More Races"
-        district_id = record.get("districtcode")
-
-        if not studentgroup:
-            return {"error": "Missing studentgroup in record"}
-        if not district_id:
-            return {"error": "Missing districtcode in record"}
-
-        # Create the dictionary entries for studentgroup and district_id, if
-        # they don't already exist.
-        if (studentgroup_adjusted not in aggregated_scores):
-            aggregated_scores[studentgroup_adjusted] = {}
-        if (district_id not in aggregated_scores[studentgroup_adjusted]):
-            # Initialize each district's results for each student group to 0.
-            aggregated_scores[studentgroup_adjusted][district_id] = {
-                "total_students": 0,
-                "consistent_grade_level": 0
-            }
+    query = build_scores_query([year], district_ids, tests, subject, grade, student_groups)
 
-        # Add this record's student numbers to the totals for this district
-        result = aggregated_scores.get(studentgroup_adjusted).get(district_id)
-        if result:
-            total_str = record.get("count_of_students_expected", "0")
-            if total_str == "NULL": total_str = "0"
-            consistent_str = record.get("count_consistent_grade_level", "0")
-            if consistent_str == "NULL": consistent_str = "0"
-            try:
-                result["total_students"] += int(total_str)
-                result["consistent_grade_level"] += int(consistent_str)
-            except:
-                return {"error": "Error converting student counts to integers",
-                        "studentgroup": studentgroup,
-                        "studentgroup_adjusted": studentgroup_adjusted,
-                        "district_id": district_id,
-                        "year": year,
-                        "record": record
-                       }
+    # Execute the query, turning its rows into ScoreRows as they arrive
+    rows = execute_assessment_query(year, query, parse_scores)
+    if isinstance(rows, dict):
+        return rows
 
-    # Use the aggregated results to calculate percentages
-    results = []
-    for studentgroup_adjusted in aggregated_scores:
-        for district_id in aggregated_scores[studentgroup_adjusted]:
-            result_data = aggregated_scores[studentgroup_adjusted][district_id]
-            # Calculate percentage
-            percent = None
-            try:
-                if result_data.get("total_students", 0) > 0:
-                    percent = round(
-                        (result_data.get("consistent_grade_level", 0) / result_data.get("total_students", 0)) * 100, 2)
-            except:
-                return {"error": "Error calculating percentage of students at grade level",
-                        "studentgroup": studentgroup,
-                        "studentgroup_adjusted": studentgroup_adjusted,
-                        "district_id": district_id,
-                        "year": year,
-                        "result_data": result_data
-                       }
-
-            results.append({
-                "student_group": studentgroup_adjusted,
-                "district_id": district_id,
-                "total_students": result_data["total_students"],
-                "consistent_grade_level": result_data["consistent_grade_level"],
-                "percent_consistent_grade_level": percent
-            })
+    with metrics.span("aggregate_scores", rows=len(rows)):
+        results = aggregate_scores(rows)
 
     return {
         "year": year,
         "subject": subject,
         "grade": grade,
+        "results": scores_to_dicts(results["results"]),
+        "query": query
+    }
+
+@mcp.tool()
+@shaped_output
+def get_district_score_grid(district_ids: list = [FOCUS_DISTRICT_ID], subjects: list = ["ELA", "Math", "Science"], grades: list = [3, 4, 5, 6, 7, 8, 10, 11], student_groups: list = ["All Students"], year: int = DEFAULT_ASSESSMENT_YEAR, tests: list = ["SBAC", "AIM", "WCAS"]):
+    """Get test scores for one or more districts across several subjects and grades in a single call, added up across tests the same way as get_district_scores. Use this instead of calling get_district_scores once per subject and grade. Do NOT manually compute rankings or trends using this raw data. Use analyze_trends instead.
+    Returns one entry per district and student group in "results", whose "scores" map each subject to grade -> {total_students, consistent_grade_level, percent_consistent_grade_level}. Subjects and grades that weren't tested are left out."""
+    assessment_set = ASSESSMENT_SETS.get(year)
+    if not assessment_set:
+        return {"error": f"Assessment dataset for year {year} not found"}
+    district_ids = [str(district_id) for district_id in district_ids]
+    invalid = validate_district_ids(district_ids) or validate_grid_parameters(year, tests, subjects, grades, student_groups)
+    if invalid:
+        return invalid
+
+    # The portal adds up the tests for each district, group, subject and grade, so only one row
+    # per grid cell comes back rather than one per test.
+    query = assessment_set.build_grid_query(
+        school_year=get_school_year(year),
+        district_filter=f"""
+  AND caseless_one_of(`districtcode`, "{get_list_as_string(district_ids)}")""",
+        tests=get_list_as_string(tests),
+        subjects=get_list_as_string(subjects),
+        grades=grades,
+        student_groups=STUDENT_GROUP_ALIASES.query_list(tuple(student_groups))
+    )
+    response = execute_query(assessment_set.url, query)
+    if "error" in response:
+        return response
+
+    with metrics.span("score_grid", rows=len(response)):
+        results = build_score_grid(response, district_ids, subjects, grades, student_groups, assessment_set.grade_offset)
+
+    return {
+        "year": year,
         "results": results,
         "query": query
     }
 
+def build_score_grid(response: list, district_ids: list, subjects: list, grades: list, student_groups: list, grade_offset: int = 0) -> list:
+    """Lay out grid query rows as one entry per district and student group, in the order they were requested."""
+    # (district, group) -> subject -> grade -> [met standard, students]. Groups the data spells more than
+    # one way come back as separate rows, so counts are added rather than assigned.
+    cells = {}
+    for row in response:
+        student_group = row.get("studentgroup")
+        student_group = STUDENT_GROUP_ALIASES.normalized_names.get(student_group, student_group)
+        grade = get_grade_from_string(row.get("gradelevel", ""))
+        if grade is None:
+            continue
+        counts = cells.setdefault((row.get("districtcode"), student_group.lower()), {}).setdefault(row.get("testsubject", "").lower(), {}).setdefault(grade - grade_offset, [0, 0])
+        counts[0] += parse_sum(row.get("count_consistent_grade_level"))
+        counts[1] += parse_sum(row.get("count_of_students_expected"))
+
+    results = []
+    for district_id in district_ids:
+        for student_group in student_groups:
+            scores_by_subject = cells.get((str(district_id), student_group.lower()))
+            if scores_by_subject is None:
+                continue
+            scores = {}
+            for subject in subjects:
+                scores_by_grade = scores_by_subject.get(subject.lower(), {})
+                subject_scores = {}
+                for grade in sorted(grades):
+                    if grade not in scores_by_grade:
+                        continue
+                    consistent_grade_level, total_students = scores_by_grade[grade]
+                    subject_scores[str(grade)] = {
+                        "total_students": total_students,
+                        "consistent_grade_level": consistent_grade_level,
+                        "percent_consistent_grade_level": round(consistent_grade_level / total_students * 100, 2) if total_students > 0 else None
+                    }
+                if subject_scores:
+                    scores[subject] = subject_scores
+            results.append({"district_id": str(district_id), "student_group": student_group, "scores": scores})
+    return results
+
+def build_scores_query(years: list, district_ids: list, tests: list, subject: str, grade: int, student_groups: list) -> str:
+    """Build the scores query for one or more years that share the same dataset schema."""
+    # A district_ids of None means every district in the state.
+    district_filter = ""
+    if district_ids is not None:
+        district_filter = f"""
+  AND caseless_one_of(`districtcode`, "{get_list_as_string(district_ids)}")"""
+
+    return ASSESSMENT_SETS[years[0]].build_query(
+        school_years=get_list_as_string([get_school_year(year) for year in years]),
+        district_filter=district_filter,
+        tests=get_list_as_string(tests),
+        subject=subject,
+        grade=grade,
+        # Groups the data spells more than one way (e.g. TwoorMoreRaces) are queried under every spelling.
+        student_groups=STUDENT_GROUP_ALIASES.query_list(tuple(student_groups))
+    )
+
+def aggregate_scores(rows: list) -> dict:
+    """Sum up the student counts across tests for each student group and district, and compute percentages.
+
+    Takes ScoreRows (see records.parse_score_rows) and returns {"results": [ScoreResult, ...]}."""
+    # Each row corresponds to a district's results for the specified grade
+    # level and test subject. Each district may have more than one test for
+    # a given subject (SBAC/WCAS and WA-AIM) so add together the student
+    # numbers for all tests.
+    aggregated_scores = {}
+    for row in rows:
+        district_scores = aggregated_scores.get(row.student_group)
+        if district_scores is None:
+            district_scores = aggregated_scores[row.student_group] = {}
+        result = district_scores.get(row.district_id)
+        if result is None:
+            result = district_scores[row.district_id] = ScoreResult(row.student_group, row.district_id)
+        result.total_students += row.total_students
+        result.consistent_grade_level += row.consistent_grade_level
+
+    # Use the aggregated results to calculate percentages
+    results = []
+    for district_scores in aggregated_scores.values():
+        for result in district_scores.values():
+            if result.total_students > 0:
+                result.percent_consistent_grade_level = round((result.consistent_grade_level / result.total_students) * 100, 2)
+            results.append(result)
+
+    return {"results": results}
+
+def plan_score_queries(years: list) -> list:
+    """Group years that can be fetched with a single query: same dataset URL and same column schema.
+
+    Returns a list of (url, years) tuples in order of each group's earliest year. Years without
+    a configured dataset are returned in their own group with a url of None."""
+    groups = {}
+    for year in years:
+        assessment_set = ASSESSMENT_SETS.get(year)
+        key = assessment_set.schema_key if assessment_set else (None, year)
+        groups.setdefault(key, []).append(year)
+    return [(key[0], group_years) for key, group_years in groups.items()]
+
+def get_district_scores_for_years(district_ids: list, subject: str, grade: int, student_groups: list, years: list, tests: list = ["SBAC", "AIM", "WCAS"]) -> dict:
+    """Get scores for multiple years using one query per dataset view, rather than one per year.
+
+    Returns a dict of year -> result (in the same shape as get_district_scores, but with ScoreResults
+    rather than dicts in "results"), or an error dict."""
+    plan = plan_score_queries(years)
+
+    def fetch_group(group_years):
+        query = build_scores_query(group_years, district_ids, tests, subject, grade, student_groups)
+        # Every year in the group shares a URL, so routing by the first year is enough.
+        return query, execute_assessment_query(group_years[0], query, parse_scores)
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_QUERIES) as executor:
+        # Run each query in a copy of the caller's context so its timing span nests under the tool call.
+        futures = [executor.submit(contextvars.copy_context().run, fetch_group, group_years) for _, group_years in plan]
+        responses = {}
+        for (_, group_years), future in zip(plan, futures):
+            query, response = future.result()
+            if isinstance(response, dict):
+                # Don't bother waiting on queries that haven't started yet.
+                for pending in futures:
+                    pending.cancel()
+                return response
+            responses[tuple(group_years)] = (query, response)
+
+    scores_by_year = {}
+    for group_years, (query, response) in responses.items():
+        # Split the combined rows back out by school year.
+        rows_by_school_year = {get_school_year(year).lower(): [] for year in group_years}
+        for row in response:
+            rows = rows_by_school_year.get(row.school_year)
+            if rows is not None:
+                rows.append(row)
+
+        for year in group_years:
+            year_rows = rows_by_school_year[get_school_year(year).lower()]
+            with metrics.span("aggregate_scores", rows=len(year_rows)):
+                results = aggregate_scores(year_rows)
+            scores_by_year[year] = {
+                "year": year,
+                "subject": subject,
+                "grade": grade,
+                "results": results["results"],
+                "query": query
+            }
+
+    return scores_by_year
+
 @mcp.tool()
+@shaped_output
+@materialized
 def analyze_trends(focus_district_id: str = FOCUS_DISTRICT_ID, multidistrict_set_id: str = "DEFAULT", subject: str = "ELA", grade: int = 3, student_groups: list = ["All Students", "Low-Income"], year: int = DEFAULT_ASSESSMENT_YEAR, yearspan: int = 4):
-    """Analyze trends in scores for one or more districts across multiple years. Returns authoritative rankings across multiple districts and trends across multiple years. Use this tool whenever multi-district ranking or trend logic is required. Do NOT compute rankings or trends manually."""
+    """Analyze trends in scores for one or more districts across multiple years. Returns authoritative rankings across multiple districts and trends across multiple years. Use this tool whenever multi-district ranking or trend logic is required. Do NOT compute rankings or trends manually.
+    Use multidistrict_set_id="STATE" to rank every district in the state; statewide results use dense ranks, include percentiles and per-district regression slopes, and summarize the focus district's standing."""
     first_year = year - yearspan + 1
     last_year = year
 
@@ -197,32 +323,54 @@ def analyze_trends(focus_district_id: str = FOCUS_DISTRICT_ID, multidistrict_set
     if "error" in benchmark_scores:
         return benchmark_scores
 
+    if multidistrict_set_id == STATEWIDE_SET_ID:
+        import statewide_analysis
+        with metrics.span("statewide_analysis"):
+            return statewide_analysis.analyze_statewide(benchmark_scores, first_year, last_year, focus_district_id)
+
+    # Index the results once so that rankings and trends are simple lookups, rather than
+    # repeated scans of every year's records for every district and student group.
+    index = index_scores(benchmark_scores)
+
     analysis = { "ranked_results": [], "annual_trends": [] }
-    for student_group in benchmark_scores.get("student_groups", []):
-        for year_scores in benchmark_scores.get("results", []):
-            analysis["ranked_results"].append(get_district_rankings(year_scores, student_group))
+    with metrics.span("rankings"):
+        for student_group in benchmark_scores.get("student_groups", []):
+            for year_scores in benchmark_scores.get("results", []):
+                analysis["ranked_results"].append(get_district_rankings(year_scores, student_group, index))
 
-        analysis["annual_trends"].append(get_annual_trends(benchmark_scores, first_year, last_year, student_group))
+    with metrics.span("trends"):
+        for student_group in benchmark_scores.get("student_groups", []):
+            analysis["annual_trends"].append(get_annual_trends(benchmark_scores, first_year, last_year, student_group, index))
 
     return analysis
 
-def get_annual_trends(scores: dict, first_year, last_year, student_group) -> dict:
-    first_year_scores = next((record for record in scores.get("results", []) if record.get("year") == first_year), None)
-    last_year_scores = next((record for record in scores.get("results", []) if record.get("year") == last_year), None)
+def index_scores(scores: dict) -> dict:
+    """Index multi-year score results by (year, student_group), then by district_id.
 
-    trends_by_district = []
+    Districts stay in the order they appear in the results, so output built from the index
+    is ordered the same way as output built by scanning the results."""
+    index = {}
+    for year_scores in scores.get("results", []):
+        year = year_scores.get("year")
+        for record in year_scores.get("data", []):
+            index.setdefault((year, record.student_group), {})[record.district_id] = record
+    return index
 
-    for last_record in last_year_scores.get("data", []):
-        if last_record.get("student_group") != student_group:
-            continue
+def get_annual_trends(scores: dict, first_year, last_year, student_group, index: dict = None) -> dict:
+    if index is None:
+        index = index_scores(scores)
+    first_year_scores = index.get((first_year, student_group), {})
+    last_year_scores = index.get((last_year, student_group), {})
 
-        district_id = last_record.get("district_id")
-        first_record = next((r for r in first_year_scores.get("data", []) if r.get("district_id") == district_id and r.get("student_group") == student_group), None)
+    trends_by_district = []
+
+    for district_id, last_record in last_year_scores.items():
+        first_record = first_year_scores.get(district_id)
         if not first_record:
             continue
 
-        first_percent = first_record.get("percent_consistent_grade_level", None)
-        last_percent = last_record.get("percent_consistent_grade_level", None)
+        first_percent = first_record.percent_consistent_grade_level
+        last_percent = last_record.percent_consistent_grade_level
 
         if first_percent is None or last_percent is None:
             continue
@@ -243,46 +391,63 @@ def get_annual_trends(scores: dict, first_year, last_year, student_group) -> dic
         "trends_by_district": trends_by_district
     }
 
-def get_district_rankings(scores: dict, student_group: str) -> dict:
-    # Filter scores to only include the specified student group. Make copies of each record tnat we include,
-    # so we don't modify the original data.
-    filtered_scores = [record.copy() for record in scores.get("data", []) if record.get("student_group", "Unknown") == student_group]
-
-    sorted_records = sorted(filtered_scores, key=lambda x: (x.get("percent_consistent_grade_level") is not None, x.get("percent_consistent_grade_level")), reverse=True)
+def get_district_rankings(scores: dict, student_group: str, index: dict = None) -> dict:
+    # Filter scores to only include the specified student group.
+    if index is not None:
+        filtered_scores = index.get((scores.get("year"), student_group), {}).values()
+    else:
+        filtered_scores = [record for record in scores.get("data", []) if record.student_group == student_group]
 
-    for rank, record in enumerate(sorted_records, start=1):
-        record["rank"] = rank
-        record.pop("student_group", None)  # remove redundant student_group field
+    sorted_records = sorted(filtered_scores, key=lambda x: (x.percent_consistent_grade_level is not None, x.percent_consistent_grade_level), reverse=True)
 
+    # Output records leave out the student group, since it's the same for every one.
     return {
         "year": scores.get("year"),
         "student_group": student_group,
-        "ranked_data": sorted_records
+        "ranked_data": [
+            {
+                "district_id": record.district_id,
+                "total_students": record.total_students,
+                "consistent_grade_level": record.consistent_grade_level,
+                "percent_consistent_grade_level": record.percent_consistent_grade_level,
+                "rank": rank
+            }
+            for rank, record in enumerate(sorted_records, start=1)
+        ]
     }
 
 def get_multidistrict_scores(multidistrict_set_id: str = "DEFAULT", subject: str = "ELA", grade: int = 3, student_groups: list = ["All Students"], years: list = [2022, 2023, 2024, 2025]):
-    """Get scores for a set of multiple districts across multiple years."""
-    multidistrict_set = next((b for b in config_data["multidistrict_sets"] if b["id"] == multidistrict_set_id), None)
+    """Get scores for a set of multiple districts across multiple years. Each year's "data" is a list of ScoreResults."""
+    if multidistrict_set_id == STATEWIDE_SET_ID:
+        # No district filter at all; the query returns every district in the state.
+        multidistrict_set = {"id": STATEWIDE_SET_ID, "districts": None}
+    else:
+        multidistrict_set = next((b for b in config_data["multidistrict_sets"] if b["id"] == multidistrict_set_id), None)
     if not multidistrict_set:
         return {"error": f"Multidistrict set {multidistrict_set_id} not found"}
-    results = { "results": [] }
-    for year in years:
-        if year == 2020: # skip 2020, no testing data
-            continue
-
-        scores = get_district_scores(
-            district_ids=multidistrict_set["districts"],
-            subject=subject,
-            grade=grade,
-            student_groups=student_groups,
-            year=year
-        )
-        if "error" in scores:
-            return scores
+    if multidistrict_set["districts"] is not None:
+        invalid = validate_district_ids(multidistrict_set["districts"])
+        if invalid:
+            return {"error": f"Multidistrict set {multidistrict_set_id} is misconfigured. {invalid['error']}"}
+    # Years that share a dataset view and column schema are fetched with a single query,
+    # and the per-view queries run concurrently. Results are collected in year order so
+    # the output is deterministic.
+    query_years = [year for year in years if year != 2020] # skip 2020, no testing data
+    scores_by_year = get_district_scores_for_years(
+        district_ids=multidistrict_set["districts"],
+        subject=subject,
+        grade=grade,
+        student_groups=student_groups,
+        years=query_years
+    )
+    if "error" in scores_by_year:
+        return scores_by_year
 
+    results = { "results": [] }
+    for year in query_years:
         results["results"].append({
             "year": year,
-            "data": scores["results"]
+            "data": scores_by_year[year]["results"]
         })
 
     return {
@@ -295,6 +460,7 @@ def get_multidistrict_scores(multidistrict_set_id: str = "DEFAULT", subject: str
     }
 
 @mcp.tool()
+@nonblocking
 def get_district_name(district_id: str = FOCUS_DISTRICT_ID) -> dict:
     """Get the name of a district given its ID."""
     if district_id in DISTRICTS:
@@ -302,19 +468,48 @@ def get_district_name(district_id: str = FOCUS_DISTRICT_ID) -> dict:
     else:
         return {"error": f"District ID {district_id} not found"}
 
-def get_grade(grade: int) -> str:
-    if grade < 10:
-        return f"0{grade}"
-    else:
-        return str(grade)
+@mcp.tool()
+@nonblocking
+def find_districts(name: str, limit: int = 5) -> dict:
+    """Find districts by name, e.g. "Lake Washington" or "Bellevue", to get the district IDs the other tools take.
+    Matches the start of each word and tolerates misspellings. Returns candidates best first, each with a score
+    from 0 to 1 (1 means every word matched)."""
+    return {
+        "query": name,
+        "matches": [
+            {"district_id": district_id, "district_name": DISTRICTS[district_id], "score": score}
+            for district_id, score in DISTRICT_INDEX.search(name, limit)
+        ]
+    }
 
-def execute_assessment_query(year: int, query_string: str) -> dict:
-    """Execute a query against the data.wa.gov portal for a given year and return results, with proper error handling."""
-    assessment_set = next((a for a in config_data["assessment_sets"] if a["year"] == year), None)
+def validate_district_ids(district_ids: list) -> dict:
+    """Check that every district ID exists, so a query for an unknown district is never sent.
+    Returns an error dict (suggesting the closest names for IDs that look like names), or None."""
+    unknown = []
+    for district_id in district_ids:
+        if str(district_id) in DISTRICTS:
+            continue
+        matches = DISTRICT_INDEX.search(str(district_id), 1) if not str(district_id).isdigit() else []
+        if matches:
+            unknown.append(f"{district_id} (did you mean {matches[0][0]}, {DISTRICTS[matches[0][0]]}?)")
+        else:
+            unknown.append(str(district_id))
+    if unknown:
+        return {"error": f"District IDs not found: {'; '.join(unknown)}. Use find_districts to look up district IDs by name."}
+    return None
+
+def execute_assessment_query(year: int, query_string: str, parse=list) -> dict:
+    """Execute a query against the data.wa.gov portal for a given year and return results (as parse(rows);
+    see utils.execute_query), with proper error handling."""
+    assessment_set = ASSESSMENT_SETS.get(year)
     if not assessment_set:
         return {"error": f"Assessment dataset for year {year} not found"}
     
-    return execute_query(assessment_set["url"], query_string)
+    return execute_query(assessment_set.url, query_string, parse)
+
+def parse_scores(rows) -> list:
+    """Turn the rows of a scores query into ScoreRows as they're decoded, so the raw string-valued dicts are never held."""
+    return parse_score_rows(rows, STUDENT_GROUP_ALIASES.normalized_names)
 
 def get_list_as_string(items: list) -> str:
     """Convert a list of items to a string for use in a query."""
@@ -323,11 +518,13 @@ def get_list_as_string(items: list) -> str:
     return list_str
 
 @mcp.tool()
+@nonblocking
 def list_multidistrict_sets():
     """List available multidistrict sets."""
     return config_data["multidistrict_sets"]
 
 @mcp.tool()
+@nonblocking
 def get_multidistrict_set(multidistrict_set_id: str) -> dict:
     """Get details of a specific multidistrict set."""
     multidistrict_set = next((b for b in config_data["multidistrict_sets"] if b["id"] == multidistrict_set_id), None)
@@ -336,33 +533,191 @@ def get_multidistrict_set(multidistrict_set_id: str) -> dict:
     return multidistrict_set
 
 @mcp.tool()
+@nonblocking
 def list_available_assessment_years():
     """List all available assessment years."""
-    return [a["year"] for a in config_data["assessment_sets"]]
+    return list(ASSESSMENT_SETS)
+
+def get_assessment_catalog(year: int) -> dict:
+    """Get the catalog entry (available tests and student groups by school year) for a year's assessment dataset."""
+    assessment_set = ASSESSMENT_SETS.get(year)
+    if not assessment_set:
+        return {"error": f"Assessment dataset for year {year} not found"}
+    return get_catalog().get(assessment_set.url, "assessment")
 
 @mcp.tool()
 def list_available_tests(year: int = DEFAULT_ASSESSMENT_YEAR):
     """List all available test/subject pairs for a given year."""
-    query = """SELECT `testadministration`, `testsubject`, `gradelevel`
-GROUP BY `testadministration`, `testsubject`, `gradelevel`
-HAVING caseless_ne(`gradelevel`, "All Grades")"""
-    response = execute_assessment_query(year, query)
-    if "error" in response:
-        return response
-    
-    for test in response:
-        test["gradelevel"] = int(test["gradelevel"])
+    entry = get_assessment_catalog(year)
+    if "error" in entry:
+        return entry
 
-    return response
+    return [
+        {"testadministration": test, "testsubject": subject, "gradelevel": grade}
+        for test, subject, grade in entry["tests"].get(get_school_year(year).lower(), [])
+    ]
 
 @mcp.tool()
 def list_available_student_groups(year: int = DEFAULT_ASSESSMENT_YEAR):
     """List all available student groups for a given year."""
-    query = """SELECT `studentgroup`, `studentgrouptype`
-GROUP BY `studentgrouptype`, `studentgroup`
-ORDER BY `studentgrouptype`"""
+    entry = get_assessment_catalog(year)
+    if "error" in entry:
+        return entry
+
+    return [
+        {"studentgroup": student_group, "studentgrouptype": student_group_type}
+        for student_group, student_group_type in entry["student_groups"].get(get_school_year(year).lower(), [])
+    ]
+
+def get_year_catalog(year: int):
+    """The (tests, student groups) the catalog lists for a year, or None if they can't be loaded."""
+    entry = get_assessment_catalog(year)
+    if "error" in entry:
+        # Not being able to load the catalog shouldn't stop the query itself from being tried.
+        return None
+    school_year = get_school_year(year).lower()
+    available_tests = entry["tests"].get(school_year)
+    available_student_groups = entry["student_groups"].get(school_year)
+    if not available_tests or not available_student_groups:
+        return None
+    return available_tests, available_student_groups
+
+def validate_student_groups(year: int, available_student_groups: list, student_groups: list) -> dict:
+    group_names = {student_group.lower() for student_group, _ in available_student_groups}
+    missing_groups = [
+        student_group for student_group in student_groups
+        if not any(name.lower() in group_names for name in STUDENT_GROUP_ALIASES.query_list((student_group,)).split('","'))
+    ]
+    if missing_groups:
+        return {"error": f"Student groups not found for {year}: {', '.join(missing_groups)}. Use list_available_student_groups to see the groups for a year."}
+    return None
+
+def validate_scores_parameters(year: int, tests: list, subject: str, grade: int, student_groups: list) -> dict:
+    """Check scores query parameters against the catalog for the year, so a query that can only come back
+    empty is never sent. Returns an error dict, or None if the parameters are valid (or can't be checked)."""
+    year_catalog = get_year_catalog(year)
+    if year_catalog is None:
+        return None
+    available_tests, available_student_groups = year_catalog
+
+    subject_tests = [(test, grade_level) for test, test_subject, grade_level in available_tests if test_subject.lower() == subject.lower()]
+    if not subject_tests:
+        subjects = sorted({test_subject for _, test_subject, _ in available_tests})
+        return {"error": f"Subject {subject} not found for {year}. Available subjects: {', '.join(subjects)}"}
+
+    # Grades are stored as the data labels them, which is offset for 2020-21.
+    grade_offset = ASSESSMENT_SETS[year].grade_offset
+    grade_tests = {test.lower() for test, grade_level in subject_tests if grade_level == grade + grade_offset}
+    if not grade_tests:
+        grades = sorted({grade_level - grade_offset for _, grade_level in subject_tests})
+        return {"error": f"Grade {grade} not found for {subject} in {year}. Available grades: {', '.join(map(str, grades))}"}
+    if not grade_tests.intersection(test.lower() for test in tests):
+        available = sorted({test for test, grade_level in subject_tests if grade_level == grade + grade_offset})
+        return {"error": f"None of the tests {', '.join(tests)} were given for {subject} grade {grade} in {year}. Available tests: {', '.join(available)}"}
+
+    return validate_student_groups(year, available_student_groups, student_groups)
+
+def validate_grid_parameters(year: int, tests: list, subjects: list, grades: list, student_groups: list) -> dict:
+    """Check score grid parameters against the catalog for the year, as validate_scores_parameters does for
+    one subject and grade. Subjects and grades that weren't tested together are allowed, since the grid
+    leaves them out, but every subject and student group must exist, and at least one of the grades must
+    have been tested and one of the tests given. Returns an error dict, or None."""
+    year_catalog = get_year_catalog(year)
+    if year_catalog is None:
+        return None
+    available_tests, available_student_groups = year_catalog
+
+    available_subjects = sorted({test_subject for _, test_subject, _ in available_tests})
+    missing_subjects = [subject for subject in subjects if subject.lower() not in {s.lower() for s in available_subjects}]
+    if missing_subjects:
+        return {"error": f"Subjects not found for {year}: {', '.join(missing_subjects)}. Available subjects: {', '.join(available_subjects)}"}
+
+    grade_offset = ASSESSMENT_SETS[year].grade_offset
+    subject_names = {subject.lower() for subject in subjects}
+    subject_tests = [(test, grade_level) for test, test_subject, grade_level in available_tests if test_subject.lower() in subject_names]
+    available_grades = sorted({grade_level - grade_offset for _, grade_level in subject_tests})
+    if not set(grades).intersection(available_grades):
+        return {"error": f"None of the grades {', '.join(map(str, grades))} were tested for {', '.join(subjects)} in {year}. Available grades: {', '.join(map(str, available_grades))}"}
+    available = sorted({test for test, grade_level in subject_tests if grade_level - grade_offset in grades})
+    if not {test.lower() for test in available}.intersection(test.lower() for test in tests):
+        return {"error": f"None of the tests {', '.join(tests)} were given for {', '.join(subjects)} in {year}. Available tests: {', '.join(available)}"}
+
+    return validate_student_groups(year, available_student_groups, student_groups)
 
-    return execute_assessment_query(year, query)
+@mcp.tool()
+def get_cache_stats() -> dict:
+    """Get hit/miss counters and size information for the local response cache."""
+    cache = get_response_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+@mcp.tool()
+@nonblocking
+def get_portal_stats() -> dict:
+    """Get request, retry, throttle and connection reuse counters for the data portal HTTP client,
+    plus how many identical in-flight queries were coalesced into a single request."""
+    single_flight = get_single_flight().stats()
+    return {
+        **get_portal_client().stats(),
+        "coalesced_queries": single_flight["coalesced"],
+        "in_flight_queries": single_flight["in_flight"]
+    }
+
+@mcp.tool()
+def get_server_stats(recent_calls: int = 10) -> dict:
+    """Get timing statistics for tool calls, portal queries (with response sizes, row counts and cache status)
+    and post-processing stages, along with the most recent tool calls broken down into nested spans
+    and the progress of the startup cache warm-up."""
+    cache = get_response_cache()
+    precomputed = get_precomputed_store()
+    return {
+        # Under the multi-worker launcher, every statistic here is for the worker process that answered.
+        "pid": os.getpid(),
+        **metrics.get_stats(recent_calls),
+        "cache": cache.stats() if cache is not None else {"enabled": False},
+        "precomputed": precomputed.stats() if precomputed is not None else {"enabled": False},
+        "catalog": get_catalog().stats(),
+        "portal": get_portal_stats(),
+        "warmup": warmup.stats()
+    }
+
+if config_data.get("metrics_endpoint", True):
+    @mcp.custom_route("/metrics", methods=["GET"])
+    async def prometheus_metrics(request):
+        """Prometheus-style metrics, served when running under an HTTP transport."""
+        from starlette.responses import PlainTextResponse
+        return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+# The tools the start-up warm-up calls.
+WARMUP_TOOLS = {"analyze_trends": analyze_trends, "get_district_scores": get_district_scores}
+
+def configure_http(host: str, port: int, stateless: bool = False):
+    """Set the address to serve HTTP transports on. Stateless streamable HTTP (no sessions) lets any
+    of several worker processes answer any request."""
+    mcp.settings.host = host
+    mcp.settings.port = port
+    mcp.settings.stateless_http = stateless
+    if host not in ("127.0.0.1", "localhost", "::1"):
+        # As FastMCP does when constructed with such a host: the DNS rebinding protection it turns on
+        # for localhost would reject requests that name this host.
+        mcp.settings.transport_security = None
 
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
+    import argparse
+    parser = argparse.ArgumentParser(description="WA Education Data MCP server")
+    parser.add_argument("--transport", choices=["stdio", "sse", "streamable-http"], default="stdio")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to serve HTTP transports on")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes to serve streamable HTTP from (see workers.py)")
+    args = parser.parse_args()
+    if args.workers > 1:
+        if args.transport != "streamable-http":
+            parser.error("--workers needs --transport streamable-http")
+        import workers
+        workers.serve(args.workers, args.host, args.port, warmup_tools=WARMUP_TOOLS)
+    else:
+        configure_http(args.host, args.port)
+        # Runs in the background, so the client's initialize request is answered straight away.
+        warmup.start(WARMUP_TOOLS)
+        mcp.run(transport=args.transport)
@@ -0,0 +1,66 @@
+import copy
+import threading
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into a single execution.
+
+    The first caller for a key runs the function; callers that arrive while it is still
+    running wait for it and receive a copy of its result instead of repeating the work.
+
+    Exceptions of the types in retry_on belong to the caller that ran the function rather than
+    to the call itself (e.g. that caller was cancelled); callers waiting on it run the function
+    again instead of receiving the exception."""
+
+    def __init__(self, retry_on: tuple = ()):
+        self.retry_on = retry_on
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, function, *args, **kwargs):
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    call = {"done": threading.Event(), "result": None, "exception": None, "waiters": 0}
+                    self._calls[key] = call
+                    self.executed += 1
+                    break
+                call["waiters"] += 1
+                self.coalesced += 1
+
+            call["done"].wait()
+            if isinstance(call["exception"], self.retry_on):
+                # Another caller's failure, not this one's: try again, possibly running the function itself.
+                continue
+            if call["exception"] is not None:
+                raise call["exception"]
+            # Each waiter gets its own copy, so a caller that modifies its result
+            # can't affect what the other callers see.
+            return copy.deepcopy(call["result"])
+
+        result = None
+        try:
+            result = function(*args, **kwargs)
+            return result
+        except BaseException as e:
+            call["exception"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                # No new waiters can join once the key is removed. Give any existing ones a
+                # private copy, taken before the leader's caller gets a chance to modify it.
+                if call["waiters"] and call["exception"] is None:
+                    call["result"] = copy.deepcopy(result)
+            call["done"].set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": in_flight
+        }
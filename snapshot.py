@@ -0,0 +1,326 @@
+"""Local snapshot of the data.wa.gov datasets, stored in a DuckDB file.
+
+Run `python snapshot.py sync` to download the district-level rows of every assessment and
+enrollment view listed in wa-ed-config.json. Set "data_backend" to "snapshot" in the config
+(or WA_ED_DATA_BACKEND=snapshot in the environment) to answer tool queries from the snapshot
+instead of the live portal. The SoQL queries built by the tools are translated to DuckDB SQL,
+so tool outputs are the same for both backends.
+
+DuckDB is an optional dependency (`pip install duckdb`) and is only needed for snapshot mode."""
+import argparse
+import os
+import re
+import threading
+import time
+
+from json_stream import CHUNK_SIZE, iter_json_array
+from utils import load_config, load_environment, get_live_urls, get_portal_client, build_query_url
+
+DEFAULT_SNAPSHOT_PATH = ".cache/snapshot.duckdb"
+DEFAULT_PAGE_SIZE = 50000
+
+_connection = None
+_connection_lock = threading.Lock()
+
+# Tokens in a SoQL query: backtick identifiers, double or single quoted string literals, and
+# everything else. Literals and identifiers are never touched by the keyword rewrites below.
+_TOKEN_PATTERN = re.compile(r"`[^`]*`|\"[^\"]*\"|'[^']*'|[^`\"']+")
+_CASELESS_FUNCTIONS = {
+    "caseless_eq": "=",
+    "caseless_ne": "<>",
+    "caseless_one_of": "IN"
+}
+_CLAUSE_KEYWORDS = re.compile(r"\b(WHERE|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT|OFFSET)\b", re.IGNORECASE)
+
+def get_snapshot_path() -> str:
+    path = load_config().get("snapshot", {}).get("path", DEFAULT_SNAPSHOT_PATH)
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(__file__), path)
+    return path
+
+def get_snapshot_version():
+    """The snapshot file's modification time, which stands in for the dataset versions under the
+    snapshot backend (every sync rewrites it), or None if there's no snapshot."""
+    path = get_snapshot_path()
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+def get_table_name(url: str) -> str:
+    """Map a dataset view URL (e.g. .../views/292v-tb9r/query.json) to a local table name."""
+    match = re.search(r"/views/([a-z0-9]{4}-[a-z0-9]{4})", url)
+    if not match:
+        raise ValueError(f"Unrecognized dataset URL {url}")
+    return "view_" + match.group(1).replace("-", "_")
+
+def _split_arguments(text: str) -> list:
+    """Split a function argument list on top-level commas."""
+    arguments = []
+    depth = 0
+    current = ""
+    for token in _TOKEN_PATTERN.findall(text):
+        if token[0] in "`\"'":
+            current += token
+            continue
+        for char in token:
+            if char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            if char == "," and depth == 0:
+                arguments.append(current.strip())
+                current = ""
+            else:
+                current += char
+    arguments.append(current.strip())
+    return arguments
+
+def _find_call_end(sql: str, position: int) -> int:
+    """Find the position just past the closing parenthesis of a call whose arguments start at position.
+
+    Identifiers and literals have already been converted to DuckDB quoting, so only skip over
+    quoted sections."""
+    depth = 1
+    quote_char = None
+    while depth:
+        char = sql[position]
+        if quote_char:
+            if char == quote_char:
+                quote_char = None
+        elif char in "\"'":
+            quote_char = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        position += 1
+    return position
+
+def _rewrite_case_functions(sql: str) -> str:
+    """Rewrite SoQL case(condition, value, ...) calls as CASE WHEN expressions."""
+    pattern = re.compile(r"\bcase\s*\(", re.IGNORECASE)
+    while True:
+        match = pattern.search(sql)
+        if not match:
+            return sql
+        position = _find_call_end(sql, match.end())
+        arguments = _split_arguments(sql[match.end():position - 1])
+        branches = " ".join(f"WHEN {condition} THEN {value}" for condition, value in zip(arguments[::2], arguments[1::2]))
+        sql = f"{sql[:match.start()]}(CASE {branches} END){sql[position:]}"
+
+def _rewrite_caseless_functions(sql: str) -> str:
+    """Rewrite caseless_eq/caseless_ne/caseless_one_of calls as lower()-based comparisons."""
+    pattern = re.compile(r"\b(caseless_eq|caseless_ne|caseless_one_of)\s*\(", re.IGNORECASE)
+    while True:
+        match = pattern.search(sql)
+        if not match:
+            return sql
+
+        position = _find_call_end(sql, match.end())
+        arguments = _split_arguments(sql[match.end():position - 1])
+        column = f"lower(CAST({arguments[0]} AS VARCHAR))"
+        values = [f"lower({value})" for value in arguments[1:]]
+        operator = _CASELESS_FUNCTIONS[match.group(1).lower()]
+        if operator == "IN":
+            replacement = f"({column} IN ({', '.join(values)}))"
+        else:
+            replacement = f"({column} {operator} {values[0]})"
+        sql = sql[:match.start()] + replacement + sql[position:]
+
+def translate_query(query_string: str, table_name: str) -> str:
+    """Translate a SoQL query into DuckDB SQL against the given snapshot table."""
+    converted = []
+    from_inserted = False
+    for token in _TOKEN_PATTERN.findall(query_string):
+        if token.startswith("`"):
+            converted.append('"' + token[1:-1] + '"')
+        elif token.startswith('"'):
+            converted.append("'" + token[1:-1].replace("'", "''") + "'")
+        elif token.startswith("'"):
+            converted.append(token)
+        else:
+            # Snapshot columns are stored as text (just like the portal returns them), so
+            # numeric aggregates need an explicit cast.
+            token = re.sub(r"\bsum\s*\(", "soql_sum(", token, flags=re.IGNORECASE)
+            token = re.sub(r"::\s*number\b", "::DOUBLE", token, flags=re.IGNORECASE)
+            # SoQL has no FROM clause; add one ahead of the first clause after the select list.
+            if not from_inserted:
+                clause = _CLAUSE_KEYWORDS.search(token)
+                if clause:
+                    token = f"{token[:clause.start()]} FROM \"{table_name}\" {token[clause.start():]}"
+                    from_inserted = True
+            converted.append(token)
+
+    sql = "".join(converted)
+    if not from_inserted:
+        sql += f' FROM "{table_name}"'
+    return _rewrite_caseless_functions(_rewrite_case_functions(sql))
+
+def _format_value(value) -> str:
+    """Format a DuckDB value the way the portal's JSON does (everything is a string)."""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def get_connection(read_only: bool = True):
+    """Return the shared DuckDB connection for the snapshot file."""
+    global _connection
+    import duckdb
+
+    with _connection_lock:
+        if _connection is None:
+            path = get_snapshot_path()
+            if read_only and not os.path.exists(path):
+                raise FileNotFoundError(f"Snapshot {path} not found. Run `python snapshot.py sync` first.")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _connection = duckdb.connect(path, read_only=read_only)
+        return _connection
+
+def execute_snapshot_query(url: str, query_string: str):
+    """Execute a SoQL query against the local snapshot, returning rows shaped like the portal's response."""
+    try:
+        connection = get_connection()
+    except Exception as e:
+        return {"error": str(e), "url": url, "query": query_string}
+    return query_connection(connection, url, query_string)
+
+def query_connection(connection, url: str, query_string: str):
+    """Execute a SoQL query against the table for url in any DuckDB connection holding snapshot-shaped tables."""
+    try:
+        sql = translate_query(query_string, get_table_name(url))
+        cursor = connection.cursor()
+        try:
+            # Temporary macros are per-cursor, so define the SoQL helpers on each one.
+            cursor.execute("CREATE OR REPLACE TEMP MACRO soql_sum(x) AS sum(TRY_CAST(x AS DOUBLE))")
+            cursor.execute(sql)
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    except Exception as e:
+        return {"error": str(e), "url": url, "query": query_string}
+
+    # The portal leaves null fields out of each row entirely, so do the same here.
+    return [
+        {column: _format_value(value) for column, value in zip(columns, row) if value is not None}
+        for row in rows
+    ]
+
+def _fetch_rows(url: str, where_clause: str, page_size: int):
+    """Page through every district-level row of a dataset view matching where_clause."""
+    client = get_portal_client()
+    offset = 0
+    while True:
+        query = f"SELECT * WHERE {where_clause} ORDER BY `:id` LIMIT {page_size} OFFSET {offset}"
+        with client.get(build_query_url(url, query), stream=True) as response:
+            rows = list(iter_json_array(response.iter_content(CHUNK_SIZE)))
+        yield rows
+        if len(rows) < page_size:
+            return
+        offset += page_size
+
+def _store_rows(connection, table_name: str, rows: list):
+    """Insert rows into a snapshot table, adding any columns that haven't been seen before."""
+    existing_columns = {row[0] for row in connection.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = ?", [table_name]).fetchall()}
+    columns = []
+    for row in rows:
+        for column in row:
+            if column not in columns:
+                columns.append(column)
+    for column in columns:
+        if column not in existing_columns:
+            connection.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{column}" VARCHAR')
+
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    placeholders = ", ".join("?" for _ in columns)
+    connection.executemany(
+        f'INSERT INTO "{table_name}" ({column_list}) VALUES ({placeholders})',
+        [[row.get(column) for column in columns] for row in rows])
+
+def sync(force: bool = False, log=print) -> dict:
+    """Download district-level rows for every configured dataset view into the snapshot.
+
+    Frozen views are only downloaded once. Live assessment views are fully re-pulled, since they
+    hold just the current year. The multi-year enrollment view only has its most recent school
+    year (and anything newer) re-pulled."""
+    global _connection
+    import duckdb
+
+    config = load_config()
+    page_size = config.get("snapshot", {}).get("page_size", DEFAULT_PAGE_SIZE)
+    live_urls = get_live_urls(config)
+    enrollment_urls = {e["url"] for e in config.get("enrollment_sets", [])}
+    urls = list(dict.fromkeys([a["url"] for a in config.get("assessment_sets", [])] + list(enrollment_urls)))
+
+    # Sync needs a writable connection, so drop any read-only one held by this process.
+    with _connection_lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+    path = get_snapshot_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = duckdb.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS _snapshot_sync (table_name VARCHAR PRIMARY KEY, url VARCHAR, synced_at DOUBLE, row_count BIGINT)")
+
+    summary = {}
+    try:
+        for url in urls:
+            table_name = get_table_name(url)
+            synced = connection.execute("SELECT synced_at FROM _snapshot_sync WHERE table_name = ?", [table_name]).fetchone()
+            if synced and url not in live_urls and not force:
+                log(f"{table_name}: frozen, already synced")
+                summary[table_name] = "skipped"
+                continue
+
+            # Clearing out the old rows happens in the same transaction as loading the new ones, so a
+            # sync that fails part-way leaves the view as it was.
+            connection.execute("BEGIN TRANSACTION")
+            where_clause = "caseless_eq(`organizationlevel`, 'District')"
+            if synced and url in enrollment_urls and not force:
+                latest_school_year = connection.execute(f'SELECT max("schoolyear") FROM "{table_name}"').fetchone()[0]
+                if latest_school_year:
+                    connection.execute(f'DELETE FROM "{table_name}" WHERE "schoolyear" >= ?', [latest_school_year])
+                    where_clause += f" AND `schoolyear` >= '{latest_school_year}'"
+            else:
+                connection.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            connection.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}" ("organizationlevel" VARCHAR)')
+
+            row_count = 0
+            try:
+                for rows in _fetch_rows(url, where_clause, page_size):
+                    if rows:
+                        _store_rows(connection, table_name, rows)
+                    row_count += len(rows)
+                    log(f"{table_name}: {row_count} rows")
+                total_rows = connection.execute(f'SELECT count(*) FROM "{table_name}"').fetchone()[0]
+                connection.execute("INSERT OR REPLACE INTO _snapshot_sync VALUES (?, ?, ?, ?)", [table_name, url, time.time(), total_rows])
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            summary[table_name] = row_count
+    finally:
+        connection.close()
+
+    return summary
+
+def status() -> list:
+    """Describe what is currently stored in the snapshot."""
+    rows = get_connection().execute("SELECT table_name, url, synced_at, row_count FROM _snapshot_sync ORDER BY table_name").fetchall()
+    return [
+        {"table_name": table_name, "url": url, "synced_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(synced_at)), "row_count": row_count}
+        for table_name, url, synced_at, row_count in rows
+    ]
+
+if __name__ == "__main__":
+    load_environment()
+
+    parser = argparse.ArgumentParser(description="Manage the local snapshot of data.wa.gov datasets.")
+    parser.add_argument("command", choices=["sync", "status"])
+    parser.add_argument("--force", action="store_true", help="Re-download every view, including frozen ones.")
+    args = parser.parse_args()
+
+    if args.command == "sync":
+        sync(force=args.force)
+    else:
+        for entry in status():
+            print(f"{entry['table_name']}: {entry['row_count']} rows, synced {entry['synced_at']} ({entry['url']})")
@@ -0,0 +1,43 @@
+"""SQLite connections for the on-disk stores (response cache, precomputed results) that several
+server processes can share.
+
+With the multi-worker launcher every worker process opens the same database files, so a portal
+response fetched by one worker is a cache hit for all the others. The databases use write-ahead
+logging, so readers in one process don't block behind another process's writes, and each process
+opens its own connection: a connection that was inherited across fork() is never used."""
+import os
+import sqlite3
+
+def connect(path: str) -> sqlite3.Connection:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    # With WAL, NORMAL only risks the last commits on power loss, which for a cache is fine.
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+class SharedConnection:
+    """A connection to a shared database file, opened again in any process other than the one that opened it."""
+
+    def __init__(self, path: str, schema: list):
+        self.path = path
+        self._schema = schema
+        self._inherited = []
+        self._open()
+
+    def _open(self):
+        self._pid = os.getpid()
+        self._connection = connect(self.path)
+        for statement in self._schema:
+            self._connection.execute(statement)
+        self._connection.commit()
+
+    def get(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            # Keep the parent's connection referenced rather than closing it: closing it here could
+            # release locks the parent still holds.
+            self._inherited.append(self._connection)
+            self._open()
+        return self._connection
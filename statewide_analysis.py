@@ -0,0 +1,167 @@
+"""Vectorized ranking and trend analysis across every district in the state.
+
+Scores are pivoted into a districts x years matrix per student group, and ranks, percentiles
+and per-district regression slopes are computed with NumPy over the whole matrix at once.
+Used by analyze_trends when multidistrict_set_id is "STATE"."""
+import numpy as np
+
+def build_score_matrices(scores: dict, years: list) -> dict:
+    """Pivot multi-year scores into student_group -> (district_ids, districts x years percent matrix).
+
+    All student groups are built in a single pass over the results. Missing scores (no results,
+    or suppressed with no students) are NaN."""
+    district_positions = {}
+    group_positions = {}
+    cells = []
+    for year_position, year_scores in enumerate(scores.get("results", [])):
+        if year_scores.get("year") not in years:
+            continue
+        year_position = years.index(year_scores.get("year"))
+        for record in year_scores.get("data", []):
+            percent = record.percent_consistent_grade_level
+            cells.append((
+                group_positions.setdefault(record.student_group, len(group_positions)),
+                district_positions.setdefault(record.district_id, len(district_positions)),
+                year_position,
+                np.nan if percent is None else percent
+            ))
+
+    cube = np.full((len(group_positions), len(district_positions), len(years)), np.nan)
+    if cells:
+        groups, districts, columns, values = (np.asarray(a) for a in zip(*cells))
+        cube[groups, districts, columns] = values.astype(float)
+
+    district_ids = np.asarray(list(district_positions), dtype=object)
+    matrices = {}
+    for student_group, group_position in group_positions.items():
+        matrix = cube[group_position]
+        # Only keep districts that have at least one year of data for this group.
+        has_data = ~np.isnan(matrix).all(axis=1)
+        matrices[student_group] = (list(district_ids[has_data]), matrix[has_data])
+    return matrices
+
+def dense_ranks(matrix):
+    """Dense rank (1 = highest) of each column's values. NaN entries get a rank of 0."""
+    ranks = np.zeros(matrix.shape, dtype=np.int64)
+    for column in range(matrix.shape[1]):
+        values = matrix[:, column]
+        present = ~np.isnan(values)
+        if present.any():
+            unique_values, inverse = np.unique(values[present], return_inverse=True)
+            ranks[present, column] = len(unique_values) - inverse
+    return ranks
+
+def percentiles(matrix):
+    """Percentile rank (0-100) of each value within its column, splitting ties evenly. NaN stays NaN."""
+    result = np.full(matrix.shape, np.nan)
+    for column in range(matrix.shape[1]):
+        values = matrix[:, column]
+        present = ~np.isnan(values)
+        count = present.sum()
+        if not count:
+            continue
+        sorted_values = np.sort(values[present])
+        below = np.searchsorted(sorted_values, values[present], side="left")
+        at_or_below = np.searchsorted(sorted_values, values[present], side="right")
+        result[present, column] = (below + 0.5 * (at_or_below - below)) / count * 100
+    return result
+
+def regression_slopes(matrix, years: list):
+    """Least-squares slope (percentage points per year) for each row, ignoring NaN years.
+
+    Rows with fewer than two observed years get a NaN slope."""
+    present = ~np.isnan(matrix)
+    observed = present.sum(axis=1)
+    x = np.broadcast_to(np.asarray(years, dtype=float), matrix.shape)
+    y = np.where(present, matrix, 0.0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = np.where(present, x, 0.0).sum(axis=1) / observed
+        y_mean = y.sum(axis=1) / observed
+        x_centered = np.where(present, x - x_mean[:, None], 0.0)
+        y_centered = np.where(present, y - y_mean[:, None], 0.0)
+        slopes = (x_centered * y_centered).sum(axis=1) / (x_centered ** 2).sum(axis=1)
+    slopes[observed < 2] = np.nan
+    return slopes
+
+def _value(number, digits: int = 2):
+    """Convert a NumPy number to a rounded Python float, or None for NaN."""
+    return None if np.isnan(number) else round(float(number), digits)
+
+def analyze_statewide(scores: dict, first_year: int, last_year: int, focus_district_id: str = None) -> dict:
+    """Rank every district for each year and student group, and compute per-district trends."""
+    years = [r.get("year") for r in scores.get("results", [])]
+    first_position = years.index(first_year) if first_year in years else 0
+    last_position = years.index(last_year) if last_year in years else len(years) - 1
+
+    analysis = { "ranked_results": [], "annual_trends": [] }
+    if focus_district_id:
+        analysis["focus_district"] = { "district_id": focus_district_id, "student_groups": [] }
+
+    matrices = build_score_matrices(scores, years)
+    empty = ([], np.full((0, len(years)), np.nan))
+    for student_group in scores.get("student_groups", []):
+        district_ids, matrix = matrices.get(student_group, empty)
+        ranks = dense_ranks(matrix)
+        percentile_matrix = percentiles(matrix)
+        slopes = regression_slopes(matrix, years)
+        slope_ranks = dense_ranks(slopes[:, None])[:, 0]
+
+        for year_position, year in enumerate(years):
+            present = np.flatnonzero(~np.isnan(matrix[:, year_position]))
+            ordered = present[np.lexsort((present, ranks[present, year_position]))]
+            # Round and convert whole columns at once; building the output is the slowest part otherwise.
+            ranked_data = zip(
+                [district_ids[i] for i in ordered],
+                np.round(matrix[ordered, year_position], 2).tolist(),
+                ranks[ordered, year_position].tolist(),
+                np.round(percentile_matrix[ordered, year_position], 1).tolist()
+            )
+            analysis["ranked_results"].append({
+                "year": year,
+                "student_group": student_group,
+                "district_count": len(ordered),
+                "ranked_data": [
+                    {
+                        "district_id": district_id,
+                        "percent_consistent_grade_level": percent,
+                        "rank": rank,
+                        "percentile": percentile
+                    }
+                    for district_id, percent, rank, percentile in ranked_data
+                ]
+            })
+
+        trends_by_district = []
+        for i in np.flatnonzero(~np.isnan(slopes))[np.argsort(-slopes[~np.isnan(slopes)], kind="stable")]:
+            first_percent = matrix[i, first_position]
+            last_percent = matrix[i, last_position]
+            delta_trend = (last_percent - first_percent) / (last_year - first_year + 1)
+            trends_by_district.append({
+                "district_id": district_ids[i],
+                "first_year_percent": _value(first_percent),
+                "last_year_percent": _value(last_percent),
+                "annual_trend": _value(delta_trend),
+                "regression_slope": _value(slopes[i]),
+                "slope_rank": int(slope_ranks[i])
+            })
+
+        analysis["annual_trends"].append({
+            "student_group": student_group,
+            "first_year": first_year,
+            "last_year": last_year,
+            "trends_by_district": trends_by_district
+        })
+
+        if focus_district_id and focus_district_id in district_ids:
+            i = district_ids.index(focus_district_id)
+            analysis["focus_district"]["student_groups"].append({
+                "student_group": student_group,
+                "ranks_by_year": { str(year): int(ranks[i, p]) or None for p, year in enumerate(years) },
+                "percentiles_by_year": { str(year): _value(percentile_matrix[i, p], 1) for p, year in enumerate(years) },
+                "regression_slope": _value(slopes[i]),
+                "slope_rank": int(slope_ranks[i]) or None,
+                "district_count": len(district_ids)
+            })
+
+    return analysis
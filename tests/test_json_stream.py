@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from json_stream import iter_json_array
+
+ROWS = [
+    {"schoolyear": "2023-24", "districtcode": "17414", "count": "123"},
+    {"districtname": "Café – 東京", "quote": "a \"quoted\" [value], {x}"},
+    [1, 2.5, -3e-2, True, False, None],
+    "text",
+    12.5,
+    -7,
+    1e21,
+    0
+]
+
+def decode(body: bytes, chunk_size: int) -> list:
+    return list(iter_json_array(body[i:i + chunk_size] for i in range(0, len(body), chunk_size)))
+
+@pytest.mark.parametrize("separators", [(",", ":"), (", ", ": ")])
+def test_every_chunk_size_gives_the_same_items(separators):
+    body = json.dumps(ROWS, separators=separators, ensure_ascii=False).encode("utf-8")
+    for chunk_size in range(1, len(body) + 1):
+        assert decode(body, chunk_size) == ROWS
+
+def test_every_split_point_gives_the_same_items():
+    body = json.dumps(ROWS, ensure_ascii=False).encode("utf-8")
+    for split in range(len(body) + 1):
+        assert list(iter_json_array([body[:split], body[split:]])) == ROWS
+
+@pytest.mark.parametrize("body", [b"[12.5]", b"[12.5,3]", b"[1e10, 2E+5, 3.25e-3]", b"[-0.5 ,7.0]", b"[ 10 ]"])
+def test_top_level_numbers_split_after_the_point_or_exponent(body):
+    expected = json.loads(body)
+    for split in range(len(body) + 1):
+        assert list(iter_json_array([body[:split], body[split:]])) == expected
+
+def test_whitespace_and_empty_arrays():
+    assert decode(b"  [ ]  ", 1) == []
+    assert decode(b"[]", 64) == []
+    assert decode(b"\n[\n {\"a\": \"1\"} ,\n {\"a\": \"2\"}\n]\n", 3) == [{"a": "1"}, {"a": "2"}]
+
+def test_no_chunks_is_truncated():
+    with pytest.raises(ValueError, match="Truncated"):
+        list(iter_json_array([]))
+
+@pytest.mark.parametrize("body", [b'{"error": "bad query"}', b'"text"', b"12", b"<html></html>"])
+def test_a_body_that_is_not_an_array_is_rejected(body):
+    with pytest.raises(ValueError, match="Expected a JSON array"):
+        decode(body, 4)
+
+@pytest.mark.parametrize("body", [b"[", b'[{"a": "1"}', b'[{"a": "1"},', b'[{"a": "1"}, {"a": ', b"[12.5"])
+def test_a_truncated_body_is_rejected(body):
+    for chunk_size in (1, 3, len(body)):
+        with pytest.raises(ValueError):
+            decode(body, chunk_size)
+
+def test_items_before_the_truncation_are_yielded():
+    items = iter_json_array([b'[{"a": "1"}, {"a": "2"}, {"a"'])
+    assert next(items) == {"a": "1"}
+    assert next(items) == {"a": "2"}
+    with pytest.raises(ValueError):
+        next(items)
+
+@pytest.mark.parametrize("body", [b'[{"a": "1"} {"a": "2"}]', b"[1,,2]", b"[1] [2]", b"[1]x"])
+def test_malformed_arrays_are_rejected(body):
+    with pytest.raises(ValueError):
+        decode(body, 2)
@@ -0,0 +1,57 @@
+import pytest
+
+from utils import _clause_terms, _find_clauses, add_paging, has_limit
+
+GROUPED_QUERY = """SELECT `schoolyear`, `districtcode`, sum(`count_of_students_expected`) AS `total`
+WHERE caseless_eq(`organizationlevel`, "District")
+GROUP BY `schoolyear`, `districtcode`
+ORDER BY `schoolyear` DESC"""
+
+def test_without_an_offset_only_a_limit_is_added():
+    assert add_paging(GROUPED_QUERY, 100) == GROUPED_QUERY + "\nLIMIT 100"
+    assert add_paging("  SELECT `a`\n", 5) == "SELECT `a`\nLIMIT 5"
+
+def test_order_by_is_extended_with_the_group_by_columns():
+    assert add_paging(GROUPED_QUERY, 100, 200) == """SELECT `schoolyear`, `districtcode`, sum(`count_of_students_expected`) AS `total`
+WHERE caseless_eq(`organizationlevel`, "District")
+GROUP BY `schoolyear`, `districtcode`
+ORDER BY `schoolyear` DESC, `districtcode`
+LIMIT 100 OFFSET 200"""
+
+def test_grouped_query_without_order_by_is_ordered_by_its_group_by_columns():
+    query = "SELECT `schoolyear`, `gradelevel`\nGROUP BY `schoolyear`, `gradelevel`\nHAVING count(`gradelevel`) > 0"
+    assert add_paging(query, 10, 0) == query + "\nORDER BY `schoolyear`, `gradelevel`\nLIMIT 10 OFFSET 0"
+
+def test_ungrouped_query_is_ordered_by_row_id():
+    assert add_paging("SELECT `a` WHERE `b` = 'x'", 10, 20) == "SELECT `a` WHERE `b` = 'x'\nORDER BY `:id`\nLIMIT 10 OFFSET 20"
+    assert add_paging("SELECT `a`\nORDER BY `a`", 10, 20) == "SELECT `a`\nORDER BY `a`, `:id`\nLIMIT 10 OFFSET 20"
+
+def test_columns_already_ordered_are_not_repeated():
+    query = "SELECT `a`, `b`\nGROUP BY `a`, `b`\nORDER BY `b` ASC, `a` DESC"
+    assert add_paging(query, 10, 0) == "SELECT `a`, `b`\nGROUP BY `a`, `b`\nORDER BY `b` ASC, `a` DESC\nLIMIT 10 OFFSET 0"
+
+def test_clause_keywords_inside_literals_are_ignored():
+    query = """SELECT `a`
+WHERE caseless_one_of(`studentgroup`, "Group by ORDER BY", 'limit 5 offset 2', `having`)
+GROUP BY `a`"""
+    assert set(_find_clauses(query)) == {"GROUP BY"}
+    assert not has_limit(query)
+    assert add_paging(query, 10, 30) == query + "\nORDER BY `a`\nLIMIT 10 OFFSET 30"
+
+def test_clause_keywords_are_matched_case_insensitively_across_whitespace():
+    query = "SELECT `a`\ngroup   by `a`\norder\nby `a`"
+    assert set(_find_clauses(query)) == {"GROUP BY", "ORDER BY"}
+    assert add_paging(query, 10, 0) == "SELECT `a`\ngroup   by `a`\nORDER BY `a`\nLIMIT 10 OFFSET 0"
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT `a` LIMIT 5", True),
+    ("SELECT `a` offset 5", True),
+    ("SELECT `a` WHERE `b` = \"LIMIT 5\"", False),
+    ("SELECT `limit`", False)
+])
+def test_has_limit(query, expected):
+    assert has_limit(query) is expected
+
+def test_clause_terms_split_on_top_level_commas_only():
+    query = "SELECT `a` GROUP BY date_trunc_y(`d`, 'x'), `a`, case(`b` = 'y', 1, true, 2) HAVING count(`a`) > 1"
+    assert _clause_terms(query, _find_clauses(query), "GROUP BY") == ["date_trunc_y(`d`, 'x')", "`a`", "case(`b` = 'y', 1, true, 2)"]
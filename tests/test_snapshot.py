@@ -0,0 +1,139 @@
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+
+import enrollment_tools
+import snapshot
+import utils
+from assessment_sets import DEFAULT_SCHEMA, AssessmentSet, StudentGroupAliases
+from snapshot import get_table_name, query_connection, translate_query
+
+ASSESSMENT_URL = "https://data.wa.gov/api/v3/views/test-0001/query.json"
+ENROLLMENT_URL = utils.load_config()["enrollment_sets"][0]["url"]
+
+ASSESSMENT_COLUMNS = ["schoolyear", "organizationlevel", "districtcode", "districtname", "studentgroup", "studentgrouptype", "gradelevel",
+                      "testadministration", "testsubject", "count_consistent_grade_level", "count_of_students_expected", "DAT"]
+ASSESSMENT_ROWS = [
+    ("2023-24", "District", "17414", "Lake Washington", "All Students", "All", "03", "SBAC", "ELA", "600", "1000", "None"),
+    ("2023-24", "District", "17414", "Lake Washington", "All Students", "All", "03", "AIM", "ELA", "NULL", "10", "None"),
+    ("2023-24", "district", "17405", "Bellevue", "TwoorMoreRaces", "Race", "03", "sbac", "ela", "50", "80", "None"),
+    ("2023-24", "District", "17414", "Lake Washington", "All Students", "All", "04", "SBAC", "ELA", "300", "500", "None"),
+    ("2023-24", "District", "17414", "Lake Washington", "All Students", "All", "03", "SBAC", "Math", "400", "1000", "None"),
+    ("2023-24", "District", "17414", "Lake Washington", "Low-Income", "Income", "03", "SBAC", "ELA", "100", "200", "None"),
+    ("2023-24", "School", "17414", "Lake Washington", "All Students", "All", "03", "SBAC", "ELA", "60", "100", "None"),
+    ("2022-23", "District", "17414", "Lake Washington", "All Students", "All", "03", "SBAC", "ELA", "550", "990", "None"),
+    ("2023-24", "District", "6117", "Issaquah", "All Students", "All", "03", "SBAC", "ELA", "700", "1000", "None")
+]
+
+ENROLLMENT_COLUMNS = ["schoolyear", "organizationlevel", "districtcode", "districtname", "gradelevel", "all_students", "low_income"]
+ENROLLMENT_ROWS = [
+    ("2017-18", "District", "17414", "Lake Washington", "Kindergarten", "100", "20"),
+    ("2017-18", "District", "17414", "Lake Washington", "Half-day Kindergarten", "10", "10"),
+    ("2018-19", "District", "17414", "Lake Washington", "1st Grade", "105", "NULL"),
+    ("2019-20", "District", "17414", "Lake Washington", "2nd Grade", "98", "25"),
+    ("2019-20", "School", "17414", "Lake Washington", "2nd Grade", "50", "5"),
+    ("2019-20", "District", "17414", "Lake Washington", "3rd Grade", "90", "18"),
+    ("2019-20", "District", "17405", "Bellevue", "2nd Grade", "70", "7")
+]
+
+def sorted_rows(rows: list) -> list:
+    return sorted(rows, key=lambda row: sorted(row.items()))
+
+@pytest.fixture
+def connection():
+    connection = duckdb.connect(":memory:")
+    for url, columns, rows in [(ASSESSMENT_URL, ASSESSMENT_COLUMNS, ASSESSMENT_ROWS), (ENROLLMENT_URL, ENROLLMENT_COLUMNS, ENROLLMENT_ROWS)]:
+        table = get_table_name(url)
+        column_definitions = ", ".join(f'"{column}" VARCHAR' for column in columns)
+        connection.execute(f'CREATE TABLE "{table}" ({column_definitions})')
+        connection.executemany(f'INSERT INTO "{table}" VALUES ({", ".join("?" for _ in columns)})', rows)
+    yield connection
+    connection.close()
+
+@pytest.fixture
+def assessment_set():
+    return AssessmentSet(2024, ASSESSMENT_URL, DEFAULT_SCHEMA)
+
+def test_identifiers_literals_and_from_clause():
+    assert translate_query('SELECT `a`, `b` WHERE `c` = "It\'s" ORDER BY `a`', "view_x") == \
+        'SELECT "a", "b"  FROM "view_x" WHERE "c" = \'It\'\'s\' ORDER BY "a"'
+    assert translate_query("SELECT `a`", "view_x") == 'SELECT "a" FROM "view_x"'
+    assert translate_query("SELECT `a` LIMIT 5", "view_x") == 'SELECT "a"  FROM "view_x" LIMIT 5'
+
+def test_caseless_functions():
+    assert translate_query('SELECT `a` WHERE caseless_eq(`d`, "X") AND caseless_ne(`e`, "Y")', "view_x") == \
+        'SELECT "a"  FROM "view_x" WHERE (lower(CAST("d" AS VARCHAR)) = lower(\'X\')) AND (lower(CAST("e" AS VARCHAR)) <> lower(\'Y\'))'
+    assert translate_query('SELECT `a` WHERE caseless_one_of(`s`, "x, y", \'z\')', "view_x") == \
+        'SELECT "a"  FROM "view_x" WHERE (lower(CAST("s" AS VARCHAR)) IN (lower(\'x, y\'), lower(\'z\')))'
+
+def test_case_number_cast_and_sum():
+    assert translate_query('SELECT sum(case(caseless_eq(`n`, "NULL"), 0, true, `n`::number)) AS `m` GROUP BY `a`', "view_x") == \
+        'SELECT soql_sum((CASE WHEN (lower(CAST("n" AS VARCHAR)) = lower(\'NULL\')) THEN 0 WHEN true THEN "n"::DOUBLE END)) AS "m"  FROM "view_x" GROUP BY "a"'
+
+def test_keywords_inside_literals_and_identifiers_are_left_alone():
+    assert translate_query('SELECT `sum(x)` WHERE caseless_one_of(`s`, "x where y", "GROUP BY", "sum(1)::number")', "view_x") == \
+        'SELECT "sum(x)"  FROM "view_x" WHERE (lower(CAST("s" AS VARCHAR)) IN (lower(\'x where y\'), lower(\'GROUP BY\'), lower(\'sum(1)::number\')))'
+
+def test_scores_query(connection, assessment_set):
+    query = assessment_set.build_query(
+        school_years="2023-24",
+        district_filter='\n  AND caseless_one_of(`districtcode`, "17414","17405")',
+        tests='SBAC","AIM',
+        subject="ELA",
+        grade=3,
+        student_groups=StudentGroupAliases({"TwoorMoreRaces": "Two Or More Races"}).query_list(("All Students", "Two Or More Races"))
+    )
+    expected = [
+        {"schoolyear": "2023-24", "organizationlevel": "District", "districtcode": "17414", "districtname": "Lake Washington", "studentgroup": "All Students",
+         "studentgrouptype": "All", "gradelevel": "03", "testadministration": "SBAC", "testsubject": "ELA", "count_consistent_grade_level": "600",
+         "count_of_students_expected": "1000", "DAT": "None"},
+        {"schoolyear": "2023-24", "organizationlevel": "District", "districtcode": "17414", "districtname": "Lake Washington", "studentgroup": "All Students",
+         "studentgrouptype": "All", "gradelevel": "03", "testadministration": "AIM", "testsubject": "ELA", "count_consistent_grade_level": "NULL",
+         "count_of_students_expected": "10", "DAT": "None"},
+        {"schoolyear": "2023-24", "organizationlevel": "district", "districtcode": "17405", "districtname": "Bellevue", "studentgroup": "TwoorMoreRaces",
+         "studentgrouptype": "Race", "gradelevel": "03", "testadministration": "sbac", "testsubject": "ela", "count_consistent_grade_level": "50",
+         "count_of_students_expected": "80", "DAT": "None"}
+    ]
+    assert sorted_rows(query_connection(connection, ASSESSMENT_URL, query)) == sorted_rows(expected)
+
+def test_scores_query_with_renamed_columns(connection):
+    connection.execute(f'ALTER TABLE "{get_table_name(ASSESSMENT_URL)}" RENAME COLUMN count_consistent_grade_level TO countmetstandard')
+    assessment_set = AssessmentSet(2024, ASSESSMENT_URL, {**DEFAULT_SCHEMA, "met_standard_column": "countmetstandard"})
+    query = assessment_set.build_query(school_years="2023-24", district_filter="", tests="SBAC", subject="Math", grade=3, student_groups="All Students")
+    rows = query_connection(connection, ASSESSMENT_URL, query)
+    assert [(row["districtcode"], row["count_consistent_grade_level"], row["count_of_students_expected"]) for row in rows] == [("17414", "400", "1000")]
+
+def test_grid_query(connection, assessment_set):
+    query = assessment_set.build_grid_query(
+        school_year="2023-24",
+        district_filter='\n  AND caseless_one_of(`districtcode`, "17414","17405")',
+        tests='SBAC","AIM',
+        subjects='ELA","Math',
+        grades=[3, 4],
+        student_groups='All Students","TwoorMoreRaces'
+    )
+    expected = [
+        {"districtcode": "17414", "studentgroup": "All Students", "testsubject": "ELA", "gradelevel": "03", "count_consistent_grade_level": "600", "count_of_students_expected": "1010"},
+        {"districtcode": "17414", "studentgroup": "All Students", "testsubject": "ELA", "gradelevel": "04", "count_consistent_grade_level": "300", "count_of_students_expected": "500"},
+        {"districtcode": "17414", "studentgroup": "All Students", "testsubject": "Math", "gradelevel": "03", "count_consistent_grade_level": "400", "count_of_students_expected": "1000"},
+        {"districtcode": "17405", "studentgroup": "TwoorMoreRaces", "testsubject": "ela", "gradelevel": "03", "count_consistent_grade_level": "50", "count_of_students_expected": "80"}
+    ]
+    assert sorted_rows(query_connection(connection, ASSESSMENT_URL, query)) == sorted_rows(expected)
+
+def test_cohort_enrollment_query(connection, monkeypatch):
+    # The real enrollment query, answered by the snapshot backend from the test table.
+    monkeypatch.setenv("WA_ED_DATA_BACKEND", "snapshot")
+    monkeypatch.setattr(snapshot, "_connection", connection)
+    enrollment = enrollment_tools.get_cohort_enrollment([2030], ["17414", "17405"], ["All Students", "Low Income"])
+    assert enrollment == {"districts": {
+        "17405": {"districtname": "Bellevue", "enrollment": {(2020, 2): {"all_students": 70, "low_income": 7}}},
+        "17414": {"districtname": "Lake Washington", "enrollment": {
+            (2018, 0): {"all_students": 110, "low_income": 30},
+            (2019, 1): {"all_students": 105},
+            (2020, 2): {"all_students": 98, "low_income": 25}
+        }}
+    }}
+
+def test_query_errors_are_returned(connection):
+    result = query_connection(connection, ASSESSMENT_URL, "SELECT `no_such_column`")
+    assert result["error"] and result["url"] == ASSESSMENT_URL
@@ -1,15 +1,58 @@
+import contextlib
+import contextvars
+import io
 import os
-import requests
-from urllib.parse import quote
+import re
+import threading
+import time
+from urllib.parse import quote, urlsplit
 import json
+import metrics
 
+# requests, dotenv, the response cache and the portal client are imported on first use rather
+# than here, so that the MCP server can finish its stdio handshake without paying for them.
 
 CONFIG_FILE_NAME = "wa-ed-config.json"
+DEFAULT_CACHE_PATH = ".cache/responses.sqlite3"
+DEFAULT_PAGE_SIZE = 50000
+
+# Quoted strings and identifiers, and the SoQL clauses that can follow WHERE, for adding paging to queries.
+_LITERAL_PATTERN = re.compile(r"(\"[^\"]*\"|'[^']*'|`[^`]*`)")
+_CLAUSE_PATTERN = re.compile(r"\b(GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT|OFFSET)\b", re.IGNORECASE)
+
+# Encodes rows for the response cache the same way ResponseCache.put does.
+_row_encoder = json.JSONEncoder(separators=(",", ":"))
+
+_config = None
+_environment_loaded = False
+_response_cache = None
+_dataset_ttls = None
+_portal_client = None
+_single_flight = None
+_query_transport = None
+_precomputed_store = None
+_catalog = None
+_view_versions = {}
+_datasets_used = contextvars.ContextVar("datasets_used", default=None)
+_cancelled = contextvars.ContextVar("cancelled", default=None)
+_init_lock = threading.Lock()
 
 def load_config() -> dict:
-    config_file = os.path.join(os.path.dirname(__file__), CONFIG_FILE_NAME)
-    with open(config_file) as f:
-        return json.load(f)
+    """Load wa-ed-config.json. The file is only read once; every module shares the same dict."""
+    global _config
+    if _config is None:
+        config_file = os.path.join(os.path.dirname(__file__), CONFIG_FILE_NAME)
+        with open(config_file) as f:
+            _config = json.load(f)
+    return _config
+
+def load_environment():
+    """Load environment variables from .env (e.g. DATA_PORTAL_APP_TOKEN), once, on first use."""
+    global _environment_loaded
+    if not _environment_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _environment_loaded = True
 
 def get_school_year(year: int) -> str:
     """Convert a year to a school year string."""
@@ -37,14 +80,492 @@ def get_grade_as_string(grade: int, all_values_for_k: bool = True) -> str:
     else:
         return []
 
-def execute_query(url: str, query_string: str) -> dict:
-    query = f"{url}?app_token={os.getenv('DATA_PORTAL_APP_TOKEN')}&query={quote(query_string)}"
-    response = requests.get(query, timeout=10)
+def get_grade_from_string(grade_str: str) -> int:
+    """Convert a grade level string from the enrollment dataset (e.g. "3rd Grade", "Half-day Kindergarten") to a number."""
+    if "kindergarten" in grade_str.lower():
+        return 0
+    digits = "".join(c for c in grade_str.split(" ")[0] if c.isdigit())
+    return int(digits) if digits else None
+
+def get_portal_client():
+    """Return the process-wide pooled HTTP client for the data portal."""
+    global _portal_client
+    with _init_lock:
+        if _portal_client is not None:
+            return _portal_client
+        from portal_client import PortalClient
+        portal_config = load_config().get("portal", {})
+        _portal_client = PortalClient(
+            pool_size=portal_config.get("pool_size", 10),
+            timeout=portal_config.get("timeout_seconds", 10),
+            max_retries=portal_config.get("max_retries", 3),
+            backoff_base=portal_config.get("backoff_base_seconds", 0.5),
+            backoff_max=portal_config.get("backoff_max_seconds", 8),
+            requests_per_second=portal_config.get("requests_per_second", 5),
+            burst=portal_config.get("burst", 10)
+        )
+    return _portal_client
+
+def get_single_flight():
+    """Return the process-wide single-flight group used to coalesce identical in-flight queries."""
+    global _single_flight
+    with _init_lock:
+        if _single_flight is None:
+            from single_flight import SingleFlight
+            # A cancelled call only gives up on its own behalf; calls sharing its query fetch it themselves.
+            _single_flight = SingleFlight(retry_on=(ToolCancelled,))
+    return _single_flight
+
+def get_response_cache():
+    """Return the process-wide response cache, or None if caching is disabled in the config."""
+    global _response_cache
+    with _init_lock:
+        if _response_cache is not None:
+            return _response_cache
+        cache_config = load_config().get("response_cache", {})
+        if not cache_config.get("enabled", True):
+            return None
+        from response_cache import ResponseCache
+        path = cache_config.get("path", DEFAULT_CACHE_PATH)
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(__file__), path)
+        _response_cache = ResponseCache(path, int(cache_config.get("max_size_mb", 256) * 1024 * 1024))
+    return _response_cache
+
+def get_precomputed_store():
+    """Return the process-wide store of precomputed tool results, or None if precomputing is disabled in the config."""
+    global _precomputed_store
+    with _init_lock:
+        if _precomputed_store is not None:
+            return _precomputed_store
+        precompute_config = load_config().get("precompute", {})
+        if not precompute_config.get("enabled", True):
+            return None
+        from precompute import DEFAULT_STORE_PATH, PrecomputedStore
+        path = precompute_config.get("path", DEFAULT_STORE_PATH)
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(__file__), path)
+        _precomputed_store = PrecomputedStore(path)
+    return _precomputed_store
+
+def get_catalog():
+    """Return the process-wide catalog of tests, student groups and years offered by each dataset view."""
+    global _catalog
+    with _init_lock:
+        if _catalog is not None:
+            return _catalog
+        from catalog import DEFAULT_CATALOG_PATH, DEFAULT_VERSION_CHECK_SECONDS, DatasetCatalog
+        catalog_config = load_config().get("catalog", {})
+        path = catalog_config.get("path", DEFAULT_CATALOG_PATH)
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(__file__), path)
+        _catalog = DatasetCatalog(path, catalog_config.get("version_check_seconds", DEFAULT_VERSION_CHECK_SECONDS))
+    return _catalog
+
+def get_live_urls(config: dict = None) -> set:
+    """Dataset URLs that can still change: the latest assessment year's view and the enrollment views."""
+    config = config or load_config()
+    latest_year = config.get("latest_assessment_year", 2025)
+    urls = {a["url"] for a in config.get("assessment_sets", []) if a["year"] >= latest_year}
+    urls.update(e["url"] for e in config.get("enrollment_sets", []))
+    return urls
+
+def get_dataset_ttl(url: str):
+    """Get the cache TTL in seconds for a dataset URL. None means the data is frozen and never expires.
+
+    A dataset is considered live if it backs the latest assessment year or any enrollment set,
+    since those are the only views OSPI still updates. An explicit cache_ttl_seconds on an
+    assessment or enrollment set overrides the default for that set's URL."""
+    global _dataset_ttls
+    if _dataset_ttls is None:
+        config = load_config()
+        cache_config = config.get("response_cache", {})
+        current_ttl = cache_config.get("current_ttl_seconds", 3600)
+        frozen_ttl = cache_config.get("frozen_ttl_seconds", None)
+        latest_year = config.get("latest_assessment_year", 2025)
+
+        ttls = {}
+        def add_ttl(dataset_url, ttl):
+            # When several sets share a URL, the shortest TTL wins (None is "forever").
+            if dataset_url not in ttls or ttls[dataset_url] is None:
+                ttls[dataset_url] = ttl
+            elif ttl is not None:
+                ttls[dataset_url] = min(ttls[dataset_url], ttl)
+
+        for assessment_set in config.get("assessment_sets", []):
+            default_ttl = current_ttl if assessment_set["year"] >= latest_year else frozen_ttl
+            add_ttl(assessment_set["url"], assessment_set.get("cache_ttl_seconds", default_ttl))
+        for enrollment_set in config.get("enrollment_sets", []):
+            add_ttl(enrollment_set["url"], enrollment_set.get("cache_ttl_seconds", current_ttl))
+        _dataset_ttls = (ttls, current_ttl)
+
+    ttls, current_ttl = _dataset_ttls
+    # Unknown URLs are treated like live data rather than cached forever.
+    return ttls.get(url, current_ttl)
+
+def get_data_backend() -> str:
+    """Get the configured data backend: "portal" (live data.wa.gov queries) or "snapshot" (local DuckDB file)."""
+    load_environment()
+    return os.getenv("WA_ED_DATA_BACKEND") or load_config().get("data_backend", "portal")
+
+def build_query_url(url: str, query_string: str) -> str:
+    """Build the full portal request URL for a SoQL query against a dataset view."""
+    load_environment()
+    return f"{url}?app_token={os.getenv('DATA_PORTAL_APP_TOKEN')}&query={quote(query_string)}"
+
+def get_view_id(url: str) -> str:
+    """Get the dataset view ID (e.g. "292v-tb9r") from a portal query URL."""
+    parts = url.split("/views/", 1)
+    return parts[1].split("/", 1)[0] if len(parts) == 2 else url
+
+def get_view_last_modified(url: str):
+    """Get when a dataset view's rows were last updated (the rowsUpdatedAt Unix time from the portal's
+    view metadata), or None if the metadata can't be fetched.
+
+    With a query transport set (see set_query_transport), the transport's get_view_version(url) is
+    asked instead, if it has one; otherwise the version is unknown and the portal isn't contacted."""
+    if _query_transport is not None:
+        get_view_version = getattr(_query_transport, "get_view_version", None)
+        return get_view_version(url) if get_view_version is not None else None
+    return fetch_view_last_modified(url)
+
+def fetch_view_last_modified(url: str):
+    """Ask the data.wa.gov portal for a dataset view's rowsUpdatedAt (see get_view_last_modified)."""
+    import requests
+    parts = urlsplit(url)
+    metadata_url = f"{parts.scheme}://{parts.netloc}/api/views/{get_view_id(url)}.json"
+    try:
+        with get_portal_client().get(metadata_url) as response:
+            return response.json().get("rowsUpdatedAt")
+    except (requests.exceptions.RequestException, ValueError, AttributeError):
+        return None
+
+def get_current_view_version(url: str, max_age_seconds: float):
+    """Get a dataset view's current version (see get_view_last_modified), asking the portal at most
+    once every max_age_seconds. The last answer is shared by everything checking the same view."""
+    now = time.monotonic()
+    with _init_lock:
+        checked = _view_versions.get(url)
+    if checked is not None and now - checked[0] < max_age_seconds:
+        return checked[1]
+
+    version = get_view_last_modified(url)
+    with _init_lock:
+        _view_versions[url] = (now, version)
+    return version
+
+@contextlib.contextmanager
+def track_datasets():
+    """Collect the URL of every dataset queried inside the block (including from worker threads
+    running in a copy of the context): `with track_datasets() as urls: ...`"""
+    urls = set()
+    token = _datasets_used.set(urls)
+    try:
+        yield urls
+    finally:
+        _datasets_used.reset(token)
+
+class ToolCancelled(Exception):
+    """Raised in a tool's worker thread when the tool call it is working for has been cancelled."""
+
+@contextlib.contextmanager
+def cancellation_scope():
+    """Give the block (and worker threads running in a copy of its context) a cancellation flag.
+
+    Once the yielded threading.Event is set, the next query made on the block's behalf raises
+    ToolCancelled instead of going to the portal."""
+    cancelled = threading.Event()
+    token = _cancelled.set(cancelled)
+    try:
+        yield cancelled
+    finally:
+        _cancelled.reset(token)
+
+def check_cancelled():
+    """Raise ToolCancelled if the current tool call has been cancelled."""
+    cancelled = _cancelled.get()
+    if cancelled is not None and cancelled.is_set():
+        raise ToolCancelled()
+
+def is_error(result) -> bool:
+    """Check whether a query result is an error dict."""
+    return isinstance(result, dict) and "error" in result
+
+class RowTap:
+    """Counts the rows a parser reads from a query response and, given max_bytes, encodes them as they
+    pass into the JSON array body that the response cache stores."""
+
+    def __init__(self, max_bytes: int = None):
+        self.rows = 0
+        self.complete = False
+        self._max_bytes = max_bytes
+        self._body = io.BytesIO() if max_bytes is not None else None
+
+    def tap(self, rows):
+        for row in rows:
+            if self._body is not None:
+                self._body.write(b"," if self.rows else b"[")
+                self._body.write(_row_encoder.encode(row).encode("utf-8"))
+                if self._body.tell() > self._max_bytes:
+                    # Too large to cache, so there's no point holding on to it.
+                    self._body = None
+            self.rows += 1
+            yield row
+        self.complete = True
+
+    def parse(self, parse, rows):
+        """Return parse(rows), with the rows passing through the tap."""
+        return parse(self.tap(rows))
+
+    def body(self):
+        """The encoded rows, or None if the parser stopped before the last row or they're too large to cache."""
+        if not self.complete or self._body is None:
+            return None
+        if not self.rows:
+            self._body.write(b"[")
+        self._body.write(b"]")
+        return self._body.getbuffer()
+
+def execute_query(url: str, query_string: str, parse=list):
+    """Run a SoQL query against a dataset view and return parse(rows), or an error dict.
+
+    parse takes an iterable of the response's rows (dicts of strings) and builds what the caller
+    needs from them, e.g. records.parse_score_rows. Rows from the portal or the response cache are
+    decoded one at a time as parse reads them, so unless parse keeps them (as the default, list,
+    does) a large response is never held as a list of row dicts. parse should be a module-level
+    function: identical queries in flight at the same time share one fetch and its parsed result
+    only when they're parsed by the same function."""
+    check_cancelled()
+    datasets_used = _datasets_used.get()
+    if datasets_used is not None:
+        datasets_used.add(url)
+
+    with metrics.span("query", dataset=get_view_id(url)) as query_span:
+        if get_data_backend() == "snapshot":
+            import snapshot
+            result = snapshot.execute_snapshot_query(url, query_string)
+            query_span.set(cache="snapshot")
+            if is_error(result):
+                return result
+            tap = RowTap()
+            result = tap.parse(parse, result)
+            query_span.set(rows=tap.rows)
+            return result
+
+        cache = get_response_cache()
+        if cache is not None:
+            tap = RowTap()
+            cached_response = cache.get(url, query_string, lambda rows: tap.parse(parse, rows))
+            if cached_response is not None:
+                query_span.set(cache="hit", rows=tap.rows)
+                return cached_response
+
+        # Identical queries that are already on their way to the portal (e.g. from parallel tool
+        # calls) share that request and its result rather than sending another one. Only the
+        # caller that actually sends the request gets to mark the span as a miss.
+        from response_cache import make_cache_key
+        query_span.set(cache="coalesced")
+        result = get_single_flight().do((make_cache_key(url, query_string), parse), fetch_query, url, query_string, cache, parse)
+        if is_error(result):
+            query_span.set(error=result["error"])
+        return result
+
+def set_query_transport(transport):
+    """Replace the portal HTTP request with transport(url, query_string) -> response, or restore it with None.
+
+    Used by the benchmarks to record portal responses and replay them (or synthetic ones) offline.
+    The response cache and single-flight layers still apply on top of the transport. Dataset view
+    metadata lookups go to the transport too (see get_view_last_modified)."""
+    global _query_transport
+    _query_transport = transport
+
+def fetch_query(url: str, query_string: str, cache=None, parse=list):
+    """Send a query to the portal (or the configured transport) and return parse(rows), storing
+    successful responses in the cache."""
+    if cache is not None:
+        # Another server process sharing the cache may already be fetching the same query.
+        tap = RowTap()
+        shared_response = cache.claim(url, query_string, check_cancelled=check_cancelled, parse=lambda rows: tap.parse(parse, rows))
+        if shared_response is not None:
+            metrics.annotate(cache="shared", rows=tap.rows)
+            return shared_response
+
+    metrics.annotate(cache="miss")
     try:
-        response.raise_for_status() 
-    except requests.exceptions.HTTPError as e:
-        return {"error": str(e), "url": query, "query": query_string, "status_code": response.status_code}
-    except requests.exceptions.RequestException as e:
-        return {"error": str(e), "url": query, "query": query_string}
+        if _query_transport is not None:
+            response = _query_transport(url, query_string)
+            if is_error(response):
+                return response
+            # Only cache successful responses; errors should be retried on the next call.
+            if cache is not None:
+                cache.put(url, query_string, response, get_dataset_ttl(url))
+            tap = RowTap()
+            result = tap.parse(parse, response)
+            metrics.annotate(rows=tap.rows)
+            return result
+
+        taps = []
+        def parse_and_record(rows):
+            # A fresh tap for every pass over the rows, since a paged query can start over.
+            taps.append(RowTap(cache.max_bytes if cache is not None else None))
+            return taps[-1].parse(parse, rows)
+
+        result = fetch_from_portal(url, query_string, parse_and_record)
+        if is_error(result):
+            return result
+        metrics.annotate(rows=taps[-1].rows)
+        body = taps[-1].body()
+        if cache is not None and body is not None:
+            cache.put_body(url, query_string, body, get_dataset_ttl(url))
+    finally:
+        if cache is not None:
+            # A claim that can't be released expires on its own, and waiting processes pick up the
+            # response from the cache regardless, so a failure here mustn't replace the fetch's own outcome.
+            with contextlib.suppress(Exception):
+                cache.release(url, query_string)
+    return result
+
+def _find_clauses(query_string: str) -> dict:
+    """Locate the GROUP BY, HAVING, ORDER BY, LIMIT and OFFSET clauses of a SoQL query: name -> (start, end of keyword)."""
+    masked = _LITERAL_PATTERN.sub(lambda m: " " * len(m.group()), query_string)
+    return {" ".join(m.group(1).upper().split()): (m.start(), m.end()) for m in _CLAUSE_PATTERN.finditer(masked)}
+
+def _clause_terms(query_string: str, clauses: dict, name: str) -> list:
+    """Split the body of a clause (e.g. the column list of a GROUP BY) into its comma-separated terms."""
+    start, end = clauses[name]
+    clause_end = min([s for s, _ in clauses.values() if s > start], default=len(query_string))
+    terms, depth, term_start = [], 0, end
+    for i in range(end, clause_end):
+        if query_string[i] == "(":
+            depth += 1
+        elif query_string[i] == ")":
+            depth -= 1
+        elif query_string[i] == "," and depth == 0:
+            terms.append(query_string[term_start:i].strip())
+            term_start = i + 1
+    terms.append(query_string[term_start:clause_end].strip())
+    return [term for term in terms if term]
+
+def has_limit(query_string: str) -> bool:
+    """Check whether a SoQL query sets its own LIMIT or OFFSET."""
+    clauses = _find_clauses(query_string)
+    return "LIMIT" in clauses or "OFFSET" in clauses
+
+def add_paging(query_string: str, limit: int, offset: int = None) -> str:
+    """Add a LIMIT to a SoQL query, or with an offset, one page of the query in a stable order.
+
+    Paged results are only consistent from one page to the next if the rows are fully ordered, so
+    the existing ORDER BY (if any) is extended with the GROUP BY columns, or with the row ID for
+    queries that aren't grouped."""
+    query_string = query_string.strip()
+    if offset is None:
+        return f"{query_string}\nLIMIT {limit}"
+
+    clauses = _find_clauses(query_string)
+    order_terms = _clause_terms(query_string, clauses, "ORDER BY") if "ORDER BY" in clauses else []
+    tie_breakers = _clause_terms(query_string, clauses, "GROUP BY") if "GROUP BY" in clauses else ["`:id`"]
+    ordered = {term.split()[0].lower() for term in order_terms}
+    order_terms += [term for term in tie_breakers if term.lower() not in ordered]
+
+    # ORDER BY is the last clause of a query without LIMIT/OFFSET, so everything before it stays as written.
+    if "ORDER BY" in clauses:
+        query_string = query_string[:clauses["ORDER BY"][0]].rstrip()
+    return f"{query_string}\nORDER BY {', '.join(order_terms)}\nLIMIT {limit} OFFSET {offset}"
+
+class PortalError(Exception):
+    """A portal request that failed part-way through reading its rows, with the error dict to return."""
+
+    def __init__(self, error: dict):
+        super().__init__(error["error"])
+        self.error = error
+
+def fetch_from_portal(url: str, query_string: str, parse=list):
+    """Send a query to the data.wa.gov portal and return parse(rows), or an error dict.
+
+    Rows are decoded as the response streams in and handed to parse one at a time, rather than
+    after buffering the whole body. Queries that don't set their own LIMIT are paged, so a result
+    larger than the portal's page size is fetched in full instead of being cut off."""
+    if has_limit(query_string):
+        return _parse_portal_rows(parse, iter_portal_page(url, query_string, query_string))
+
+    # Most results fit in a single page, so try that first without changing the row order.
+    page_size = load_config().get("portal", {}).get("page_size", DEFAULT_PAGE_SIZE)
+    first_page_rows = 0
+    def first_page():
+        nonlocal first_page_rows
+        with contextlib.closing(iter_portal_page(url, query_string, add_paging(query_string, page_size))) as page:
+            for row in page:
+                first_page_rows += 1
+                yield row
+
+    result = _parse_portal_rows(parse, first_page())
+    if first_page_rows < page_size:
+        return result
+
+    # The first page was full. Unordered pages aren't guaranteed to line up with each other,
+    # so start again and page through the whole result in a stable order.
+    del result
+    def all_pages():
+        offset = 0
+        while True:
+            check_cancelled()
+            page_rows = 0
+            with contextlib.closing(iter_portal_page(url, query_string, add_paging(query_string, page_size, offset))) as page:
+                for row in page:
+                    page_rows += 1
+                    yield row
+            if page_rows < page_size:
+                return
+            offset += page_size
+
+    return _parse_portal_rows(parse, all_pages())
+
+def _parse_portal_rows(parse, rows):
+    """Return parse(rows) for rows coming from the portal, or the error dict if a request fails."""
+    with contextlib.closing(rows):
+        try:
+            return parse(rows)
+        except PortalError as e:
+            return e.error
+
+def iter_portal_page(url: str, query_string: str, page_query: str):
+    """Send one request to the portal and yield its rows, decoding the JSON array as it arrives.
+    Raises PortalError if the request fails."""
+    import requests
+    from json_stream import CHUNK_SIZE, iter_json_array
+    query = build_query_url(url, page_query)
+    error = None
+    with metrics.span("portal_request") as request_span:
+        try:
+            response = get_portal_client().get(query, stream=True)
+        except requests.exceptions.HTTPError as e:
+            e.response.close()
+            request_span.set(status_code=e.response.status_code)
+            error = {"error": str(e), "url": query, "query": query_string, "status_code": e.response.status_code}
+        except requests.exceptions.RequestException as e:
+            error = {"error": str(e), "url": query, "query": query_string}
+
+        if error is None:
+            request_span.set(status_code=response.status_code)
+            received = 0
+            def chunks():
+                nonlocal received
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    received += len(chunk)
+                    yield chunk
 
-    return response.json()
\ No newline at end of file
+            rows = 0
+            try:
+                with response:
+                    for row in iter_json_array(chunks()):
+                        rows += 1
+                        yield row
+            except requests.exceptions.RequestException as e:
+                error = {"error": str(e), "url": query, "query": query_string}
+            except ValueError as e:
+                error = {"error": f"Invalid JSON in portal response: {e}", "url": query, "query": query_string}
+            finally:
+                request_span.set(bytes=received, rows=rows)
+    # Raised once the request's span has closed, so it's timed like any other failed request.
+    if error is not None:
+        raise PortalError(error)
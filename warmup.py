@@ -0,0 +1,192 @@
+"""Optional background warm-up of the response cache when the server starts.
+
+Without it, the first analyze_trends call of a session pays for every portal query and for
+opening connections to the portal. When "warmup" is enabled in wa-ed-config.json, the server
+starts a background thread that first opens a few pooled connections to the portal (by asking
+for dataset metadata), then runs the configured subjects and grades for the DEFAULT multidistrict
+set and the focus district over the latest few years, so their query responses are in the
+response cache. The thread waits delay_seconds before doing anything, so that it isn't
+competing with the server's own startup and the MCP handshake isn't held up. A tool call that
+arrives while the same query is being warmed shares that request rather than sending another
+one. Progress is reported by get_server_stats.
+
+With several worker processes (see workers.py), the cache warm-up runs once, in the supervisor
+process, since the workers share the cache. Pooled connections belong to the process that opens
+them, so every worker opens its own (start_connections) and the supervisor, which never serves
+requests, opens none."""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from utils import get_data_backend, get_live_urls, get_response_cache, get_view_last_modified, load_config
+
+DEFAULT_WARMUP = {
+    "enabled": False,
+    "delay_seconds": 1,
+    "preopen_connections": 4,
+    "years": 4,
+    "subjects": ["ELA", "Math"],
+    "grades": [3, 8],
+    "student_groups": ["All Students", "Low-Income"]
+}
+
+class WarmUpProgress:
+    """Thread-safe progress of the warm-up: its state, and how many calls have finished."""
+
+    def __init__(self):
+        self.state = "not started"
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self.connections_opened = 0
+        self.current = None
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, value)
+
+    def count(self, outcome: str):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            elapsed = None
+            if self.started_at is not None:
+                elapsed = round((self.finished_at or time.time()) - self.started_at, 2)
+            return {
+                "state": self.state,
+                "completed": self.completed,
+                "failed": self.failed,
+                "total": self.total,
+                "current": self.current,
+                "connections_opened": self.connections_opened,
+                "elapsed_seconds": elapsed
+            }
+
+_progress = WarmUpProgress()
+
+def get_warmup_config(config: dict = None) -> dict:
+    return {**DEFAULT_WARMUP, **(config or load_config()).get("warmup", {})}
+
+def get_warmup_calls(config: dict, tools: dict) -> list:
+    """The (description, function, arguments) calls that warm the cache, most likely to be needed first.
+
+    tools maps "analyze_trends" and "get_district_scores" to the server's tool functions. They're
+    passed in rather than imported, because when the server is started as a script, importing
+    server here would load a second copy of it."""
+    warmup_config = get_warmup_config(config)
+    focus_district_id = config.get("focus_district_id", "17414")
+    latest_year = config.get("latest_assessment_year", 2025)
+    calls = []
+    for subject in warmup_config["subjects"]:
+        for grade in warmup_config["grades"]:
+            calls.append((f"analyze_trends DEFAULT {subject} grade {grade}", tools["analyze_trends"].__wrapped__, {
+                "focus_district_id": focus_district_id,
+                "multidistrict_set_id": "DEFAULT",
+                "subject": subject,
+                "grade": grade,
+                "student_groups": warmup_config["student_groups"],
+                "yearspan": warmup_config["years"]
+            }))
+            calls.append((f"get_district_scores {focus_district_id} {subject} grade {grade}", tools["get_district_scores"].__wrapped__, {
+                "district_ids": [focus_district_id],
+                "subject": subject,
+                "grade": grade,
+                "student_groups": warmup_config["student_groups"],
+                "year": latest_year
+            }))
+    return calls
+
+def open_connections(config: dict, count: int) -> int:
+    """Open up to count pooled portal connections by fetching dataset metadata in parallel. Returns how many succeeded."""
+    # The live views first: their metadata is also what the precomputed results check against.
+    urls = sorted(get_live_urls(config)) + sorted({a["url"] for a in config.get("assessment_sets", [])} - get_live_urls(config))
+    urls = urls[:count]
+    if not urls:
+        return 0
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        return sum(version is not None for version in executor.map(get_view_last_modified, urls))
+
+def _begin(warmup_config: dict) -> bool:
+    """Wait out the configured delay and mark the warm-up as running. Returns False if there's nothing to warm."""
+    if warmup_config["delay_seconds"]:
+        _progress.update(state="waiting")
+        time.sleep(warmup_config["delay_seconds"])
+    _progress.update(state="running", started_at=time.time())
+
+    if get_data_backend() == "snapshot":
+        # Nothing to warm: queries are answered from the local snapshot.
+        _progress.update(state="skipped (snapshot backend)", finished_at=time.time())
+        return False
+    return True
+
+def _open_connections(config: dict, warmup_config: dict):
+    with metrics.span("warmup_connections") as connections_span:
+        opened = open_connections(config, warmup_config["preopen_connections"])
+        connections_span.set(connections=opened)
+    _progress.update(connections_opened=opened)
+
+def run(tools: dict, config: dict = None, preopen_connections: bool = True):
+    """Open portal connections (unless preopen_connections is False), then make every warm-up call in
+    turn, recording progress."""
+    config = config or load_config()
+    warmup_config = get_warmup_config(config)
+    if not _begin(warmup_config):
+        return
+    if preopen_connections:
+        _open_connections(config, warmup_config)
+
+    if get_response_cache() is None:
+        _progress.update(state="done (response cache disabled)", finished_at=time.time())
+        return
+
+    calls = get_warmup_calls(config, tools)
+    _progress.update(total=len(calls))
+    for description, function, arguments in calls:
+        _progress.update(current=description)
+        try:
+            with metrics.span("warmup", call=description):
+                result = function(**arguments)
+        except Exception as e:
+            # A failed warm-up call only means the first real call does the work instead.
+            result = {"error": str(e)}
+        _progress.count("failed" if isinstance(result, dict) and "error" in result else "completed")
+    _progress.update(state="done", current=None, finished_at=time.time())
+
+def run_connections(config: dict = None):
+    """Only open this process's portal connections, recording progress."""
+    config = config or load_config()
+    warmup_config = get_warmup_config(config)
+    if not _begin(warmup_config):
+        return
+    _open_connections(config, warmup_config)
+    _progress.update(state="done (connections only)", finished_at=time.time())
+
+def _start_thread(config: dict, target, *args):
+    if not get_warmup_config(config)["enabled"]:
+        _progress.update(state="disabled")
+        return None
+    thread = threading.Thread(target=target, args=args, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+def start(tools: dict, config: dict = None, preopen_connections: bool = True):
+    """Start the warm-up of the given tools (see get_warmup_calls) in a background thread if it's enabled
+    in the config. Returns the thread, or None."""
+    config = config or load_config()
+    return _start_thread(config, run, tools, config, preopen_connections)
+
+def start_connections(config: dict = None):
+    """Start opening this process's portal connections in a background thread if the warm-up is enabled
+    in the config, without warming the cache (e.g. in a worker process, see workers.py). Returns the thread, or None."""
+    config = config or load_config()
+    return _start_thread(config, run_connections, config)
+
+def stats() -> dict:
+    return _progress.stats()
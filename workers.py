@@ -0,0 +1,45 @@
+"""Multi-worker serving: several server processes behind one HTTP port.
+
+One server process runs the CPU work of every tool call (aggregating, ranking and laying out
+results) under one GIL, so under load from several clients the calls queue behind each other.
+`python server.py --transport streamable-http --workers 4` instead starts uvicorn's process
+supervisor, which binds the port once and spawns that many worker processes to accept
+connections on it, restarting any worker that dies. Each worker is a complete server with its
+own event loop, worker threads and portal connections, so the CPU work of simultaneous calls
+runs in parallel in separate processes.
+
+The workers share the on-disk state: the response cache and precomputed results (SQLite, see
+sqlite_store) and the dataset catalog. A response fetched by one worker is a cache hit for every
+other, and a worker that needs a query another worker is already fetching waits for that
+response instead of sending the query again (ResponseCache.claim). The start-up warm-up of the
+cache runs once, in the supervisor process, and fills the shared cache for all of them; each worker
+opens its own pooled portal connections, since connections can't be shared between processes.
+
+The workers serve stateless streamable HTTP: any worker can answer any request, since there are
+no sessions tied to one process. Metrics, get_server_stats and the in-memory parts of the
+caches are per worker."""
+import os
+
+import uvicorn
+
+import warmup
+
+APP_FACTORY = "workers:create_app"
+
+def create_app():
+    """The ASGI app for one worker process."""
+    import server
+    server.configure_http(os.environ.get("WA_ED_HTTP_HOST", "127.0.0.1"), int(os.environ.get("WA_ED_HTTP_PORT", 8000)), stateless=True)
+    warmup.start_connections()
+    return server.mcp.streamable_http_app()
+
+def serve(workers: int, host: str = "127.0.0.1", port: int = 8000, app_factory: str = APP_FACTORY, log_level: str = "info", warmup_tools: dict = None):
+    """Serve the tools over streamable HTTP from workers processes, until interrupted. warmup_tools are
+    the server's tools for the warm-up to call (see warmup.get_warmup_calls); without them there's no warm-up."""
+    # The spawned workers inherit these and use them to configure their apps.
+    os.environ["WA_ED_HTTP_HOST"] = host
+    os.environ["WA_ED_HTTP_PORT"] = str(port)
+    if warmup_tools is not None:
+        # The supervisor never serves requests, so it only warms the shared cache.
+        warmup.start(warmup_tools, preopen_connections=False)
+    uvicorn.run(app_factory, factory=True, host=host, port=port, workers=workers, log_level=log_level)